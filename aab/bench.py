@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+"""
+Benchmarks on synthetic add-on projects
+"""
+
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from . import PATH_PACKAGE, __version__
+
+BENCH_MODULE_NAME = "bench_addon"
+BENCH_VERSION = "v1.0.0"
+# Marks work directories that aab bench may clear on subsequent runs
+BENCH_WORKDIR_MARKER = ".aab-bench"
+PHASES = ("create_dist", "build_dist", "package_dist")
+
+_template_module = '''\
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic module {index}
+"""
+
+from typing import List
+
+
+class Item{index}:
+    def __init__(self, values: List[int]):
+        self.values = values
+
+    def total(self) -> int:
+        return sum(value * {index} for value in self.values)
+
+{functions}
+'''
+
+_template_function = '''\
+def function_{index}_{number}(value: int) -> int:
+    """Returns a transformed value"""
+    return (value * {number} + {index}) % 97
+'''
+
+_template_form = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<ui version="4.0">
+ <class>Form{index}</class>
+ <widget class="QDialog" name="Form{index}">
+  <property name="windowTitle">
+   <string>Form {index}</string>
+  </property>
+  <layout class="QVBoxLayout" name="verticalLayout">
+{items}
+  </layout>
+ </widget>
+{resources}
+ <connections/>
+</ui>
+"""
+
+_template_form_label = """\
+   <item>
+    <widget class="QLabel" name="label_{number}">
+     <property name="text">
+      <string>Label {number}</string>
+     </property>
+    </widget>
+   </item>"""
+
+_template_form_icon_label = """\
+   <item>
+    <widget class="QLabel" name="label_{number}">
+     <property name="pixmap">
+      <pixmap resource="../resources/bench.qrc">:/bench/icons/icon_{icon}.svg</pixmap>
+     </property>
+    </widget>
+   </item>"""
+
+_template_form_resources = """\
+ <resources>
+  <include location="../resources/bench.qrc"/>
+ </resources>"""
+
+_template_icon = """\
+<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100">\
+<circle cx="50" cy="50" r="{radius}"/></svg>
+"""
+
+
+@dataclass
+class BenchmarkSpec:
+    """Shape of the synthetic add-on project to benchmark"""
+
+    source_files: int = 50
+    forms: int = 10
+    widgets_per_form: int = 20
+    qrc_entries: int = 20
+    assets: int = 10
+    asset_size_kb: int = 256
+    targets: Tuple[str, ...] = ("qt6", "qt5")
+
+
+def generate_project(path: Path, spec: BenchmarkSpec, seed: int = 0) -> Tuple[int, int]:
+    """Writes a synthetic add-on repository to path and commits it to Git
+
+    Returns:
+        tuple -- Number of files and total size in bytes of the project
+    """
+    rng = random.Random(seed)
+    module_path = path / "src" / BENCH_MODULE_NAME
+    files: Dict[Path, bytes] = {}
+
+    addon_properties = {
+        "display_name": "Benchmark Add-on",
+        "module_name": BENCH_MODULE_NAME,
+        "repo_name": "bench-addon",
+        "ankiweb_id": "0",
+        "author": "aab",
+        "conflicts": [],
+        "targets": list(spec.targets),
+    }
+    files[path / "addon.json"] = json.dumps(addon_properties, indent=2).encode()
+    files[path / "LICENSE"] = b"Synthetic benchmark project\n"
+
+    files[module_path / "__init__.py"] = b"".join(
+        "from . import module_{}  # noqa: F401\n".format(index).encode()
+        for index in range(spec.source_files)
+    )
+    for index in range(spec.source_files):
+        functions = "\n\n".join(
+            _template_function.format(index=index, number=number)
+            for number in range(20)
+        )
+        files[module_path / "module_{}.py".format(index)] = _template_module.format(
+            index=index, functions=functions
+        ).encode()
+
+    for index in range(spec.assets):
+        # Half of the assets compress well, the other half does not
+        size = spec.asset_size_kb * 1024
+        data = rng.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+        if index % 2:
+            data = data[:64] * (len(data) // 64)
+        files[module_path / "assets" / "asset_{}.bin".format(index)] = data
+
+    if spec.qrc_entries:
+        qrc_files = []
+        for index in range(spec.qrc_entries):
+            files[path / "resources" / "icons" / "icon_{}.svg".format(index)] = (
+                _template_icon.format(radius=10 + index % 40).encode()
+            )
+            qrc_files.append("    <file>icons/icon_{}.svg</file>".format(index))
+        files[path / "resources" / "bench.qrc"] = (
+            '<RCC>\n  <qresource prefix="/bench">\n{}\n  </qresource>\n</RCC>\n'.format(
+                "\n".join(qrc_files)
+            ).encode()
+        )
+
+    for index in range(spec.forms):
+        items = []
+        for number in range(spec.widgets_per_form):
+            if spec.qrc_entries and number % 4 == 0:
+                items.append(
+                    _template_form_icon_label.format(
+                        number=number, icon=(index + number) % spec.qrc_entries
+                    )
+                )
+            else:
+                items.append(_template_form_label.format(number=number))
+        files[path / "designer" / "form_{}.ui".format(index)] = _template_form.format(
+            index=index,
+            items="\n".join(items),
+            resources=_template_form_resources if spec.qrc_entries else "",
+        ).encode()
+
+    for file_path, content in files.items():
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(content)
+
+    git = ["git", "-c", "user.name=aab", "-c", "user.email=aab@localhost"]
+    for command in (
+        ["git", "init", "-q"],
+        ["git", "add", "-A"],
+        git + ["commit", "-q", "-m", "Synthetic benchmark project"],
+        ["git", "tag", BENCH_VERSION],
+    ):
+        subprocess.run(command, cwd=path, check=True)
+
+    return len(files), sum(len(content) for content in files.values())
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class BenchmarkRunner:
+    """
+    Runs the create/build/package phases of aab on a synthetic project
+
+    Every phase is run as a separate aab process, just like in build scripts,
+    so timings include interpreter startup and reflect the real CLI.
+    """
+
+    def __init__(
+        self,
+        spec: BenchmarkSpec,
+        iterations: int = 5,
+        phase_args: Optional[Dict[str, List[str]]] = None,
+    ):
+        self._spec = spec
+        self._iterations = iterations
+        self._phase_args = phase_args or {}
+
+    def run(self, workdir: Optional[Path] = None) -> Dict[str, Any]:
+        if workdir is not None:
+            return self._run(self._prepare_workdir(workdir))
+        with tempfile.TemporaryDirectory(prefix="aab-bench-") as tmpdir:
+            return self._run(Path(tmpdir))
+
+    def _prepare_workdir(self, workdir: Path) -> Path:
+        """Returns an empty directory at or below workdir to generate the
+        project in. Only directories created by aab bench are ever cleared."""
+        if workdir.exists() and not workdir.is_dir():
+            logging.error("Error: %s is not a directory", workdir)
+            sys.exit(1)
+        if (workdir / BENCH_WORKDIR_MARKER).is_file():
+            shutil.rmtree(str(workdir))
+        elif workdir.exists() and any(workdir.iterdir()):
+            project_path = Path(tempfile.mkdtemp(prefix="aab-bench-", dir=str(workdir)))
+            logging.info(
+                "%s is not empty and was not created by aab bench. Using %s instead.",
+                workdir,
+                project_path,
+            )
+            workdir = project_path
+        workdir.mkdir(parents=True, exist_ok=True)
+        (workdir / BENCH_WORKDIR_MARKER).touch()
+        return workdir
+
+    def _run(self, project_path: Path) -> Dict[str, Any]:
+        logging.info("Generating synthetic project in %s...", project_path)
+        file_count, total_size = generate_project(project_path, self._spec)
+
+        timings: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+
+        for iteration in range(1, self._iterations + 1):
+            logging.info("Iteration %s/%s...", iteration, self._iterations)
+            for phase in PHASES:
+                timings[phase].append(self._run_phase(phase, project_path))
+
+        phases = {
+            phase: self._summarize(durations, file_count, total_size)
+            for phase, durations in timings.items()
+        }
+
+        return {
+            "aab_version": __version__,
+            "python_version": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "iterations": self._iterations,
+            "spec": asdict(self._spec),
+            "project": {"files": file_count, "bytes": total_size},
+            "phases": phases,
+        }
+
+    def _run_phase(self, phase: str, project_path: Path) -> float:
+        command = [
+            sys.executable,
+            "-m",
+            "aab.cli",
+            phase,
+            BENCH_VERSION,
+            *self._phase_args.get(phase, []),
+        ]
+        env = dict(os.environ)
+        # Make sure that the aab under test is the one running the benchmark
+        env["PYTHONPATH"] = os.pathsep.join(
+            filter(None, (str(PATH_PACKAGE.parent), env.get("PYTHONPATH")))
+        )
+
+        start = time.perf_counter()
+        result = subprocess.run(
+            command,
+            cwd=project_path,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        duration = time.perf_counter() - start
+
+        if result.returncode != 0:
+            logging.error("Error while running benchmark phase '%s':", phase)
+            logging.error(result.stdout.decode("utf-8", errors="replace"))
+            sys.exit(1)
+
+        logging.debug("%s took %.3fs", phase, duration)
+        return duration
+
+    def _summarize(
+        self, durations: List[float], file_count: int, total_size: int
+    ) -> Dict[str, Any]:
+        median = statistics.median(durations)
+        return {
+            "runs": durations,
+            "min": min(durations),
+            "median": median,
+            "p95": percentile(durations, 95),
+            "files_per_second": file_count / median if median else None,
+            "mb_per_second": total_size / 1024**2 / median if median else None,
+        }
+
+
+def format_results(results: Dict[str, Any]) -> str:
+    lines = [
+        "{:<14} {:>9} {:>9} {:>9} {:>10}".format(
+            "Phase", "min", "median", "p95", "MiB/s"
+        )
+    ]
+    for phase, summary in results["phases"].items():
+        lines.append(
+            "{:<14} {:>8.3f}s {:>8.3f}s {:>8.3f}s {:>10.2f}".format(
+                phase,
+                summary["min"],
+                summary["median"],
+                summary["p95"],
+                summary["mb_per_second"] or 0,
+            )
+        )
+    return "\n".join(lines)
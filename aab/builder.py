@@ -35,26 +35,61 @@ Main Add-on Builder
 
 import logging
 import os
-import shutil
 import sys
-import zipfile
-from typing import List
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
 
 from . import PATH_DIST, PATH_PROJECT_ROOT
+from .cache import FileCache
 from .config import Config
+from .copying import CopyEngine
 from .git import Git
 from .manifest import ManifestUtils
+from .packaging import CompressionPolicy, PackageWriter, ZipEntryStore
+from .staging import ContentStore
+from .tracing import span
 from .ui import QtVersion, UIBuilder
-from .utils import call_shell, copy_recursively, purge
+from .utils import call_shell, purge, remove_tree_in_background
 
 _trash_patterns = ["*.pyc", "*.pyo", "__pycache__"]
 
+# only these end up in packages
+_paths_packaged_sources = [PATH_PROJECT_ROOT / "src"]
 
-def clean_repo():
+# needs to be on the same filesystem as PATH_DIST for hard links to work
+PATH_CONTENT_STORE = PATH_PROJECT_ROOT / "build" / ".aab" / "objects"
+# same here, so that the dist tree can be moved out of the way
+PATH_TRASH = PATH_PROJECT_ROOT / "build" / ".aab" / "trash"
+
+
+def clean_repo(keep_dist: bool = False):
+    """
+    Keyword Arguments:
+        keep_dist {bool} -- Leave the dist tree in place, e.g. for incremental
+                            exports of the working tree (default: {False})
+    """
     logging.info("Cleaning repository...")
-    if PATH_DIST.exists():
-        shutil.rmtree(str(PATH_DIST))
-    purge(".", _trash_patterns, recursive=True)
+    if not keep_dist:
+        # Deleting large trees can take a while, so let the build go ahead
+        remove_tree_in_background(PATH_DIST, PATH_TRASH)
+    for path in _paths_packaged_sources:
+        purge(
+            path,
+            _trash_patterns,
+            recursive=True,
+            exclude=_list_ignored_directories(path),
+        )
+
+
+def _list_ignored_directories(path: Path) -> List[Path]:
+    """Git-ignored directories below path, e.g. virtual environments"""
+    command = "git ls-files -z --others --ignored --exclude-standard --directory"
+    output = call_shell('{} -- "{}"'.format(command, path), error_exit=False)
+    if not output:
+        return []
+    return [
+        PATH_PROJECT_ROOT / entry for entry in output.split("\0") if entry.endswith("/")
+    ]
 
 
 class AddonBuilder:
@@ -62,33 +97,97 @@ class AddonBuilder:
     _paths_licenses = [PATH_DIST, PATH_DIST / "resources"]
     _path_optional_icons = PATH_PROJECT_ROOT / "resources" / "icons" / "optional"
     _path_changelog = PATH_DIST / "CHANGELOG.md"
-
-    def __init__(self, version=None, callback_archive=None):
-        self._version = Git().parse_version(version)
+    _max_indexed_packages = 5
+
+    def __init__(
+        self,
+        version=None,
+        callback_archive=None,
+        jobs: int = 1,
+        in_process: bool = False,
+        use_cache: bool = False,
+        reproducible: bool = False,
+        untracked_files: bool = True,
+        link_files: bool = False,
+        config: Optional[Config] = None,
+        git: Optional[Git] = None,
+    ):
+        """
+        Keyword Arguments:
+            config {Config} -- Already loaded project config to use instead of
+                               reading addon.json again (default: {None})
+            git {Git} -- Git interface to share with the caller. It is left
+                         open on close() and its untracked_files setting takes
+                         precedence. (default: {None})
+        """
+        # Shared by all build steps so that Git metadata is only resolved once
+        self._owns_git = git is None
+        self._git = git or Git(untracked_files=untracked_files)
+        self._version = self._git.parse_version(version)
         # git stash create comes up empty when no changes were made since the
         # last commit. Don't use 'dev' as version in these cases.
-        git_status = call_shell("git status --porcelain")
-        if self._version == "dev" and git_status == "":
-            self._version = Git().parse_version("current")
+        if self._version == "dev" and not self._git.snapshot().is_dirty:
+            self._version = self._git.parse_version("current")
         if not self._version:
             logging.error("Error: Version could not be determined through Git")
             sys.exit(1)
         self._callback_archive = callback_archive
-        self._config = Config()
+        self._content_store: Optional[ContentStore] = None
+        if link_files and callback_archive:
+            # Archive callbacks might modify staged files in place
+            logging.warning(
+                "Warning: Linking files is not supported with archive callbacks."
+                " Copying files instead."
+            )
+        elif link_files:
+            self._content_store = ContentStore(PATH_CONTENT_STORE)
+        self._jobs = jobs
+        self._in_process = in_process
+        self._form_cache = FileCache.user_cache("forms") if use_cache else None
+        self._zip_entry_store = ZipEntryStore()
+        self._indexed_previous_packages = False
+        self._source_date = self._get_source_date() if reproducible else None
+        self._config = config or Config()
         self._path_dist_module = PATH_DIST / "src" / self._config["module_name"]
 
+    def close(self):
+        """Releases the Git process and package files held open by the builder"""
+        if self._owns_git:
+            self._git.close()
+        self._zip_entry_store.close()
+
     def build(self, qt_versions: List[QtVersion], disttype="local", pyenv=None):
+        return self.build_variants(
+            qt_versions=qt_versions, disttypes=[disttype], pyenv=pyenv
+        )[0]
+
+    def build_variants(
+        self, qt_versions: List[QtVersion], disttypes: List[str], pyenv=None
+    ) -> List[Path]:
+        """Builds the dist tree once and packages it for each distribution type
+
+        Variants only differ in their manifest, so the source tree is exported,
+        post-processed and compiled a single time.
+        """
         logging.info(
             "\n--- Building %s %s for %s ---\n",
             self._config["display_name"],
             self._version,
-            disttype,
+            ", ".join(disttypes),
         )
 
         self.create_dist()
-        self.build_dist(qt_versions=qt_versions, disttype=disttype, pyenv=pyenv)
+        self.build_dist(qt_versions=qt_versions, disttype=disttypes[0], pyenv=pyenv)
+
+        out_paths = []
+        for index, disttype in enumerate(disttypes):
+            if index > 0:
+                self._write_manifest(disttype)
+            out_paths.append(
+                self.package_dist(qt_versions=qt_versions, disttype=disttype)
+            )
 
-        return self.package_dist(qt_versions=qt_versions, disttype=disttype)
+        return out_paths
 
     def create_dist(self):
         logging.info(
@@ -97,36 +196,49 @@ class AddonBuilder:
             self._version,
         )
 
-        clean_repo()
+        with span("create_dist"):
+            with span("clean"):
+                # Dev builds are exported from the working tree, which only
+                # updates files that changed since the last export
+                clean_repo(keep_dist=self._version == "dev")
 
-        PATH_DIST.mkdir(parents=True)
-        Git().archive(self._version, PATH_DIST)
+            PATH_DIST.mkdir(parents=True, exist_ok=True)
+            with span("export source tree"):
+                self._git.archive(self._version, PATH_DIST, store=self._content_store)
 
     def build_dist(self, qt_versions: List[QtVersion], disttype="local", pyenv=None):
-        self._copy_licenses()
-        if self._path_changelog.exists():
-            self._copy_changelog()
-        if self._path_optional_icons.exists():
-            self._copy_optional_icons()
-        if self._callback_archive:
-            self._callback_archive()
-
-        self._write_manifest(disttype)
-
-        ui_builder = UIBuilder(dist=PATH_DIST, config=self._config)
-
-        should_create_qt_shim: bool = False
-        for qt_version in qt_versions:
-            if ui_builder.build(qt_version=qt_version, pyenv=pyenv):
-                should_create_qt_shim = True
-
-        if should_create_qt_shim:
-            logging.info("Writing Qt compatibility shim...")
-            ui_builder.create_qt_shim()
-            logging.info("Done.")
+        with span("build_dist", disttype=disttype):
+            with span("copy additional files"), CopyEngine() as copier:
+                self._copy_licenses(copier)
+                if self._path_changelog.exists():
+                    self._copy_changelog(copier)
+                if self._path_optional_icons.exists():
+                    self._copy_optional_icons(copier)
+                logging.debug(copier.wait().summary())
+            if self._callback_archive:
+                with span("archive callback"):
+                    self._callback_archive()
+
+            self._write_manifest(disttype)
+
+            ui_builder = UIBuilder(
+                dist=PATH_DIST,
+                config=self._config,
+                jobs=self._jobs,
+                in_process=self._in_process,
+                form_cache=self._form_cache,
+                timestamp=self._source_date,
+            )
+
+            try:
+                with span("build ui"):
+                    ui_builder.build_targets(qt_versions=qt_versions, pyenv=pyenv)
+            finally:
+                ui_builder.close()
 
     def package_dist(self, qt_versions: List[QtVersion], disttype="local"):
-        return self._package(qt_versions, disttype)
+        with span("package {disttype}".format(disttype=disttype)):
+            return self._package(qt_versions, disttype)
 
     def _package(self, qt_versions: List[QtVersion], disttype):
         logging.info("Packaging add-on...")
@@ -147,45 +259,98 @@ class AddonBuilder:
 
         out_path = PATH_PROJECT_ROOT / "build" / out_name
 
-        if out_path.exists():
-            out_path.unlink()
+        self._index_previous_packages()
 
-        with zipfile.ZipFile(str(out_path), "w", zipfile.ZIP_DEFLATED) as myzip:
-            rootlen = len(str(to_zip)) + 1
-            for root, dirs, files in os.walk(str(to_zip)):
-                for file in files:
-                    path = os.path.join(root, file)
-                    myzip.write(path, path[rootlen:])
+        policy = CompressionPolicy.from_config(config.get("compression", {}))
 
+        with PackageWriter(
+            out_path,
+            store=self._zip_entry_store,
+            policy=policy,
+            source_date=self._source_date,
+        ) as writer:
+            writer.write_files(self._iter_package_files(to_zip))
+
+        logging.info(writer.stats.summary())
         logging.info("Package saved as {out_name}".format(out_name=out_name))
         logging.info("Done.")
 
         return out_path
 
-    def _write_manifest(self, disttype):
-        ManifestUtils.generate_and_write_manifest(
-            addon_properties=self._config,
-            version=self._version,
-            dist_type=disttype,
-            target_dir=self._path_dist_module,
+    def _iter_package_files(self, to_zip: Path) -> Iterator[Tuple[Path, str]]:
+        rootlen = len(str(to_zip)) + 1
+        for root, dirs, files in os.walk(str(to_zip)):
+            # Sort in place to walk directories in a deterministic order
+            dirs.sort()
+            for file in sorted(files):
+                path = os.path.join(root, file)
+                yield Path(path), path[rootlen:]
+
+    def _index_previous_packages(self):
+        """Makes compressed entries of earlier packages available for reuse"""
+        if self._indexed_previous_packages:
+            return
+        self._indexed_previous_packages = True
+        if self._source_date is not None:
+            # Earlier packages might have been compressed with different
+            # settings or zlib versions, so reproducible builds only reuse
+            # entries produced within the same run
+            return
+        previous_packages = sorted(
+            (PATH_PROJECT_ROOT / "build").glob(
+                "{repo_name}-*.ankiaddon".format(repo_name=self._config["repo_name"])
+            ),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True,
         )
+        for path in previous_packages[: self._max_indexed_packages]:
+            logging.debug("Indexing previous package %s", path.name)
+            self._zip_entry_store.index_archive(path)
+
+    def _get_source_date(self) -> int:
+        """Timestamp to stamp reproducible builds with, following
+        https://reproducible-builds.org/specs/source-date-epoch/"""
+        source_date_epoch = os.environ.get("SOURCE_DATE_EPOCH")
+        if source_date_epoch:
+            try:
+                return int(source_date_epoch)
+            except ValueError:
+                logging.error(
+                    "Error: SOURCE_DATE_EPOCH is not a valid Unix timestamp: %s",
+                    source_date_epoch,
+                )
+                sys.exit(1)
+        return self._git.modtime(self._version)
 
-    def _copy_licenses(self):
+    def _write_manifest(self, disttype):
+        with span("write manifest", disttype=disttype):
+            ManifestUtils.generate_and_write_manifest(
+                addon_properties=self._config,
+                version=self._version,
+                dist_type=disttype,
+                target_dir=self._path_dist_module,
+                git=self._git,
+            )
+
+    # Targets are replaced rather than written to by CopyEngine, so files
+    # linked to the content store are safe without making them private first
+
+    def _copy_licenses(self, copier: CopyEngine):
         logging.info("Copying licenses...")
         for path in self._paths_licenses:
             if not path.is_dir():
                 continue
             for file in path.glob("LICENSE*"):
                 target = self._path_dist_module / "{stem}.txt".format(stem=file.stem)
-                shutil.copyfile(str(file), str(target))
+                copier.copy_file(file, target)
 
-    def _copy_changelog(self):
+    def _copy_changelog(self, copier: CopyEngine):
         logging.info("Copying changelog...")
-        target = self._path_dist_module / "CHANGELOG.md"
-        shutil.copy(str(self._path_changelog), str(target))
+        copier.copy_file(self._path_changelog, self._path_dist_module / "CHANGELOG.md")
 
-    def _copy_optional_icons(self):
+    def _copy_optional_icons(self, copier: CopyEngine):
         logging.info("Copying additional icons...")
-        copy_recursively(
-            self._path_optional_icons, PATH_DIST / "resources" / "icons" / ""
+        copier.copy_tree(
+            self._path_optional_icons,
+            PATH_DIST / "resources" / "icons" / self._path_optional_icons.name,
         )
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+"""
+Persistent user-level file cache
+"""
+
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+
+ENV_CACHE_DIR = "AAB_CACHE_DIR"
+ENV_CACHE_SIZE = "AAB_CACHE_SIZE_MB"
+
+DEFAULT_CACHE_SIZE_MB = 256
+
+
+def get_user_cache_path() -> Path:
+    """Returns the root of aab's user cache, e.g. ~/.cache/aab"""
+    custom_path = os.environ.get(ENV_CACHE_DIR)
+    if custom_path:
+        return Path(custom_path).expanduser()
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    base_path = Path(xdg_cache_home) if xdg_cache_home else Path.home() / ".cache"
+    return base_path / "aab"
+
+
+def hash_key(*parts: Union[str, bytes]) -> str:
+    """Combines key parts into a single hex digest usable as a cache key"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+class FileCache:
+    """
+    Content-addressed file store with size-capped LRU eviction
+
+    Entries are stored under the hex key they were added with. Every hit
+    updates the modification time of an entry, which serves as its LRU
+    timestamp during eviction.
+    """
+
+    def __init__(self, path: Path, max_size: int = DEFAULT_CACHE_SIZE_MB * 1024**2):
+        self._path = path
+        self._max_size = max_size
+
+    @classmethod
+    def user_cache(cls, namespace: str) -> "FileCache":
+        max_size_mb = int(os.environ.get(ENV_CACHE_SIZE, DEFAULT_CACHE_SIZE_MB))
+        return cls(get_user_cache_path() / namespace, max_size=max_size_mb * 1024**2)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def get(self, key: str) -> Optional[Path]:
+        entry = self._entry_path(key)
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def retrieve(self, key: str, target: Path, link: bool = False) -> bool:
+        """Places a copy of the entry at target. Returns False on cache misses.
+
+        With link=True, the entry is hard-linked into place where possible.
+        Callers are then responsible for never modifying target in place.
+        """
+        entry = self.get(key)
+        if entry is None:
+            return False
+        if target.exists() or target.is_symlink():
+            target.unlink()
+        try:
+            if link:
+                try:
+                    os.link(entry, target)
+                    return True
+                except OSError:
+                    pass
+            shutil.copyfile(entry, target)
+        except FileNotFoundError:
+            # evicted by a concurrent process
+            return False
+        return True
+
+    def store(self, key: str, source: Path):
+        with source.open("rb") as f:
+            self._store_fileobj(key, f)
+
+    def store_bytes(self, key: str, data: bytes):
+        self._store_fileobj(key, io.BytesIO(data))
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits its size cap"""
+        entries = []
+        total_size = 0
+        for entry in self._path.glob("*/*"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+            total_size += stat.st_size
+
+        if total_size <= self._max_size:
+            return
+
+        logging.debug("Evicting entries from cache at %s...", self._path)
+        entries.sort()
+        for _, size, entry in entries:
+            if total_size <= self._max_size:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def _store_fileobj(self, key: str, fileobj: BinaryIO):
+        entry = self._entry_path(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=entry.parent, prefix=".tmp-", delete=False
+        ) as f:
+            shutil.copyfileobj(fileobj, f)
+        os.replace(f.name, entry)
+
+    def _entry_path(self, key: str) -> Path:
+        return self._path / key[:2] / key[2:]
@@ -33,14 +33,18 @@
 import sys
 import logging
 import argparse
-from typing import List
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional
 
 from . import PATH_PROJECT_ROOT, COPYRIGHT_MSG, DIST_TYPES
-from .config import Config, PATH_CONFIG
-from .builder import AddonBuilder, clean_repo
-from .ui import QtVersion, UIBuilder
-from .manifest import ManifestUtils
-from .git import Git
+from .config import PATH_CONFIG
+
+# Everything else is imported by the commands that need it, so that simple
+# invocations like `aab --help` or `aab clean` start up quickly
+if TYPE_CHECKING:
+    from .config import Config
+    from .context import BuildContext
+    from .ui import QtVersion
 
 
 # Checks
@@ -63,8 +67,10 @@ def validate_cwd():
 ##############################################################################
 
 
-def get_qt_versions(args: argparse.Namespace) -> List[QtVersion]:
-    targets = [args.target] if args.target != "all" else Config()["targets"]
+def get_qt_versions(args: argparse.Namespace, config: "Config") -> List["QtVersion"]:
+    from .ui import QtVersion
+
+    targets = [args.target] if args.target != "all" else config["targets"]
 
     if "anki21" in targets:
         qt_versions = [QtVersion.qt5, QtVersion.qt6]
@@ -79,40 +85,61 @@ def get_qt_versions(args: argparse.Namespace) -> List[QtVersion]:
 
 
 def build(args):
-    qt_versions = get_qt_versions(args)
+    from .builder import AddonBuilder
+
+    context: "BuildContext" = args.context
+    qt_versions = get_qt_versions(args, context.config)
 
     dists = [args.dist] if args.dist != "all" else DIST_TYPES
 
-    builder = AddonBuilder(version=args.version)
+    builder = AddonBuilder(
+        version=args.version,
+        jobs=args.jobs,
+        in_process=args.in_process,
+        use_cache=not args.no_cache,
+        reproducible=args.reproducible,
+        link_files=args.link_files,
+        config=context.config,
+        git=context.git(untracked_files=not args.skip_untracked),
+    )
 
-    cnt = 1
-    total = len(dists)
-    for dist in dists:
-        logging.info("\n=== Build task %s/%s ===", cnt, total)
-        builder.build(qt_versions=qt_versions, disttype=dist)
-        cnt += 1
+    try:
+        builder.build_variants(qt_versions=qt_versions, disttypes=dists)
+    finally:
+        builder.close()
 
 
 def ui(args):
-    qt_versions = get_qt_versions(args)
-
-    builder = UIBuilder(dist=PATH_PROJECT_ROOT, config=Config())
-
-    cnt = 1
-    total = len(qt_versions)
-    for qt_version in qt_versions:
-        logging.info("\n=== Build task %s/%s ===\n", cnt, total)
-        builder.build(qt_version=qt_version)
-        cnt += 1
+    from .cache import FileCache
+    from .ui import UIBuilder
+
+    context: "BuildContext" = args.context
+    qt_versions = get_qt_versions(args, context.config)
+
+    builder = UIBuilder(
+        dist=PATH_PROJECT_ROOT,
+        config=context.config,
+        jobs=args.jobs,
+        in_process=args.in_process,
+        form_cache=None if args.no_cache else FileCache.user_cache("forms"),
+    )
 
-    logging.info("\n=== Writing Qt compatibility shim ===")
-    builder.create_qt_shim()
-    logging.info("Done.")
+    logging.info(
+        "\n=== Building UI for %s ===\n", ", ".join(v.name for v in qt_versions)
+    )
+    try:
+        builder.build_targets(qt_versions=qt_versions)
+    finally:
+        builder.close()
 
 
 def manifest(args):
-    version = Git().parse_version(vstring=args.version)
-    addon_properties = Config()
+    from .manifest import ManifestUtils
+
+    context: "BuildContext" = args.context
+    git = context.git(untracked_files=not args.skip_untracked)
+    version = git.parse_version(vstring=args.version)
+    addon_properties = context.config
 
     dist_type = args.dist
 
@@ -125,6 +152,7 @@ def manifest(args):
         version=version,
         dist_type=dist_type,
         target_dir=PATH_PROJECT_ROOT / "src" / addon_properties["module_name"],
+        git=git,
     )
 
 
@@ -132,42 +160,154 @@ def manifest(args):
 
 
 def create_dist(args):
-    builder = AddonBuilder(version=args.version)
-    builder.create_dist()
+    from .builder import AddonBuilder
+
+    context: "BuildContext" = args.context
+    builder = AddonBuilder(
+        version=args.version,
+        config=context.config,
+        git=context.git(untracked_files=not args.skip_untracked),
+    )
+    try:
+        builder.create_dist()
+    finally:
+        builder.close()
 
 
 def build_dist(args):
-    qt_versions = get_qt_versions(args)
+    from .builder import AddonBuilder
+
+    context: "BuildContext" = args.context
+    qt_versions = get_qt_versions(args, context.config)
     dists = [args.dist] if args.dist != "all" else DIST_TYPES
 
-    builder = AddonBuilder(version=args.version)
+    builder = AddonBuilder(
+        version=args.version,
+        jobs=args.jobs,
+        in_process=args.in_process,
+        use_cache=not args.no_cache,
+        reproducible=args.reproducible,
+        config=context.config,
+        git=context.git(untracked_files=not args.skip_untracked),
+    )
 
     cnt = 1
     total = len(dists)
-    for dist in dists:
-        logging.info("\n=== Build task %s/%s ===", cnt, total)
-        builder.build_dist(qt_versions=qt_versions, disttype=dist)
-        cnt += 1
+    try:
+        for dist in dists:
+            logging.info("\n=== Build task %s/%s ===", cnt, total)
+            builder.build_dist(qt_versions=qt_versions, disttype=dist)
+            cnt += 1
+    finally:
+        builder.close()
 
 
 def package_dist(args):
-    qt_versions = get_qt_versions(args)
+    from .builder import AddonBuilder
+
+    context: "BuildContext" = args.context
+    qt_versions = get_qt_versions(args, context.config)
     dists = [args.dist] if args.dist != "all" else DIST_TYPES
 
-    builder = AddonBuilder(version=args.version)
+    builder = AddonBuilder(
+        version=args.version,
+        reproducible=args.reproducible,
+        config=context.config,
+        git=context.git(untracked_files=not args.skip_untracked),
+    )
 
     cnt = 1
     total = len(dists)
-    for dist in dists:
-        logging.info("\n=== Build task %s/%s ===", cnt, total)
-        builder.package_dist(qt_versions=qt_versions, disttype=dist)
-        cnt += 1
+    try:
+        for dist in dists:
+            logging.info("\n=== Build task %s/%s ===", cnt, total)
+            builder.package_dist(qt_versions=qt_versions, disttype=dist)
+            cnt += 1
+    finally:
+        builder.close()
 
 
 def clean(args):
+    from .builder import clean_repo
+
     return clean_repo()
 
 
+def watch(args):
+    from .cache import FileCache
+    from .watch import ProjectWatcher
+
+    qt_versions = get_qt_versions(args, args.context.config)
+
+    watcher = ProjectWatcher(
+        root=PATH_PROJECT_ROOT,
+        qt_versions=qt_versions,
+        version=args.version,
+        jobs=args.jobs,
+        form_cache=None if args.no_cache else FileCache.user_cache("forms"),
+        debounce=args.debounce / 1000,
+        polling=args.poll,
+    )
+    watcher.run()
+
+
+def daemon(args):
+    from .daemon import DaemonServer, stop_daemon
+
+    if args.stop:
+        if not stop_daemon():
+            logging.info("No aab daemon is running for this project.")
+        return
+
+    server = DaemonServer(
+        root=PATH_PROJECT_ROOT,
+        idle_timeout=args.idle_timeout * 60 if args.idle_timeout else None,
+        polling=args.poll,
+    )
+    server.serve()
+
+
+def bench(args):
+    import json
+
+    from .bench import BenchmarkRunner, BenchmarkSpec, format_results
+
+    targets = ["qt6", "qt5"] if args.target in ("all", "anki21") else [args.target]
+    # Unset options fall back to the defaults of BenchmarkSpec, which is not
+    # imported when constructing the parser
+    sizes = {
+        "source_files": args.source_files,
+        "forms": args.forms,
+        "widgets_per_form": args.widgets_per_form,
+        "qrc_entries": args.qrc_entries,
+        "assets": args.assets,
+        "asset_size_kb": args.asset_size,
+    }
+    spec = BenchmarkSpec(
+        targets=tuple(targets),
+        **{key: value for key, value in sizes.items() if value is not None},
+    )
+
+    build_args = ["--jobs", str(args.jobs)]
+    if args.no_cache:
+        build_args.append("--no-cache")
+    if args.in_process:
+        build_args.append("--in-process")
+
+    runner = BenchmarkRunner(
+        spec=spec,
+        iterations=args.iterations,
+        phase_args={"build_dist": build_args},
+    )
+    results = runner.run(workdir=args.workdir)
+
+    with args.output.open("w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    logging.info("\n%s\n", format_results(results))
+    logging.info("Results saved as %s", args.output)
+
+
 # Argument parsing
 ##############################################################################
 
@@ -184,6 +324,14 @@ def construct_parser():
         required=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--trace",
+        help="Write timings of all build phases and subprocesses to FILE in the "
+        "Chrome trace-event format (viewable in chrome://tracing or Perfetto) "
+        "and print a summary of the slowest steps",
+        metavar="FILE",
+        type=Path,
+    )
 
     target_parent = argparse.ArgumentParser(add_help=False)
     target_parent.add_argument(
@@ -205,6 +353,48 @@ def construct_parser():
         choices=["local", "ankiweb", "all"],
     )
 
+    uic_parent = argparse.ArgumentParser(add_help=False)
+    uic_parent.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of worker processes to compile Qt forms with. Values above 1 "
+        "compile forms in long-lived workers of the current Python interpreter "
+        "instead of calling pyuic for each form.",
+        type=int,
+        default=1,
+    )
+    uic_parent.add_argument(
+        "--no-cache",
+        help="Do not reuse or store compiled Qt forms in the user-level aab cache",
+        action="store_true",
+    )
+    uic_parent.add_argument(
+        "--in-process",
+        help="Compile Qt forms through the PyQt uic API of the current Python "
+        "interpreter instead of calling the pyuic executables",
+        action="store_true",
+    )
+
+    reproducible_parent = argparse.ArgumentParser(add_help=False)
+    reproducible_parent.add_argument(
+        "--reproducible",
+        help="Produce byte-identical output for identical sources by stamping "
+        "files with SOURCE_DATE_EPOCH (or the commit time of the built version) "
+        "and normalizing permissions",
+        action="store_true",
+    )
+
+    staging_parent = argparse.ArgumentParser(add_help=False)
+    staging_parent.add_argument(
+        "--link-files",
+        help="Stage files of committed versions in build/dist as reflinks or hard "
+        "links to a content store under build/.aab instead of writing them out "
+        "again. Falls back to copies where the filesystem does not support "
+        "either. Not available for create_dist, as build scripts might modify "
+        "the staged files in place.",
+        action="store_true",
+    )
+
     build_parent = argparse.ArgumentParser(add_help=False)
     build_parent.add_argument(
         "version",
@@ -215,16 +405,32 @@ def construct_parser():
         "'current' – latest commit, 'release' – latest tag. "
         "Leave empty to build latest tag.",
     )
+    build_parent.add_argument(
+        "--skip-untracked",
+        help="Ignore untracked files when looking for uncommitted changes in "
+        "'dev' builds. Speeds up builds in working trees with many untracked "
+        "files.",
+        action="store_true",
+    )
 
     build_group = subparsers.add_parser(
         "build",
-        parents=[build_parent, target_parent, dist_parent],
+        parents=[
+            build_parent,
+            target_parent,
+            dist_parent,
+            uic_parent,
+            reproducible_parent,
+            staging_parent,
+        ],
         help="Build and package add-on for distribution",
     )
     build_group.set_defaults(func=build)
 
     ui_group = subparsers.add_parser(
-        "ui", parents=[target_parent], help="Compile add-on user interface files"
+        "ui",
+        parents=[target_parent, uic_parent],
+        help="Compile add-on user interface files",
     )
     ui_group.set_defaults(func=ui)
 
@@ -238,6 +444,108 @@ def construct_parser():
     clean_group = subparsers.add_parser("clean", help="Clean leftover build files")
     clean_group.set_defaults(func=clean)
 
+    watch_group = subparsers.add_parser(
+        "watch",
+        parents=[build_parent, target_parent, uic_parent],
+        help="Watch Qt forms, resources and addon.json for changes and rebuild "
+        "the affected UI files and manifest in place",
+    )
+    watch_group.add_argument(
+        "--poll",
+        help="Poll for changes instead of using inotify",
+        action="store_true",
+    )
+    watch_group.add_argument(
+        "--debounce",
+        help="Milliseconds to wait for further changes before rebuilding",
+        type=int,
+        default=100,
+    )
+    watch_group.set_defaults(func=watch, daemon_safe=False)
+
+    daemon_group = subparsers.add_parser(
+        "daemon",
+        help="Serve aab commands run through aab-client from a resident process "
+        "that keeps the project config and Git metadata loaded between calls",
+    )
+    daemon_group.add_argument(
+        "--stop",
+        help="Stop the daemon serving the current project",
+        action="store_true",
+    )
+    daemon_group.add_argument(
+        "--idle-timeout",
+        help="Shut down after this many minutes without requests",
+        type=float,
+        metavar="MINUTES",
+    )
+    daemon_group.add_argument(
+        "--poll",
+        help="Poll for changes of addon.json and Git refs instead of using inotify",
+        action="store_true",
+    )
+    daemon_group.set_defaults(func=daemon, daemon_safe=False)
+
+    bench_group = subparsers.add_parser(
+        "bench",
+        parents=[target_parent, uic_parent],
+        help="Benchmark the create_dist, build_dist and package_dist steps on a "
+        "generated synthetic add-on project. Can be run from any directory.",
+    )
+    bench_group.add_argument(
+        "-n",
+        "--iterations",
+        help="Number of times to run each step",
+        type=int,
+        default=5,
+    )
+    bench_group.add_argument(
+        "-o",
+        "--output",
+        help="Path to write the JSON results to",
+        type=Path,
+        default=Path("aab-bench.json"),
+    )
+    bench_group.add_argument(
+        "--workdir",
+        help="Generate the project in this directory and keep it around after "
+        "the benchmark, instead of using a temporary directory. Directories "
+        "left behind by earlier runs are cleared. Other non-empty directories "
+        "are kept and the project is generated in a new subdirectory.",
+        type=Path,
+    )
+    bench_group.add_argument(
+        "--source-files",
+        help="Number of Python modules to generate",
+        type=int,
+    )
+    bench_group.add_argument(
+        "--forms",
+        help="Number of Qt Designer forms to generate",
+        type=int,
+    )
+    bench_group.add_argument(
+        "--widgets-per-form",
+        help="Number of widgets in each generated form",
+        type=int,
+    )
+    bench_group.add_argument(
+        "--qrc-entries",
+        help="Number of files to list in the generated Qt resource collection",
+        type=int,
+    )
+    bench_group.add_argument(
+        "--assets",
+        help="Number of binary assets to generate",
+        type=int,
+    )
+    bench_group.add_argument(
+        "--asset-size",
+        help="Size of each binary asset in KiB",
+        type=int,
+    )
+    bench_group.set_defaults(func=bench, requires_project=False)
+
     create_dist_group = subparsers.add_parser(
         "create_dist",
         parents=[build_parent, target_parent, dist_parent],
@@ -249,7 +557,13 @@ def construct_parser():
 
     build_dist_group = subparsers.add_parser(
         "build_dist",
-        parents=[build_parent, target_parent, dist_parent],
+        parents=[
+            build_parent,
+            target_parent,
+            dist_parent,
+            uic_parent,
+            reproducible_parent,
+        ],
         help="Build add-on files from prepared source tree under build/dist. "
         "This step performs all source code post-processing handled by "
         "aab itself (e.g. building the Qt UI and writing the add-on manifest). "
@@ -261,7 +575,7 @@ def construct_parser():
 
     package_dist_group = subparsers.add_parser(
         "package_dist",
-        parents=[build_parent, target_parent, dist_parent],
+        parents=[build_parent, target_parent, dist_parent, reproducible_parent],
         help="Package pre-built distribution of add-on files under build/dist into "
         "a distributable .ankiaddon package. This is inteded to be used in "
         "build scripts and called after both `create_dist` and `build_dist` "
@@ -276,16 +590,23 @@ def construct_parser():
 ##############################################################################
 
 
-def main():
-    print(COPYRIGHT_MSG)
-
+def main(argv: Optional[List[str]] = None, context: Optional["BuildContext"] = None):
+    """
+    Keyword Arguments:
+        argv {list} -- Arguments to parse instead of sys.argv (default: {None})
+        context {BuildContext} -- Context to run the command in, e.g. the one
+                                  kept warm by aab daemon. A new one is created
+                                  and closed afterwards if None. (default: {None})
+    """
     # Argument parsing
 
     parser = construct_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    print(COPYRIGHT_MSG)
 
     # Checks
-    if not validate_cwd():
+    if getattr(args, "requires_project", True) and not validate_cwd():
         sys.exit(1)
 
     # Logging
@@ -295,7 +616,10 @@ def main():
     else:
         level = logging.INFO
 
-    logging.basicConfig(stream=sys.stdout, level=level, format="%(message)s")
+    # force replaces the handlers of previous commands run by aab daemon
+    logging.basicConfig(
+        stream=sys.stdout, level=level, format="%(message)s", force=True
+    )
 
     # Argument aliases
 
@@ -307,7 +631,36 @@ def main():
         args.target = "all"
 
     # Run
-    args.func(args)
+
+    from .context import BuildContext
+
+    owns_context = context is None
+    args.context = context or BuildContext()
+    try:
+        _run(args)
+    finally:
+        if owns_context:
+            args.context.close()
+
+
+def _run(args: argparse.Namespace):
+    if not args.trace:
+        args.func(args)
+        return
+
+    from .tracing import start_tracing, stop_tracing
+
+    tracer = start_tracing()
+    try:
+        with tracer.span("aab {}".format(args.func.__name__)):
+            args.func(args)
+    finally:
+        stop_tracing()
+        tracer.write(args.trace)
+        summary = tracer.summary()
+        if summary:
+            logging.info("\n%s", summary)
+        logging.info("Trace written to %s", args.trace)
 
 
 if __name__ == "__main__":
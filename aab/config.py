@@ -36,9 +36,6 @@ Project config parser
 import json
 import logging
 
-import jsonschema
-from jsonschema.exceptions import ValidationError
-
 from collections import UserDict
 
 from . import PATH_PACKAGE, PATH_PROJECT_ROOT
@@ -52,23 +49,84 @@ class Config(UserDict):
     Simple dictionary-like interface to the repository config file
     """
 
-    with (PATH_PACKAGE / "schema.json").open("r", encoding="utf-8") as f:
-        _schema = json.loads(f.read())
+    # Loaded on first use, as jsonschema is slow to import
+    _schema_contents = None
+    _validator = None
+    _max_cache_size = 1024**2
 
     def __init__(self, path=None):
         self._path = path or PATH_CONFIG
         try:
-            with self._path.open(encoding="utf-8") as f:
-                data = json.loads(f.read())
-            jsonschema.validate(data, self._schema)
+            with self._path.open("rb") as f:
+                contents = f.read()
+            data = json.loads(contents.decode("utf-8"))
+            self._validate(data, contents)
             self.data = data
-        except (IOError, OSError, ValueError, ValidationError):
+        # only evaluated once an exception is raised, so that jsonschema is
+        # not imported for configs that have been validated before
+        except (IOError, OSError, ValueError, self._validation_error()):
             logging.error(
                 "Error: Could not read '{}'. Traceback follows "
                 "below:\n".format(self._path.name)
             )
             raise
 
+    @staticmethod
+    def _validation_error():
+        from jsonschema.exceptions import ValidationError
+
+        return ValidationError
+
+    @classmethod
+    def _get_schema_contents(cls):
+        if cls._schema_contents is None:
+            with (PATH_PACKAGE / "schema.json").open("rb") as f:
+                cls._schema_contents = f.read()
+        return cls._schema_contents
+
+    @classmethod
+    def _get_validator(cls):
+        if cls._validator is None:
+            import jsonschema
+
+            schema = json.loads(cls._get_schema_contents().decode("utf-8"))
+            validator_class = jsonschema.validators.validator_for(schema)
+            validator_class.check_schema(schema)
+            cls._validator = validator_class(schema)
+        return cls._validator
+
+    @classmethod
+    def _validate(cls, data, contents):
+        """Same as jsonschema.validate, but reuses the validator and remembers
+        configs that passed validation in the user cache"""
+        from .cache import FileCache, get_user_cache_path, hash_key
+
+        # Entries hold the validated config, so that size-based eviction
+        # keeps the number of entries in check
+        cache = FileCache(
+            get_user_cache_path() / "config", max_size=cls._max_cache_size
+        )
+        cache_key = hash_key(cls._get_schema_contents(), contents)
+        # The cache is an optimization, so it must never keep us from
+        # loading the config, e.g. with a read-only home directory
+        try:
+            if cache.get(cache_key) is not None:
+                return
+        except OSError as e:
+            logging.debug("Could not read config validation cache: %s", e)
+
+        from jsonschema.exceptions import best_match
+
+        error = best_match(cls._get_validator().iter_errors(data))
+        if error is not None:
+            raise error
+
+        try:
+            cache.store_bytes(cache_key, contents)
+            cache.evict()
+        except OSError as e:
+            logging.debug("Could not write config validation cache: %s", e)
+
     def __setitem__(self, name, value):
         self.data[name] = value
         self._write(self.data)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+"""
+Config and Git state shared by the commands of an aab process
+"""
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Optional
+
+from .config import PATH_CONFIG, Config
+
+if TYPE_CHECKING:
+    from .git import Git
+
+
+class BuildContext:
+    """
+    Lazily loads the project config and Git interfaces used by CLI commands
+
+    One-off invocations use a fresh context per command. aab daemon keeps a
+    single context alive across requests and invalidates it as files change.
+    """
+
+    def __init__(self, config_path: Path = PATH_CONFIG):
+        self._config_path = config_path
+        self._config: Optional[Config] = None
+        self._gits: Dict[bool, "Git"] = {}
+
+    @property
+    def config(self) -> Config:
+        if self._config is None:
+            self._config = Config(self._config_path)
+        return self._config
+
+    def git(self, untracked_files: bool = True) -> "Git":
+        from .git import Git
+
+        if untracked_files not in self._gits:
+            self._gits[untracked_files] = Git(untracked_files=untracked_files)
+        return self._gits[untracked_files]
+
+    def invalidate_config(self):
+        self._config = None
+
+    def invalidate_git(self, refs: bool = True):
+        """
+        Keyword Arguments:
+            refs {bool} -- Also forget versions and revisions resolved from
+                           branches and tags (default: {True})
+        """
+        for git in self._gits.values():
+            git.invalidate(refs=refs)
+
+    def close(self):
+        for git in self._gits.values():
+            git.close()
+        self._gits.clear()
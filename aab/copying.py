@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+"""
+Parallel file copies for the steps that stage files in dist trees
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Union
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class CopyStats:
+    """Files and bytes handled by a CopyEngine"""
+
+    files: int = 0
+    bytes: int = 0
+    skipped_files: int = 0
+    skipped_bytes: int = 0
+
+    def summary(self) -> str:
+        return (
+            "Copied {files} files ({size:.1f} MiB), "
+            "skipped {skipped} unchanged files ({skipped_size:.1f} MiB)".format(
+                files=self.files,
+                size=self.bytes / 1024**2,
+                skipped=self.skipped_files,
+                skipped_size=self.skipped_bytes / 1024**2,
+            )
+        )
+
+
+class CopyEngine:
+    """
+    Copies files on a thread pool, skipping files that are already in place
+
+    Targets whose size, modification time and contents match their source
+    are left alone. All other targets are replaced atomically instead of
+    being written to in place, so that files hard-linked into the dist tree
+    (see staging.ContentStore) are never modified. File metadata is copied
+    along with the data, which is what makes the size and mtime checks of
+    later runs effective.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="aab-copy"
+        )
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+        self._stats = CopyStats()
+
+    def __enter__(self) -> "CopyEngine":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.wait()
+        finally:
+            self.close()
+
+    @property
+    def stats(self) -> CopyStats:
+        """Totals of all copies that completed so far"""
+        return self._stats
+
+    def copy_file(self, source: Union[str, Path], target: Union[str, Path]):
+        """Schedules copying the file at source to target"""
+        target = Path(target)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        self._futures.append(
+            self._executor.submit(self._copy_file, Path(source), target)
+        )
+
+    def copy_tree(
+        self, source: Union[str, Path], target: Union[str, Path]
+    ) -> List[Path]:
+        """Schedules copying all files below source to the same paths below
+        target. Files in target that do not exist in source are kept.
+
+        Returns:
+            list -- Paths of all target files
+        """
+        source = Path(source)
+        target = Path(target)
+        targets = []
+        for root, _, files in os.walk(str(source)):
+            relative_root = Path(root).relative_to(source)
+            target_root = target / relative_root
+            target_root.mkdir(parents=True, exist_ok=True)
+            for file in files:
+                targets.append(target_root / file)
+                self._futures.append(
+                    self._executor.submit(
+                        self._copy_file, Path(root) / file, target_root / file
+                    )
+                )
+        return targets
+
+    def wait(self) -> CopyStats:
+        """Waits for all scheduled copies and raises the first error, if any"""
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+        return self._stats
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _copy_file(self, source: Path, target: Path):
+        source_stat = source.stat()
+        if self._is_up_to_date(source, source_stat, target):
+            with self._lock:
+                self._stats.skipped_files += 1
+                self._stats.skipped_bytes += source_stat.st_size
+            return
+
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=".{}.".format(target.name), dir=str(target.parent)
+        )
+        try:
+            with source.open("rb") as src, os.fdopen(fd, "wb") as dst:
+                _copy_data(src, dst, source_stat.st_size)
+            os.chmod(tmp_path, source_stat.st_mode & 0o7777)
+            os.utime(tmp_path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+            if target.is_dir() and not target.is_symlink():
+                shutil.rmtree(str(target))
+            os.replace(tmp_path, str(target))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        with self._lock:
+            self._stats.files += 1
+            self._stats.bytes += source_stat.st_size
+
+    def _is_up_to_date(
+        self, source: Path, source_stat: os.stat_result, target: Path
+    ) -> bool:
+        try:
+            target_stat = target.stat()
+        except FileNotFoundError:
+            return False
+        if (
+            target_stat.st_size != source_stat.st_size
+            or target_stat.st_mtime_ns != source_stat.st_mtime_ns
+            or target_stat.st_mode != source_stat.st_mode
+        ):
+            return False
+        return _file_digest(source) == _file_digest(target)
+
+
+def _file_digest(path: Path) -> bytes:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(_COPY_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _copy_data(src, dst, size: int):
+    """Copies size bytes between two files in the kernel where supported"""
+    src_fd = src.fileno()
+    dst_fd = dst.fileno()
+    offset = 0
+
+    # Linux 4.5+, can also share data on file systems with reflink support
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < size:
+                copied = os.copy_file_range(src_fd, dst_fd, size - offset)
+                if copied == 0:
+                    break
+                offset += copied
+            if offset >= size:
+                return
+        except OSError as e:
+            logging.debug("copy_file_range unavailable: %s", e)
+
+    # Linux 2.6.33+. Other platforms only support sendfile to sockets.
+    if sys.platform.startswith("linux"):
+        try:
+            while offset < size:
+                sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+            if offset >= size:
+                return
+        except OSError as e:
+            logging.debug("sendfile unavailable: %s", e)
+
+    src.seek(offset)
+    dst.seek(offset)
+    shutil.copyfileobj(src, dst, _COPY_CHUNK_SIZE)
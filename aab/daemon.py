@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+"""
+Resident build daemon and the thin client that talks to it
+
+The client only relies on the standard library, so that forwarding a command
+to a running daemon skips importing aab's dependencies, loading the config
+schema and setting up the argument parser.
+"""
+
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+# Relative to the project root. Connecting through a relative path keeps us
+# clear of the ~100 character limit on Unix socket paths.
+PATH_DAEMON_SOCKET = Path("build") / ".aab" / "daemon.sock"
+
+
+class _ShutdownRequest(BaseException):
+    """Raised on SIGTERM. Not caught by the handlers around commands."""
+
+
+# Protocol
+##############################################################################
+
+# Clients send a single JSON object per connection and receive JSON objects
+# with "stdout" or "stderr" output, terminated by either {"exit": <status>}
+# or {"fallback": true} if the command has to run in the client process.
+
+
+def _is_same_user(connection: socket.socket) -> bool:
+    """Whether the peer runs as the current user. Platforms without
+    SO_PEERCRED rely on the permissions of the socket file alone."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return True
+    credentials = connection.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    _, uid, _ = struct.unpack("3i", credentials)
+    return uid == os.getuid()
+
+
+def _send(connection: socket.socket, message: Dict[str, Any]):
+    connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def _receive(connection: socket.socket) -> Iterator[Dict[str, Any]]:
+    with connection.makefile("rb") as reader:
+        for line in reader:
+            yield json.loads(line)
+
+
+class _SocketWriter(io.TextIOBase):
+    """Text stream that forwards everything written to it to the client"""
+
+    def __init__(self, connection: socket.socket, name: str):
+        self._connection = connection
+        self._name = name
+        self._disconnected = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text and not self._disconnected:
+            try:
+                _send(self._connection, {self._name: text})
+            except OSError:
+                # Keep the command going even if nobody is listening anymore
+                self._disconnected = True
+        return len(text)
+
+
+# Client
+##############################################################################
+
+
+def _connect(socket_path: Path) -> socket.socket:
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(str(socket_path))
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+def run_client(
+    argv: List[str], socket_path: Path = PATH_DAEMON_SOCKET
+) -> Optional[int]:
+    """Runs an aab command in the daemon serving the current directory
+
+    Returns:
+        int -- Exit status of the command, or None if no daemon is running or
+               the command has to be run locally
+    """
+    try:
+        connection = _connect(socket_path)
+    except OSError:
+        return None
+
+    with connection:
+        _send(
+            connection,
+            {"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)},
+        )
+        for message in _receive(connection):
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"])
+                sys.stdout.flush()
+            elif "stderr" in message:
+                sys.stderr.write(message["stderr"])
+                sys.stderr.flush()
+            elif "exit" in message:
+                return message["exit"]
+            elif message.get("fallback"):
+                return None
+
+    print("Error: Connection to aab daemon lost", file=sys.stderr)
+    return 1
+
+
+def stop_daemon(socket_path: Path = PATH_DAEMON_SOCKET) -> bool:
+    """Asks the daemon serving the current directory to shut down
+
+    Returns:
+        bool -- Whether a daemon was running
+    """
+    try:
+        connection = _connect(socket_path)
+    except OSError:
+        return False
+    with connection:
+        _send(connection, {"stop": True})
+        for message in _receive(connection):
+            if "exit" in message:
+                break
+    return True
+
+
+def client_main():
+    """Entry point of aab-client. Runs commands locally if no daemon is up."""
+    status = run_client(sys.argv[1:])
+    if status is None:
+        from .cli import main
+
+        main()
+        return
+    sys.exit(status)
+
+
+# Server
+##############################################################################
+
+
+class DaemonServer:
+    """
+    Runs aab commands for thin clients in a single long-lived process
+
+    Config, Git metadata and the long-lived git process are kept in a shared
+    BuildContext between requests. The config is reloaded whenever addon.json
+    changes, and resolved versions are dropped whenever branches or tags
+    move. The state of the working tree is always read afresh.
+
+    Requests are handled one at a time, as commands operate on the same
+    build directory.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        socket_path: Path = PATH_DAEMON_SOCKET,
+        idle_timeout: Optional[float] = None,
+        polling: bool = False,
+    ):
+        """
+        Arguments:
+            root {Path} -- Project root. Needs to be the current working
+                           directory.
+
+        Keyword Arguments:
+            socket_path {Path} -- Path to listen on (default: {PATH_DAEMON_SOCKET})
+            idle_timeout {float} -- Seconds without requests after which the
+                                    daemon shuts down (default: {None})
+            polling {bool} -- Poll for file changes instead of using inotify
+                              (default: {False})
+        """
+        # Deferred, so that the client does not pay for importing these
+        from .config import PATH_CONFIG
+        from .context import BuildContext
+        from .utils import call_shell
+        from .watch import create_watcher
+
+        self._root = root
+        self._socket_path = socket_path
+        self._idle_timeout = idle_timeout
+        self._config_path = root / PATH_CONFIG.name
+        self._context = BuildContext(self._config_path)
+        self._socket: Optional[socket.socket] = None
+
+        git_dir, common_dir = call_shell(
+            "git rev-parse --absolute-git-dir --git-common-dir"
+        ).splitlines()
+        self._git_dirs = {Path(git_dir), (root / common_dir).resolve()}
+        self._refs_path = (root / common_dir).resolve() / "refs"
+
+        self._watchers = [create_watcher(root, [], polling=polling)]
+        for path in self._git_dirs:
+            directories = [self._refs_path] if path == self._refs_path.parent else []
+            self._watchers.append(create_watcher(path, directories, polling=polling))
+
+    def serve(self):
+        """Handles requests until stopped, interrupted or idle for too long"""
+        self._socket = self._listen()
+        self._socket.settimeout(self._idle_timeout)
+        previous_handler = signal.signal(signal.SIGTERM, self._on_sigterm)
+        logging.info(
+            "Serving aab commands for %s on %s. Press Ctrl+C to stop.",
+            self._root,
+            self._socket_path,
+        )
+        try:
+            while True:
+                try:
+                    connection, _ = self._socket.accept()
+                except socket.timeout:
+                    logging.info("No requests received for a while. Shutting down.")
+                    break
+                if not self._handle(connection):
+                    logging.info("Stop requested. Shutting down.")
+                    break
+        except (KeyboardInterrupt, _ShutdownRequest):
+            logging.info("Shutting down.")
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+            self.close()
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            try:
+                self._socket_path.unlink()
+            except FileNotFoundError:
+                pass
+        for watcher in self._watchers:
+            watcher.close()
+        self._watchers = []
+        self._context.close()
+
+    def _on_sigterm(self, signum, frame):
+        raise _ShutdownRequest()
+
+    def _listen(self) -> socket.socket:
+        if self._socket_path.exists():
+            try:
+                _connect(self._socket_path).close()
+            except OSError:
+                # Left behind by a daemon that did not shut down cleanly
+                self._socket_path.unlink()
+            else:
+                logging.error(
+                    "Error: aab daemon is already running on %s", self._socket_path
+                )
+                sys.exit(1)
+        self._socket_path.parent.mkdir(parents=True, exist_ok=True)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Clients can run commands as our user, so nobody else may connect
+        umask = os.umask(0o177)
+        try:
+            server.bind(str(self._socket_path))
+        finally:
+            os.umask(umask)
+        server.listen()
+        return server
+
+    def _handle(self, connection: socket.socket) -> bool:
+        """Serves a single request. Returns False if the daemon should stop."""
+        with connection:
+            if not _is_same_user(connection):
+                logging.warning("Warning: Rejected request from another user")
+                return True
+            connection.settimeout(None)
+            with connection.makefile("rb") as reader:
+                line = reader.readline()
+            try:
+                request = json.loads(line)
+            except ValueError:
+                return True
+
+            if request.get("stop"):
+                _send(connection, {"exit": 0})
+                return False
+
+            if Path(request.get("cwd", "")).resolve() != self._root.resolve():
+                _send(connection, {"fallback": True})
+                return True
+
+            argv = request.get("argv", [])
+            if not self._can_run(argv):
+                _send(connection, {"fallback": True})
+                return True
+
+            self._refresh()
+            logging.info("Running 'aab %s'", " ".join(argv))
+            status = self._run(argv, request.get("env", {}), connection)
+            if status != 0:
+                # Failed commands might have left cached state half-updated
+                self._context.invalidate_git()
+            try:
+                _send(connection, {"exit": status})
+            except OSError:
+                pass
+        return True
+
+    def _can_run(self, argv: List[str]) -> bool:
+        from .cli import construct_parser
+
+        try:
+            with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+                args = construct_parser().parse_args(argv)
+        except SystemExit:
+            # Usage errors and help are reported by the command itself
+            return True
+        return getattr(args, "daemon_safe", True)
+
+    def _refresh(self):
+        """Invalidates whatever the files changed since the last request affect"""
+        config_changed = refs_changed = False
+        for watcher in self._watchers:
+            while True:
+                changes = watcher.wait(0)
+                if not changes:
+                    break
+                for path in changes:
+                    if path in (self._root, self._config_path):
+                        config_changed = True
+                    elif (
+                        path in self._git_dirs
+                        or path.name in ("HEAD", "packed-refs")
+                        or self._refs_path in path.parents
+                    ):
+                        refs_changed = True
+
+        if config_changed:
+            logging.debug("addon.json changed")
+            self._context.invalidate_config()
+        if refs_changed:
+            logging.debug("Git refs changed")
+        self._context.invalidate_git(refs=refs_changed)
+
+    def _run(self, argv: List[str], env: Dict[str, str], connection: socket.socket):
+        from .cli import main
+
+        stdout = _SocketWriter(connection, "stdout")
+        stderr = _SocketWriter(connection, "stderr")
+
+        root_logger = logging.getLogger()
+        handlers = root_logger.handlers[:]
+        level = root_logger.level
+        environ = dict(os.environ)
+        # Subprocesses like pyuic and git should see the client's environment
+        os.environ.clear()
+        os.environ.update(env)
+        try:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    main(argv, context=self._context)
+                except SystemExit as e:
+                    if e.code is None or isinstance(e.code, int):
+                        return e.code or 0
+                    print(e.code, file=sys.stderr)
+                    return 1
+                except Exception:
+                    traceback.print_exc()
+                    return 1
+            return 0
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            for handler in root_logger.handlers[:]:
+                root_logger.removeHandler(handler)
+            for handler in handlers:
+                root_logger.addHandler(handler)
+            root_logger.setLevel(level)
+
+
+if __name__ == "__main__":
+    client_main()
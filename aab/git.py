@@ -33,16 +33,353 @@
 Basic Git interface
 """
 
+import io
+import json
 import logging
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    IO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
+from .staging import ContentStore
+from .tracing import CATEGORY_SUBPROCESS, span
 from .utils import call_shell
 
+_COPY_CHUNK_SIZE = 1024 * 1024
+# relative to the export target, outside of the add-on package
+WORKING_TREE_EXPORT_STATE = Path("build") / ".aab" / "working-tree.json"
+
+
+def _resolve_member_path(outdir: Path, name: str) -> Optional[Path]:
+    """Returns target path of an archive member, or None if it escapes outdir"""
+    relative_path = Path(name)
+    if relative_path.is_absolute() or ".." in relative_path.parts:
+        return None
+    return outdir / relative_path
+
+
+def _finalize_file(path: Path, mode: int, mtime: float):
+    os.chmod(path, mode)
+    os.utime(path, (mtime, mtime))
+
+
+@dataclass(frozen=True)
+class Revision:
+    """Metadata of a resolved commit"""
+
+    commit: str
+    tree: str
+    timestamp: int
+
+
+@dataclass(frozen=True)
+class WorkingTreeChange:
+    """Entry of 'git status --porcelain=v2'"""
+
+    path: str
+    index_status: str = "."
+    worktree_status: str = "."
+    untracked: bool = False
+
+    @property
+    def deleted(self) -> bool:
+        return "D" in (self.index_status, self.worktree_status)
+
+
+@dataclass(frozen=True)
+class WorkingTreeSnapshot:
+    """Uncommitted changes of the working tree at a point in time"""
+
+    root: Path
+    changes: Tuple[WorkingTreeChange, ...]
+
+    @property
+    def is_dirty(self) -> bool:
+        return bool(self.changes)
+
+    @property
+    def has_tracked_changes(self) -> bool:
+        return any(not change.untracked for change in self.changes)
+
+    def modtime(self) -> Optional[int]:
+        """Most recent modification time of all changed files that still exist"""
+        modtimes = []
+        for change in self.changes:
+            if change.deleted:
+                continue
+            try:
+                modtimes.append(int(os.lstat(self.root / change.path).st_mtime))
+            except FileNotFoundError:
+                continue
+        return max(modtimes, default=None)
+
+
+def _parse_porcelain_v2(output: bytes) -> Iterator[WorkingTreeChange]:
+    """Parses the NUL-separated output of 'git status --porcelain=v2 -z'"""
+    records = iter(output.split(b"\0"))
+    for record in records:
+        if not record:
+            continue
+        kind = record[:1]
+        if kind == b"1":
+            # 1 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <path>
+            fields = record.split(b" ", 8)
+            yield WorkingTreeChange(
+                path=os.fsdecode(fields[8]),
+                index_status=chr(fields[1][0]),
+                worktree_status=chr(fields[1][1]),
+            )
+        elif kind == b"2":
+            # 2 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <X><score> <path>NUL<origPath>
+            fields = record.split(b" ", 9)
+            next(records, None)
+            yield WorkingTreeChange(
+                path=os.fsdecode(fields[9]),
+                index_status=chr(fields[1][0]),
+                worktree_status=chr(fields[1][1]),
+            )
+        elif kind == b"u":
+            # u <XY> <sub> <m1> <m2> <m3> <mW> <h1> <h2> <h3> <path>
+            fields = record.split(b" ", 10)
+            yield WorkingTreeChange(
+                path=os.fsdecode(fields[10]),
+                index_status=chr(fields[1][0]),
+                worktree_status=chr(fields[1][1]),
+            )
+        elif kind == b"?":
+            yield WorkingTreeChange(path=os.fsdecode(record[2:]), untracked=True)
+
+
+class GitObjectReader:
+    """
+    Long-lived 'git cat-file --batch' process for object and metadata queries
+
+    Spawning git can be expensive in large repositories, so all lookups of a
+    build are answered by a single process that is started on first use.
+    """
+
+    def __init__(self):
+        self._process: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    def read(self, rev: str) -> Optional[Tuple[str, str, bytes]]:
+        """Returns object ID, type and contents of rev, or None if it is missing"""
+        buffer = io.BytesIO()
+        result = self.copy(rev, buffer)
+        if result is None:
+            return None
+        object_id, object_type, _ = result
+        return object_id, object_type, buffer.getvalue()
+
+    def copy(self, rev: str, fileobj: IO[bytes]) -> Optional[Tuple[str, str, int]]:
+        """Streams the contents of rev to fileobj
+
+        Returns:
+            tuple -- Object ID, type and size, or None if rev is missing
+        """
+        if "\n" in rev:
+            return None
+        with self._lock:
+            stdin, stdout = self._get_pipes()
+            stdin.write(rev.encode("utf-8") + b"\n")
+            stdin.flush()
+
+            header = stdout.readline().decode("utf-8").split()
+            if len(header) != 3:
+                if not header:
+                    logging.error("Error: 'git cat-file --batch' exited unexpectedly")
+                    sys.exit(1)
+                # '<rev> missing' or '<rev> ambiguous'
+                return None
+
+            object_id, object_type, size = header
+            remaining = int(size)
+            while remaining:
+                chunk = stdout.read(min(remaining, _COPY_CHUNK_SIZE))
+                if not chunk:
+                    logging.error("Error: 'git cat-file --batch' exited unexpectedly")
+                    sys.exit(1)
+                fileobj.write(chunk)
+                remaining -= len(chunk)
+            stdout.read(1)  # trailing newline
+
+        return object_id, object_type, int(size)
+
+    def close(self):
+        with self._lock:
+            if self._process is None:
+                return
+            assert self._process.stdin is not None
+            self._process.stdin.close()
+            self._process.wait()
+            self._process = None
+
+    def _get_pipes(self) -> Tuple[IO[bytes], IO[bytes]]:
+        if self._process is None:
+            logging.debug("Starting 'git cat-file --batch'")
+            self._process = subprocess.Popen(
+                ["git", "cat-file", "--batch"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        assert self._process.stdin is not None and self._process.stdout is not None
+        return self._process.stdin, self._process.stdout
+
 
 class Git(object):
+    """
+    Git interface that caches everything it resolves
+
+    A single instance is meant to be shared for the duration of a build, so
+    that versions, revisions and timestamps are only looked up once.
+    """
+
+    # Files above this size are streamed to disk instead of being handed to
+    # the writer threads, which bounds memory use to roughly
+    # _max_pending_writes * _max_buffered_size
+    _max_buffered_size = 4 * 1024 * 1024
+    _max_pending_writes = 64
+    _export_state_version = 1
+
+    def __init__(self, untracked_files: bool = True):
+        """
+        Keyword Arguments:
+            untracked_files {bool} -- Whether untracked files count as changes of
+                                      the working tree (default: {True})
+        """
+        self._untracked_files = untracked_files
+        self._reader = GitObjectReader()
+        self._versions: Dict[Optional[str], str] = {}
+        self._revisions: Dict[str, Optional[Revision]] = {}
+        self._snapshot: Optional[WorkingTreeSnapshot] = None
+        self._modtimes: Dict[str, int] = {}
+
+    def close(self):
+        """Stops the long-lived git process, if any"""
+        self._reader.close()
+
+    def invalidate(self, refs: bool = True):
+        """Forgets cached state so that it is read again on next use
+
+        Keyword Arguments:
+            refs {bool} -- Also forget versions and revisions resolved from
+                           branches and tags. Otherwise only the working tree
+                           state is dropped. (default: {True})
+        """
+        self._snapshot = None
+        self._modtimes.clear()
+        if refs:
+            self._versions.clear()
+            self._revisions.clear()
+            # cat-file might hold on to the refs it has already read
+            self._reader.close()
+
     def parse_version(self, vstring=None):
         if vstring and vstring not in ("release", "current"):
             return vstring
 
+        if vstring not in self._versions:
+            self._versions[vstring] = self._describe(vstring)
+        return self._versions[vstring]
+
+    def revision(self, rev: str) -> Optional[Revision]:
+        """Resolves rev to its commit, tree and commit timestamp"""
+        if rev not in self._revisions:
+            self._revisions[rev] = self._read_revision(rev)
+        return self._revisions[rev]
+
+    def snapshot(self) -> WorkingTreeSnapshot:
+        """Uncommitted changes of the working tree at the time of the first call"""
+        if self._snapshot is None:
+            self._snapshot = self._read_snapshot()
+        return self._snapshot
+
+    def _read_snapshot(self) -> WorkingTreeSnapshot:
+        output = self._run_git(
+            "status",
+            "--porcelain=v2",
+            "-z",
+            "--untracked-files={}".format("normal" if self._untracked_files else "no"),
+        )
+        return WorkingTreeSnapshot(
+            root=self._find_worktree_root(),
+            changes=tuple(_parse_porcelain_v2(output)),
+        )
+
+    def _run_git(
+        self, *args: str, cwd: Optional[Path] = None, input: Optional[bytes] = None
+    ) -> bytes:
+        """Runs git without a shell and returns its raw output"""
+        command = ["git", *args]
+        command_str = " ".join(command)
+        with span(command_str, CATEGORY_SUBPROCESS, command=command_str):
+            result = subprocess.run(
+                command,
+                cwd=cwd,
+                input=input,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        if result.returncode != 0:
+            logging.error(
+                "Error while running command: '{command}'".format(command=command_str)
+            )
+            logging.error(result.stderr.decode("utf-8", errors="replace"))
+            sys.exit(1)
+        return result.stdout
+
+    def _find_worktree_root(self) -> Path:
+        """Paths in porcelain output are relative to the root of the work tree"""
+        if "GIT_DIR" not in os.environ and "GIT_WORK_TREE" not in os.environ:
+            cwd = Path.cwd()
+            for path in (cwd, *cwd.parents):
+                if (path / ".git").exists():
+                    return path
+        return Path(call_shell("git rev-parse --show-toplevel"))
+
+    def _read_revision(self, rev: str) -> Optional[Revision]:
+        result = self._reader.read("{rev}^{{commit}}".format(rev=rev))
+        if result is None:
+            return None
+        commit, _, contents = result
+
+        tree = None
+        timestamp = None
+        for line in contents.decode("utf-8", errors="replace").splitlines():
+            if not line:
+                # end of commit headers
+                break
+            key, _, value = line.partition(" ")
+            if key == "tree":
+                tree = value
+            elif key == "committer":
+                # 'Name <email> <unix timestamp> <timezone>'
+                timestamp = int(value.rsplit(" ", 2)[1])
+
+        if tree is None or timestamp is None:
+            return None
+
+        return Revision(commit=commit, tree=tree, timestamp=timestamp)
+
+    def _describe(self, vstring=None):
         logging.info("Getting Git version info...")
 
         cmd = "git describe HEAD --tags"
@@ -58,33 +395,475 @@ class Git(object):
 
         return version
 
-    def archive(self, version, outdir):
+    def archive(
+        self,
+        version,
+        outdir,
+        on_extract: Optional[Callable[[Path, int], None]] = None,
+        store: Optional[ContentStore] = None,
+    ):
+        """Exports the tree of version to outdir
+
+        Keyword Arguments:
+            on_extract {callable} -- Called with the path and size of every file
+                                     as soon as it has been written out. Might be
+                                     called from worker threads.
+            store {ContentStore} -- Stage files of committed versions as links
+                                    to entries of this store where possible,
+                                    instead of writing them out again.
+        """
         logging.info("Exporting Git archive...")
         if not outdir or not version:
             return False
         if version == "dev":
-            # https://stackoverflow.com/a/12010656
-            cmd = (
-                "stash=`git stash create`; git archive --format tar $stash |"
-                " tar -x -C {outdir}/".format(outdir=outdir)
-            )
+            with span("export working tree"):
+                if self._export_working_tree(Path(outdir), on_extract=on_extract):
+                    return True
+            # git stash create only covers tracked files and comes up empty
+            # without changes to them
+            if self.snapshot().has_tracked_changes:
+                # https://stackoverflow.com/a/12010656
+                ref = call_shell("git stash create") or "HEAD"
+            else:
+                ref = "HEAD"
         else:
-            cmd = "git archive --format tar {vers} | tar -x -C {outdir}/".format(
-                vers=version, outdir=outdir
+            ref = version
+            if store is not None:
+                with span("stage tree"):
+                    if self._stage_tree(ref, Path(outdir), store, on_extract):
+                        return True
+        command = "git archive --format tar {ref}".format(ref=ref)
+        with span(command, CATEGORY_SUBPROCESS, command=command):
+            return self._extract_archive(ref, Path(outdir), on_extract=on_extract)
+
+    def _stage_tree(
+        self,
+        ref: str,
+        outdir: Path,
+        store: ContentStore,
+        on_extract: Optional[Callable[[Path, int], None]] = None,
+    ) -> bool:
+        """Assembles the tree of ref in outdir from entries of a content store
+
+        Like 'git archive', only the subtree of the current directory is
+        staged. Blobs missing from the store are read through the long-lived
+        cat-file process. Files get the permissions 'git archive' would use and
+        the commit time as their modification time.
+
+        Returns False if the tree can't be staged like this because it relies
+        on export attributes, which only 'git archive' applies.
+        """
+        revision = self.revision(ref)
+        if revision is None:
+            return False
+
+        # Without --full-tree, paths are limited to and relative to cwd
+        entries: List[Tuple[int, str, str, str]] = []
+        for record in self._run_git("ls-tree", "-r", "-z", revision.commit).split(
+            b"\0"
+        ):
+            if not record:
+                continue
+            # <mode> SP <type> SP <object> TAB <path>
+            raw_info, _, raw_path = record.partition(b"\t")
+            raw_mode, object_type, object_id = raw_info.decode("ascii").split(" ")
+            entries.append(
+                (int(raw_mode, 8), object_type, object_id, os.fsdecode(raw_path))
             )
-        return call_shell(cmd)
+
+        info_attributes = Path(
+            self._run_git("rev-parse", "--git-path", "info/attributes")
+            .decode("utf-8")
+            .strip()
+        )
+        # 'git archive' only reads .gitattributes of the archived subtree
+        if info_attributes.exists() or any(
+            Path(path).name == ".gitattributes" for *_, path in entries
+        ):
+            logging.debug("Tree might use export attributes. Using 'git archive'")
+            return False
+
+        umask = os.umask(0)
+        os.umask(umask)
+
+        outdir.mkdir(parents=True, exist_ok=True)
+
+        for mode, object_type, object_id, path in entries:
+            target = outdir / path
+            if object_type == "commit":
+                # Submodules are exported as empty directories
+                target.mkdir(parents=True, exist_ok=True)
+                continue
+
+            target.parent.mkdir(parents=True, exist_ok=True)
+
+            if stat.S_IFMT(mode) == stat.S_IFLNK:
+                result = self._reader.read(object_id)
+                assert result is not None
+                if target.is_symlink() or target.exists():
+                    target.unlink()
+                os.symlink(os.fsdecode(result[2]), target)
+                continue
+
+            # Mirror the permissions of 'git archive' with its default tar.umask
+            file_mode = (0o775 if mode & stat.S_IXUSR else 0o664) & ~umask
+            key = "{}-{:o}".format(object_id, file_mode)
+            if store.get(key) is None:
+                store.add(
+                    key,
+                    lambda f: self._reader.copy(object_id, f),
+                    mode=file_mode,
+                    mtime=revision.timestamp,
+                )
+            store.stage(key, target, mtime=revision.timestamp)
+
+            if on_extract:
+                on_extract(target, target.stat().st_size)
+
+        logging.info(store.summary())
+        store.prune()
+
+        return True
+
+    def _export_working_tree(
+        self,
+        outdir: Path,
+        on_extract: Optional[Callable[[Path, int], None]] = None,
+    ) -> bool:
+        """Copies all files in the Git index below the current directory from
+        the working tree to outdir
+
+        Produces the same files as archiving the output of 'git stash create',
+        without writing any objects to the repository. Like 'git archive', only
+        the subtree of the current directory is exported, so that projects in
+        subdirectories of a repository work. Files that are still
+        unchanged since the last export to outdir are skipped, and files that
+        were exported before but are no longer part of the index are removed.
+
+        Returns False if the tree relies on export-subst, which only
+        'git archive' can apply.
+        """
+        # ls-files and check-attr take and return paths relative to cwd
+        root = Path.cwd()
+
+        entries: Dict[str, int] = {}
+        for record in self._run_git("ls-files", "-z", "--stage", cwd=root).split(b"\0"):
+            if not record:
+                continue
+            # <mode> <object> <stage>\t<path>, unmerged paths appear once per stage
+            raw_info, _, raw_path = record.partition(b"\t")
+            entries[os.fsdecode(raw_path)] = int(raw_info.split(b" ", 1)[0], 8)
+
+        # 'git archive' ignores attributes above the current directory, which
+        # check-attr would still apply
+        top = self.snapshot().root
+        if any(
+            (parent / ".gitattributes").exists()
+            for parent in root.parents
+            if parent == top or top in parent.parents
+        ):
+            logging.debug("Parent directories set attributes. Using 'git archive'")
+            return False
+
+        ignored, uses_subst = self._check_export_attributes(root, entries.keys())
+        if uses_subst:
+            logging.debug("Tree uses export-subst. Falling back to 'git archive'")
+            return False
+
+        state_path = outdir / WORKING_TREE_EXPORT_STATE
+        previous_files = self._read_export_state(state_path)
+        if previous_files is None and outdir.exists():
+            # Unknown contents, e.g. from exporting a release
+            shutil.rmtree(str(outdir))
+        outdir.mkdir(parents=True, exist_ok=True)
+
+        umask = os.umask(0)
+        os.umask(umask)
+
+        exported: Dict[str, int] = {}
+        for path, mode in entries.items():
+            if path in ignored or any(
+                parent.as_posix() in ignored for parent in Path(path).parents
+            ):
+                continue
+            exported[path] = mode
+
+        skipped = 0
+        errors: List[str] = []
+
+        def export_file(path: str, mode: int) -> Optional[bool]:
+            """Returns True if the file had to be copied, False if it was
+            unchanged and None if it was deleted in the working tree"""
+            source = root / path
+            target = outdir / path
+            try:
+                source_stat = os.lstat(source)
+            except FileNotFoundError:
+                if target.is_symlink() or target.exists():
+                    target.unlink()
+                return None
+
+            file_type = stat.S_IFMT(mode)
+            if file_type == stat.S_IFLNK:
+                if target.is_symlink() or target.exists():
+                    target.unlink()
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.symlink(os.readlink(source), target)
+                return True
+            elif file_type != stat.S_IFREG:
+                # Submodules are exported as empty directories
+                target.mkdir(parents=True, exist_ok=True)
+                return False
+
+            # Mirror the permissions of 'git archive' with its default tar.umask
+            target_mode = (0o775 if mode & stat.S_IXUSR else 0o664) & ~umask
+            try:
+                target_stat = os.lstat(target)
+            except FileNotFoundError:
+                target_stat = None
+            if (
+                target_stat is not None
+                and stat.S_ISREG(target_stat.st_mode)
+                and target_stat.st_size == source_stat.st_size
+                and target_stat.st_mtime_ns == source_stat.st_mtime_ns
+                and stat.S_IMODE(target_stat.st_mode) == target_mode
+            ):
+                return False
+
+            if target_stat is not None:
+                target.unlink()
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, target)
+            os.chmod(target, target_mode)
+            os.utime(target, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+            logging.debug("Exported %s (%s bytes)", target, source_stat.st_size)
+            if on_extract:
+                on_extract(target, source_stat.st_size)
+            return True
+
+        with ThreadPoolExecutor() as executor:
+            futures = {
+                path: executor.submit(export_file, path, mode)
+                for path, mode in exported.items()
+            }
+            for path, future in futures.items():
+                try:
+                    copied = future.result()
+                except OSError as e:
+                    errors.append(str(e))
+                    continue
+                if copied is None:
+                    del exported[path]
+                elif not copied:
+                    skipped += 1
+
+        if errors:
+            logging.error("Error while exporting working tree:")
+            for error in errors:
+                logging.error(error)
+            sys.exit(1)
+
+        for path in (previous_files or set()) - exported.keys():
+            target = outdir / path
+            if target.is_symlink() or target.is_file():
+                logging.debug("Removing %s, which is no longer tracked", target)
+                target.unlink()
+
+        self._write_export_state(state_path, exported.keys())
+
+        logging.info(
+            "Exported %s files from the working tree, skipped %s unchanged files",
+            len(exported) - skipped,
+            skipped,
+        )
+        return True
+
+    def _check_export_attributes(
+        self, root: Path, paths: Iterable[str]
+    ) -> Tuple[Set[str], bool]:
+        """Returns paths marked as export-ignore and whether any path uses
+        export-subst"""
+        candidates = set()
+        for path in paths:
+            candidates.add(path)
+            # Attributes of directories apply to all of their contents
+            candidates.update(
+                parent.as_posix() for parent in Path(path).parents if parent.parts
+            )
+        if not candidates:
+            return set(), False
+
+        output = self._run_git(
+            "check-attr",
+            "-z",
+            "--stdin",
+            "export-ignore",
+            "export-subst",
+            cwd=root,
+            input=b"\0".join(os.fsencode(path) for path in sorted(candidates)) + b"\0",
+        )
+
+        ignored = set()
+        uses_subst = False
+        fields = output.split(b"\0")
+        for index in range(0, len(fields) - 2, 3):
+            raw_path, attribute, value = fields[index : index + 3]
+            if value == b"unspecified" or value == b"unset":
+                continue
+            if attribute == b"export-ignore":
+                ignored.add(os.fsdecode(raw_path))
+            elif attribute == b"export-subst":
+                uses_subst = True
+
+        return ignored, uses_subst
+
+    def _read_export_state(self, state_path: Path) -> Optional[Set[str]]:
+        try:
+            with state_path.open("r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if state.get("version") != self._export_state_version:
+            return None
+        return set(state["files"])
+
+    def _write_export_state(self, state_path: Path, files: Iterable[str]):
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        with state_path.open("w", encoding="utf-8") as f:
+            json.dump(
+                {"version": self._export_state_version, "files": sorted(files)}, f
+            )
+
+    def _extract_archive(
+        self,
+        ref: str,
+        outdir: Path,
+        on_extract: Optional[Callable[[Path, int], None]] = None,
+    ) -> bool:
+        """Reads the tar stream of 'git archive' and writes files on a thread pool"""
+        # Mirror the permissions that 'tar -x' would have applied
+        umask = os.umask(0)
+        os.umask(umask)
+
+        errors: List[str] = []
+        pending: List[Future] = []
+
+        def write_file(path: Path, data: bytes, mode: int, mtime: float):
+            with path.open("wb") as f:
+                f.write(data)
+            _finalize_file(path, mode, mtime)
+            logging.debug("Extracted %s (%s bytes)", path, len(data))
+            if on_extract:
+                on_extract(path, len(data))
+
+        def collect(futures: List[Future]):
+            for future in futures:
+                try:
+                    future.result()
+                except OSError as e:
+                    errors.append(str(e))
+
+        with tempfile.TemporaryFile() as stderr, ThreadPoolExecutor() as executor:
+            process = subprocess.Popen(
+                ["git", "archive", "--format", "tar", ref],
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+            )
+            assert process.stdout is not None
+
+            try:
+                with tarfile.open(fileobj=process.stdout, mode="r|") as tar:
+                    for member in tar:
+                        path = _resolve_member_path(outdir, member.name)
+                        if path is None:
+                            errors.append(f"Refusing to extract {member.name!r}")
+                            continue
+
+                        mode = member.mode & ~umask
+
+                        if member.isdir():
+                            path.mkdir(parents=True, exist_ok=True)
+                            continue
+
+                        path.parent.mkdir(parents=True, exist_ok=True)
+
+                        if member.issym():
+                            if path.is_symlink() or path.exists():
+                                path.unlink()
+                            os.symlink(member.linkname, path)
+                            continue
+                        elif not member.isfile():
+                            logging.debug("Skipping special file %s", member.name)
+                            continue
+
+                        fileobj = tar.extractfile(member)
+                        assert fileobj is not None
+
+                        if member.size > self._max_buffered_size:
+                            # Stream large files straight from the archive
+                            # to keep memory use bounded
+                            with path.open("wb") as f:
+                                shutil.copyfileobj(fileobj, f, _COPY_CHUNK_SIZE)
+                            _finalize_file(path, mode, member.mtime)
+                            logging.debug("Extracted %s (%s bytes)", path, member.size)
+                            if on_extract:
+                                on_extract(path, member.size)
+                            continue
+
+                        pending.append(
+                            executor.submit(
+                                write_file, path, fileobj.read(), mode, member.mtime
+                            )
+                        )
+                        if len(pending) >= self._max_pending_writes:
+                            collect(pending)
+                            pending = []
+            except (tarfile.TarError, OSError) as e:
+                errors.append(str(e))
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+
+            collect(pending)
+
+            if returncode != 0:
+                stderr.seek(0)
+                errors.append(
+                    "'git archive {ref}' exited with status {code}: {msg}".format(
+                        ref=ref,
+                        code=returncode,
+                        msg=stderr.read().decode("utf-8", errors="replace").strip(),
+                    )
+                )
+
+        if errors:
+            logging.error("Error while exporting Git archive of '%s':", ref)
+            for error in errors:
+                logging.error(error)
+            sys.exit(1)
+
+        return True
 
     def modtime(self, version):
+        if version not in self._modtimes:
+            self._modtimes[version] = self._read_modtime(version)
+        return self._modtimes[version]
+
+    def _read_modtime(self, version):
         if version == "dev":
             # Get timestamps of uncommitted changes and return the most recent.
-            # https://stackoverflow.com/a/14142413
-            cmd = (
-                "git status -s | while read mode file;"
-                " do echo $(stat -c %Y $file); done"
+            modtime = self.snapshot().modtime()
+            if modtime is not None:
+                return modtime
+            # Only deletions, which leave no timestamp behind
+            version = "HEAD"
+
+        revision = self.revision(version)
+        if revision is None:
+            logging.error(
+                "Error: Could not resolve '{version}' to a commit".format(
+                    version=version
+                )
             )
-            modtimes = call_shell(cmd).splitlines()
-            # https://stackoverflow.com/a/12010656
-            modtimes = [int(modtime) for modtime in modtimes]
-            return max(modtimes)
-        else:
-            return int(call_shell("git log -1 -s --format=%ct {}".format(version)))
+            sys.exit(1)
+        return revision.timestamp
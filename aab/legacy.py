@@ -33,11 +33,17 @@
 Limited support for porting legacy Qt5 features to Qt6
 """
 
-import shutil
+import io
+import json
+import logging
+import os
 import xml.etree.ElementTree as ElementTree
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional, Set
+from typing import List, Optional, Set, Tuple
+
+from .cache import FileCache, hash_key
+from .copying import CopyEngine
 
 TAG_RCC = "RCC"
 TAG_RESOURCE = "qresource"
@@ -46,11 +52,29 @@ TAG_FILE = "file"
 ATTRIBUTE_PREFIX = "prefix"
 ATTRIBUTE_ALIAS = "alias"
 
+# (prefix, [(relative_path, alias), ...]) of all qresources of a collection
+_Collection = List[Tuple[str, List[Tuple[str, Optional[str]]]]]
+
 
-@dataclass
 class QResourceFileDescriptor:
-    relative_path: str
-    alias: Optional[str] = None
+    """File entry of a qresource. Uses slots, as collections can list tens of
+    thousands of files."""
+
+    __slots__ = ("relative_path", "alias")
+
+    def __init__(self, relative_path: str, alias: Optional[str] = None):
+        self.relative_path = relative_path
+        self.alias = alias
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.relative_path, self.alias) == (other.relative_path, other.alias)
+
+    def __repr__(self) -> str:
+        return "{}(relative_path={!r}, alias={!r})".format(
+            self.__class__.__name__, self.relative_path, self.alias
+        )
 
 
 @dataclass
@@ -65,47 +89,107 @@ class QRCParseError(ElementTree.ParseError):
 
 
 class QRCParser:
-    def __init__(self, qrc_path: Path):
-        self._parent_path = qrc_path.parent
+    """
+    Streaming parser for Qt resource collection files
 
-        try:
-            self._root = ElementTree.parse(qrc_path).getroot()
-        except Exception as e:
-            raise e
+    Parsed collections are cached in the user cache by their contents, so
+    that unchanged .qrc files are not parsed again.
+    """
 
-        if self._root.tag != TAG_RCC:
-            raise QRCParseError(f"Invalid qrc file: {TAG_RCC} tag not found at root")
+    _cache_version = 1
 
-    def get_qresources(self) -> List[QResourceDescriptor]:
-        resources: List[QResourceDescriptor] = []
+    def __init__(self, qrc_path: Path, use_cache: bool = True):
+        self._parent_path = qrc_path.parent
 
-        for resource in self._root.findall(TAG_RESOURCE):
-            prefix = resource.get(ATTRIBUTE_PREFIX)
-            if not prefix:
-                raise QRCParseError(
-                    "qresource definitions without a prefix attribute are currently not"
-                    " supported"
-                )
-            prefix = self._clean_prefix(prefix)
+        contents = qrc_path.read_bytes()
+        cache = FileCache.user_cache("qrc") if use_cache else None
+        cache_key = hash_key(str(self._cache_version), contents)
 
-            files: List[QResourceFileDescriptor] = []
+        collection = self._load_cached(cache, cache_key) if cache else None
+        if collection is None:
+            collection = self._parse(contents)
+            if cache is not None:
+                self._store_cached(cache, cache_key, collection)
+        self._collection = collection
 
-            for file in resource.findall(TAG_FILE):
-                relative_path = file.text
-                if relative_path is None:
-                    raise QRCParseError("file path cannot be None")
-                alias = file.get(ATTRIBUTE_ALIAS)
-                files.append(
+    def get_qresources(self) -> List[QResourceDescriptor]:
+        return [
+            QResourceDescriptor(
+                prefix=prefix,
+                parent_path=self._parent_path,
+                files=[
                     QResourceFileDescriptor(relative_path=relative_path, alias=alias)
-                )
-
-            resources.append(
-                QResourceDescriptor(
-                    prefix=prefix, parent_path=self._parent_path, files=files
-                )
+                    for relative_path, alias in files
+                ],
             )
+            for prefix, files in self._collection
+        ]
 
-        return resources
+    def _load_cached(self, cache: FileCache, cache_key: str) -> Optional[_Collection]:
+        try:
+            entry = cache.get(cache_key)
+            if entry is None:
+                return None
+            with entry.open(encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            # evicted or cut short by a concurrent process, or unusable cache
+            logging.debug("Could not read qrc parse cache: %s", e)
+            return None
+
+    def _store_cached(self, cache: FileCache, cache_key: str, collection: _Collection):
+        # The cache is an optimization, so it must never keep us from building
+        try:
+            cache.store_bytes(cache_key, json.dumps(collection).encode("utf-8"))
+            cache.evict()
+        except OSError as e:
+            logging.debug("Could not write qrc parse cache: %s", e)
+
+    def _parse(self, contents: bytes) -> _Collection:
+        collection: _Collection = []
+        # Files of the qresource that is currently open, if any
+        files: Optional[List[Tuple[str, Optional[str]]]] = None
+        root = None
+        # Like findall, only qresources directly below the root and files
+        # directly below a qresource are taken into account
+        depth = 0
+
+        for event, element in ElementTree.iterparse(
+            io.BytesIO(contents), events=("start", "end")
+        ):
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = element
+                    if root.tag != TAG_RCC:
+                        raise QRCParseError(
+                            f"Invalid qrc file: {TAG_RCC} tag not found at root"
+                        )
+                elif depth == 2 and element.tag == TAG_RESOURCE:
+                    files = []
+                continue
+
+            depth -= 1
+            if depth == 2 and element.tag == TAG_FILE and files is not None:
+                relative_path = element.text
+                if relative_path is None:
+                    raise QRCParseError("file path cannot be None")
+                files.append((relative_path, element.get(ATTRIBUTE_ALIAS)))
+                element.clear()
+            elif depth == 1 and element.tag == TAG_RESOURCE:
+                assert root is not None and files is not None
+                prefix = element.get(ATTRIBUTE_PREFIX)
+                if not prefix:
+                    raise QRCParseError(
+                        "qresource definitions without a prefix attribute are"
+                        " currently not supported"
+                    )
+                collection.append((self._clean_prefix(prefix), files))
+                files = None
+                # Drop parsed elements so that memory use stays flat
+                root.clear()
+
+        return collection
 
     def _clean_prefix(self, prefix: str) -> str:
         if prefix.startswith("/"):
@@ -136,39 +220,41 @@ initialize_qt_resources()
         """returns QDir initialization command"""
 
         prefixes: Set[str] = set()
+        targets: Set[str] = set()
 
-        for resource in resources:
-            prefix = resource.prefix
-            source_parent_path = resource.parent_path
+        # Only copies files that changed since the last migration
+        with CopyEngine() as copier:
+            for resource in resources:
+                prefix = resource.prefix
+                source_parent_path = resource.parent_path
 
-            prefixes.add(prefix)
+                prefixes.add(prefix)
 
-            for file in resource.files:
-                source_relative_path = file.relative_path
-                alias = file.alias
+                for file in resource.files:
+                    source_relative_path = file.relative_path
+                    alias = file.alias
 
-                target_relative_path = source_relative_path if not alias else alias
+                    target_relative_path = source_relative_path if not alias else alias
 
-                source_path = source_parent_path / source_relative_path
-                target_path = self._target_root_path / prefix / target_relative_path
+                    source_path = source_parent_path / source_relative_path
+                    target_path = self._target_root_path / prefix / target_relative_path
 
-                if target_path.exists():
-                    target_path.unlink()
+                    if source_path.is_dir():
+                        targets.update(
+                            os.path.normpath(path)
+                            for path in copier.copy_tree(source_path, target_path)
+                        )
+                    else:
+                        copier.copy_file(source_path, target_path)
+                        targets.add(os.path.normpath(target_path))
 
-                is_dir = False
-                if source_path.is_dir():
-                    target_path.mkdir(parents=True, exist_ok=True)
-                    is_dir = True
-                elif not target_path.parent.exists():
-                    target_path.parent.mkdir(parents=True, exist_ok=True)
+            stats = copier.wait()
 
-                if is_dir:
-                    shutil.copytree(source_path, target_path)
-                else:
-                    shutil.copy(source_path, target_path)
+        removed = self._remove_stale_files(targets)
+        logging.debug("%s, removed %d stale files", stats.summary(), removed)
 
         qdir_addpath_block = "\n".join(
-            self._build_qdir_command(prefix) for prefix in prefixes
+            self._build_qdir_command(prefix) for prefix in sorted(prefixes)
         )
 
         integration_snippet = self._template_integration_snippet.format(
@@ -177,5 +263,24 @@ initialize_qt_resources()
 
         return integration_snippet
 
+    def _remove_stale_files(self, targets: Set[str]) -> int:
+        """Deletes previously migrated files that are no longer listed in any
+        resource collection. Returns the number of deleted files."""
+        removed = 0
+        if not self._target_root_path.is_dir():
+            return removed
+        for root, _, files in os.walk(str(self._target_root_path), topdown=False):
+            if os.path.normpath(root) == os.path.normpath(self._target_root_path):
+                # Home of generated modules like __init__.py
+                continue
+            for file in files:
+                path = os.path.join(root, file)
+                if os.path.normpath(path) not in targets:
+                    os.unlink(path)
+                    removed += 1
+            if not os.listdir(root):
+                os.rmdir(root)
+        return removed
+
     def _build_qdir_command(self, prefix: str):
         return f"""    QDir.addSearchPath("{prefix}", str(Path(__file__).parent / "{prefix}"))"""
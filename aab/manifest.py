@@ -37,6 +37,7 @@ from typing import Any, Dict, Literal, Optional, Union
 
 from .config import Config
 from .git import Git
+from .utils import make_private
 
 DistType = Union[Literal["local"], Literal["ankiweb"]]
 
@@ -49,10 +50,14 @@ class ManifestUtils:
         version: str,
         dist_type: DistType,
         target_dir: Path,
+        git: Optional[Git] = None,
     ):
         logging.info("Writing manifest...")
         manifest = cls.generate_manifest_from_properties(
-            addon_properties=addon_properties, version=version, dist_type=dist_type
+            addon_properties=addon_properties,
+            version=version,
+            dist_type=dist_type,
+            git=git,
         )
         cls.write_manifest(manifest=manifest, target_dir=target_dir)
 
@@ -62,7 +67,17 @@ class ManifestUtils:
         addon_properties: Config,
         version: str,
         dist_type: DistType,
+        git: Optional[Git] = None,
     ) -> Dict[str, Any]:
+        owns_git = git is None
+        git = git or Git()
+        try:
+            modtime = git.modtime(version)
+        finally:
+            # Don't leave the cat-file process of a Git created here running
+            if owns_git:
+                git.close()
+
         manifest = {
             "name": addon_properties["display_name"],
             "package": addon_properties["module_name"],
@@ -71,7 +86,7 @@ class ManifestUtils:
             "version": version,
             "homepage": addon_properties.get("homepage", ""),
             "conflicts": deepcopy(addon_properties["conflicts"]),
-            "mod": Git().modtime(version),
+            "mod": modtime,
         }
 
         # Add version specifiers:
@@ -113,6 +128,7 @@ class ManifestUtils:
     @classmethod
     def write_manifest(cls, manifest: Dict[str, Any], target_dir: Path):
         target_path = target_dir / "manifest.json"
+        make_private(target_path)
         with target_path.open("w", encoding="utf-8") as manifest_file:
             manifest_file.write(
                 json.dumps(manifest, indent=4, sort_keys=False, ensure_ascii=False)
@@ -0,0 +1,775 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+"""
+Zip packaging with parallel compression, per-file compression policies
+and reuse of compressed entries
+"""
+
+import hashlib
+import logging
+import os
+import stat
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+_LOCAL_FILE_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_DIRECTORY_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_OF_CENTRAL_DIRECTORY = struct.Struct("<IHHHHIIH")
+
+_SIGNATURE_LOCAL_FILE_HEADER = 0x04034B50
+_SIGNATURE_CENTRAL_DIRECTORY_HEADER = 0x02014B50
+_SIGNATURE_END_OF_CENTRAL_DIRECTORY = 0x06054B50
+
+_ZIP_VERSION = 20
+_ZIP_CREATE_SYSTEM_UNIX = 3
+_ZIP_FLAG_UTF8 = 0x800
+_ZIP_MAX_SIZE = 0xFFFFFFFF
+_ZIP_MAX_ENTRIES = 0xFFFF
+
+# Private extra field recording the deflate level of an entry in the central
+# directory, so that later packages only reuse streams matching their policy
+_EXTRA_DEFLATE_LEVEL = struct.Struct("<HHb")
+_EXTRA_ID_DEFLATE_LEVEL = 0x6161
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Formats that are compressed already and gain nothing from deflating them
+DEFAULT_STORED_EXTENSIONS = frozenset(
+    (
+        ".7z",
+        ".ankiaddon",
+        ".apkg",
+        ".avif",
+        ".bz2",
+        ".flac",
+        ".gif",
+        ".gz",
+        ".jpeg",
+        ".jpg",
+        ".m4a",
+        ".mkv",
+        ".mp3",
+        ".mp4",
+        ".ogg",
+        ".opus",
+        ".png",
+        ".webm",
+        ".webp",
+        ".woff",
+        ".woff2",
+        ".xz",
+        ".zip",
+        ".zst",
+    )
+)
+
+
+class PackagingError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class CompressionPolicy:
+    """
+    Decides how each file is compressed when packaging
+
+    Files with one of store_extensions are stored as-is. Otherwise, if
+    trial_compression is enabled, the first trial_size bytes of larger files
+    are deflated first, and files that would shrink by less than
+    min_trial_savings are stored as well. Smaller files are deflated in full
+    and stored if their output misses the same mark.
+    """
+
+    level: int = zlib.Z_DEFAULT_COMPRESSION
+    store_extensions: FrozenSet[str] = DEFAULT_STORED_EXTENSIONS
+    trial_compression: bool = True
+    trial_size: int = 64 * 1024
+    min_trial_savings: float = 0.02
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> "CompressionPolicy":
+        """Builds policy from the 'compression' object in addon.json"""
+        extensions = DEFAULT_STORED_EXTENSIONS | frozenset(
+            ext.lower() if ext.startswith(".") else "." + ext.lower()
+            for ext in config.get("store_extensions", [])
+        )
+        return cls(
+            level=config.get("level", zlib.Z_DEFAULT_COMPRESSION),
+            store_extensions=extensions,
+            trial_compression=config.get("trial_compression", True),
+        )
+
+    @property
+    def deflate_level(self) -> int:
+        """Level with zlib's default resolved, for comparing streams"""
+        return 6 if self.level == zlib.Z_DEFAULT_COMPRESSION else self.level
+
+    def is_stored_format(self, path: Path) -> bool:
+        return path.suffix.lower() in self.store_extensions
+
+    def trial_shows_gain(self, block: bytes) -> bool:
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        compressed_size = len(compressor.compress(block) + compressor.flush())
+        return self.shows_gain(len(block), compressed_size)
+
+    def shows_gain(self, size: int, compressed_size: int) -> bool:
+        return compressed_size < size * (1 - self.min_trial_savings)
+
+
+@dataclass
+class PackagingStats:
+    files_reused: int = 0
+    files_deflated: int = 0
+    files_stored: int = 0
+    bytes_deflated_in: int = 0
+    bytes_deflated_out: int = 0
+    bytes_stored: int = 0
+    deflate_time: float = 0.0
+    trial_time: float = 0.0
+
+    def summary(self) -> str:
+        saved_bytes = self.bytes_deflated_in - self.bytes_deflated_out
+        summary = "Deflated {} files ({} saved, {:.2f}s)".format(
+            self.files_deflated, _format_size(saved_bytes), self.deflate_time
+        )
+        if self.files_stored:
+            summary += ", stored {} files without compression ({}".format(
+                self.files_stored, _format_size(self.bytes_stored)
+            )
+            if self.deflate_time and self.bytes_deflated_in:
+                throughput = self.bytes_deflated_in / self.deflate_time
+                estimated_time = self.bytes_stored / throughput - self.trial_time
+                summary += ", ~{:.2f}s saved".format(max(estimated_time, 0.0))
+            summary += ")"
+        if self.files_reused:
+            summary += ", reused {} compressed entries".format(self.files_reused)
+        return summary
+
+
+@dataclass
+class CompressedEntry:
+    """Location of a raw compressed stream inside of an existing zip archive"""
+
+    archive: BinaryIO
+    data_offset: int
+    compress_type: int
+    compress_size: int
+    file_size: int
+    crc: int
+    # Deflate level of deflated entries, None for stored ones
+    level: Optional[int] = None
+
+
+@dataclass
+class _PreparedEntry:
+    source: Path
+    arcname: str
+    stat: os.stat_result
+    digest: str
+    crc: int
+    reused: Optional[CompressedEntry] = None
+    compressed: Optional[BinaryIO] = None
+    compress_size: int = 0
+    stored: bool = False
+    deflate_time: float = 0.0
+    trial_time: float = 0.0
+
+
+class ZipEntryStore:
+    """
+    Raw compressed zip entry streams keyed by the hash of their content, their
+    compression type and deflate level
+
+    Entries are read from packages written earlier in the same run, as well as
+    from existing archives indexed through index_archive. The latter are only
+    matched by CRC and size, so they are verified against the actual file
+    contents before being reused. Deflated entries of indexed archives are
+    only considered if PackageWriter recorded their deflate level.
+
+    Archives are read through os.pread, so lookups are safe to perform from
+    multiple threads.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, int, Optional[int]], CompressedEntry] = {}
+        self._candidates: Dict[Tuple[int, int], List[CompressedEntry]] = {}
+        self._archives: List[BinaryIO] = []
+
+    def index_archive(self, path: Path) -> int:
+        """Registers entries of an existing archive as reuse candidates"""
+        try:
+            archive = path.open("rb")
+            with zipfile.ZipFile(archive) as zf:
+                infolist = zf.infolist()
+        except (OSError, zipfile.BadZipFile) as e:
+            logging.debug("Could not index %s: %s", path, e)
+            return 0
+
+        self._archives.append(archive)
+
+        count = 0
+        for zinfo in infolist:
+            if zinfo.is_dir() or zinfo.compress_type not in (
+                zipfile.ZIP_STORED,
+                zipfile.ZIP_DEFLATED,
+            ):
+                continue
+            level = None
+            if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+                level = _read_deflate_level(zinfo.extra)
+                if level is None:
+                    continue
+            entry = CompressedEntry(
+                archive=archive,
+                data_offset=_get_data_offset(archive, zinfo.header_offset),
+                compress_type=zinfo.compress_type,
+                compress_size=zinfo.compress_size,
+                file_size=zinfo.file_size,
+                crc=zinfo.CRC,
+                level=level,
+            )
+            self._candidates.setdefault((entry.crc, entry.file_size), []).append(entry)
+            count += 1
+
+        return count
+
+    def add(self, digest: str, entry: CompressedEntry):
+        self._entries.setdefault((digest, entry.compress_type, entry.level), entry)
+
+    def lookup(
+        self,
+        digest: str,
+        crc: int,
+        size: int,
+        source: Path,
+        compress_type: int,
+        level: Optional[int] = None,
+    ) -> Optional[CompressedEntry]:
+        """Returns an entry of source compressed with compress_type and, for
+        deflated entries, the given deflate level"""
+        if compress_type != zipfile.ZIP_DEFLATED:
+            level = None
+        key = (digest, compress_type, level)
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+
+        for candidate in self._candidates.get((crc, size), []):
+            if candidate.compress_type != compress_type or candidate.level != level:
+                continue
+            if _matches_file(candidate, source):
+                self._entries[key] = candidate
+                return candidate
+
+        return None
+
+    def close(self):
+        for archive in self._archives:
+            archive.close()
+        self._archives.clear()
+        self._entries.clear()
+        self._candidates.clear()
+
+    def _register_archive(self, archive: BinaryIO):
+        self._archives.append(archive)
+
+
+class PackageWriter:
+    """
+    Minimal zip writer that compresses files on a thread pool and can copy raw
+    compressed streams of unchanged files from a ZipEntryStore instead of
+    compressing them again.
+
+    Entries are always written in the order they were passed in. Compressed
+    data is spooled to temporary files once it grows beyond
+    max_buffered_size, and only a limited number of files are processed
+    ahead of the writer, so memory use stays bounded regardless of file sizes.
+
+    The archive is written to a temporary file next to the target path and
+    only moved into place on close, so that the previous package under the
+    same name can still serve as a source of reusable entries.
+
+    If source_date is set, all entries are stamped with that Unix timestamp
+    (interpreted as UTC) and their permissions normalized to 0644 or 0755,
+    so that identical inputs produce byte-identical archives.
+    """
+
+    max_buffered_size = 4 * 1024 * 1024
+
+    def __init__(
+        self,
+        path: Path,
+        store: Optional[ZipEntryStore] = None,
+        policy: Optional[CompressionPolicy] = None,
+        workers: Optional[int] = None,
+        source_date: Optional[int] = None,
+    ):
+        self._path = path
+        self._tmp_path = path.with_name(".{}.tmp".format(path.name))
+        self._store = store
+        self._policy = policy or CompressionPolicy()
+        self._workers = workers or os.cpu_count() or 1
+        self._source_date = source_date
+        self._fp = self._tmp_path.open("wb")
+        self._central_directory: List[bytes] = []
+        self._written: List[Tuple[str, int, int, int, int, int, Optional[int]]] = []
+        self.stats = PackagingStats()
+
+    def __enter__(self) -> "PackageWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._fp.close()
+            self._tmp_path.unlink()
+
+    def write(self, source: Path, arcname: str):
+        self.write_files([(source, arcname)])
+
+    def write_files(self, files: Iterable[Tuple[Path, str]]):
+        """Compresses files concurrently and writes them in the given order"""
+        window = self._workers * 2
+        pending: Deque[Future] = deque()
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            try:
+                for source, arcname in files:
+                    pending.append(executor.submit(self._prepare, source, arcname))
+                    if len(pending) >= window:
+                        self._write_prepared(pending.popleft().result())
+                while pending:
+                    self._write_prepared(pending.popleft().result())
+            finally:
+                for future in pending:
+                    future.cancel()
+                for future in pending:
+                    if not future.cancelled() and future.exception() is None:
+                        compressed = future.result().compressed
+                        if compressed is not None:
+                            compressed.close()
+
+    def close(self):
+        if self._fp.closed:
+            return
+
+        cd_offset = self._fp.tell()
+        for header in self._central_directory:
+            self._fp.write(header)
+        cd_size = self._fp.tell() - cd_offset
+
+        entries = len(self._central_directory)
+        if entries > _ZIP_MAX_ENTRIES or cd_offset > _ZIP_MAX_SIZE:
+            self._fp.close()
+            self._tmp_path.unlink()
+            raise PackagingError("Package exceeds the limits of non-ZIP64 archives")
+
+        self._fp.write(
+            _END_OF_CENTRAL_DIRECTORY.pack(
+                _SIGNATURE_END_OF_CENTRAL_DIRECTORY,
+                0,
+                0,
+                entries,
+                entries,
+                cd_size,
+                cd_offset,
+                0,
+            )
+        )
+        self._fp.close()
+
+        os.replace(self._tmp_path, self._path)
+
+        if self._store is None:
+            return
+
+        # Make freshly compressed entries available to the next package
+        archive = self._path.open("rb")
+        self._store._register_archive(archive)
+        for (
+            digest,
+            data_offset,
+            compress_type,
+            compress_size,
+            file_size,
+            crc,
+            level,
+        ) in self._written:
+            self._store.add(
+                digest,
+                CompressedEntry(
+                    archive=archive,
+                    data_offset=data_offset,
+                    compress_type=compress_type,
+                    compress_size=compress_size,
+                    file_size=file_size,
+                    crc=crc,
+                    level=level,
+                ),
+            )
+
+    def _prepare(self, source: Path, arcname: str) -> _PreparedEntry:
+        """Runs on worker threads. zlib and hashlib release the GIL."""
+        file_stat = source.stat()
+
+        digest = hashlib.sha256()
+        crc = 0
+        with source.open("rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                crc = zlib.crc32(chunk, crc)
+
+        prepared = _PreparedEntry(
+            source=source,
+            arcname=arcname,
+            stat=file_stat,
+            digest=digest.hexdigest(),
+            crc=crc,
+        )
+
+        policy = self._policy
+
+        if policy.is_stored_format(source):
+            prepared.stored = True
+        elif policy.trial_compression and file_stat.st_size > policy.trial_size:
+            start = time.perf_counter()
+            with source.open("rb") as f:
+                block = f.read(policy.trial_size)
+            prepared.stored = not policy.trial_shows_gain(block)
+            prepared.trial_time = time.perf_counter() - start
+
+        if self._lookup_reusable(prepared):
+            return prepared
+
+        if prepared.stored:
+            return prepared
+
+        start = time.perf_counter()
+        compressed = tempfile.SpooledTemporaryFile(max_size=self.max_buffered_size)
+        compressor = zlib.compressobj(policy.level, zlib.DEFLATED, -15)
+        with source.open("rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                compressed.write(compressor.compress(chunk))
+        compressed.write(compressor.flush())
+        deflate_time = time.perf_counter() - start
+
+        if policy.trial_compression and not policy.shows_gain(
+            file_stat.st_size, compressed.tell()
+        ):
+            # The full output is the only trial files below trial_size get
+            compressed.close()
+            prepared.stored = True
+            prepared.trial_time += deflate_time
+            self._lookup_reusable(prepared)
+            return prepared
+
+        prepared.deflate_time = deflate_time
+        prepared.compressed = compressed  # type: ignore[assignment]
+        prepared.compress_size = compressed.tell()
+        compressed.seek(0)
+
+        return prepared
+
+    def _lookup_reusable(self, prepared: _PreparedEntry) -> bool:
+        """Looks for a stream that matches what the policy would produce"""
+        if self._store is None:
+            return False
+        prepared.reused = self._store.lookup(
+            prepared.digest,
+            prepared.crc,
+            prepared.stat.st_size,
+            prepared.source,
+            compress_type=(
+                zipfile.ZIP_STORED if prepared.stored else zipfile.ZIP_DEFLATED
+            ),
+            level=self._policy.deflate_level,
+        )
+        return prepared.reused is not None
+
+    def _write_prepared(self, prepared: _PreparedEntry):
+        stats = self.stats
+        stats.trial_time += prepared.trial_time
+
+        if prepared.reused is not None:
+            entry = prepared.reused
+            self._write_entry(
+                prepared,
+                compress_type=entry.compress_type,
+                file_size=entry.file_size,
+                compress_size=entry.compress_size,
+                level=entry.level,
+            )
+            _copy_raw(entry, self._fp)
+            stats.files_reused += 1
+            return
+
+        file_size = prepared.stat.st_size
+
+        if prepared.stored:
+            self._write_entry(
+                prepared,
+                compress_type=zipfile.ZIP_STORED,
+                file_size=file_size,
+                compress_size=file_size,
+            )
+            with prepared.source.open("rb") as f:
+                copied = 0
+                for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                    self._fp.write(chunk)
+                    copied += len(chunk)
+            if copied != file_size:
+                raise PackagingError(f"{prepared.source} changed while packaging")
+            stats.files_stored += 1
+            stats.bytes_stored += file_size
+            return
+
+        assert prepared.compressed is not None
+        with prepared.compressed as compressed:
+            self._write_entry(
+                prepared,
+                compress_type=zipfile.ZIP_DEFLATED,
+                file_size=file_size,
+                compress_size=prepared.compress_size,
+                level=self._policy.deflate_level,
+            )
+            for chunk in iter(lambda: compressed.read(_CHUNK_SIZE), b""):
+                self._fp.write(chunk)
+        stats.files_deflated += 1
+        stats.bytes_deflated_in += file_size
+        stats.bytes_deflated_out += prepared.compress_size
+        stats.deflate_time += prepared.deflate_time
+
+    def _write_entry(
+        self,
+        prepared: _PreparedEntry,
+        compress_type: int,
+        file_size: int,
+        compress_size: int,
+        level: Optional[int] = None,
+    ):
+        arcname = prepared.arcname
+        if file_size > _ZIP_MAX_SIZE or compress_size > _ZIP_MAX_SIZE:
+            raise PackagingError(
+                f"{arcname} exceeds the size limit of non-ZIP64 archives"
+            )
+
+        name = arcname.replace(os.sep, "/")
+        try:
+            encoded_name = name.encode("ascii")
+            flags = 0
+        except UnicodeEncodeError:
+            encoded_name = name.encode("utf-8")
+            flags = _ZIP_FLAG_UTF8
+
+        extra = b""
+        if compress_type == zipfile.ZIP_DEFLATED and level is not None:
+            extra = _EXTRA_DEFLATE_LEVEL.pack(
+                _EXTRA_ID_DEFLATE_LEVEL, _EXTRA_DEFLATE_LEVEL.size - 4, level
+            )
+
+        if self._source_date is not None:
+            dos_time, dos_date = _dos_datetime(
+                self._source_date, time_converter=time.gmtime
+            )
+            mode = _normalize_mode(prepared.stat.st_mode)
+        else:
+            dos_time, dos_date = _dos_datetime(prepared.stat.st_mtime)
+            mode = prepared.stat.st_mode
+        header_offset = self._fp.tell()
+
+        self._fp.write(
+            _LOCAL_FILE_HEADER.pack(
+                _SIGNATURE_LOCAL_FILE_HEADER,
+                _ZIP_VERSION,
+                flags,
+                compress_type,
+                dos_time,
+                dos_date,
+                prepared.crc,
+                compress_size,
+                file_size,
+                len(encoded_name),
+                0,
+            )
+        )
+        self._fp.write(encoded_name)
+
+        self._central_directory.append(
+            _CENTRAL_DIRECTORY_HEADER.pack(
+                _SIGNATURE_CENTRAL_DIRECTORY_HEADER,
+                _ZIP_CREATE_SYSTEM_UNIX << 8 | _ZIP_VERSION,
+                _ZIP_VERSION,
+                flags,
+                compress_type,
+                dos_time,
+                dos_date,
+                prepared.crc,
+                compress_size,
+                file_size,
+                len(encoded_name),
+                len(extra),
+                0,
+                0,
+                0,
+                (mode & 0xFFFF) << 16,
+                header_offset,
+            )
+            + encoded_name
+            + extra
+        )
+
+        self._written.append(
+            (
+                prepared.digest,
+                self._fp.tell(),
+                compress_type,
+                compress_size,
+                file_size,
+                prepared.crc,
+                level if compress_type == zipfile.ZIP_DEFLATED else None,
+            )
+        )
+
+
+def _format_size(size: int) -> str:
+    return "{:.1f} MiB".format(size / 1024**2)
+
+
+def _dos_datetime(
+    timestamp: float, time_converter: Callable[..., time.struct_time] = time.localtime
+) -> Tuple[int, int]:
+    year, month, day, hour, minute, second = time_converter(timestamp)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    elif year > 2107:
+        year, month, day, hour, minute, second = 2107, 12, 31, 23, 59, 58
+    dos_time = hour << 11 | minute << 5 | second // 2
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    return dos_time, dos_date
+
+
+def _normalize_mode(mode: int) -> int:
+    if mode & stat.S_IXUSR:
+        return stat.S_IFREG | 0o755
+    return stat.S_IFREG | 0o644
+
+
+def _read_deflate_level(extra: bytes) -> Optional[int]:
+    """Returns the deflate level recorded by PackageWriter, if any"""
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, size = struct.unpack_from("<HH", extra, offset)
+        if (
+            header_id == _EXTRA_ID_DEFLATE_LEVEL
+            and size == _EXTRA_DEFLATE_LEVEL.size - 4
+            and offset + _EXTRA_DEFLATE_LEVEL.size <= len(extra)
+        ):
+            return _EXTRA_DEFLATE_LEVEL.unpack_from(extra, offset)[2]
+        offset += 4 + size
+    return None
+
+
+def _get_data_offset(archive: BinaryIO, header_offset: int) -> int:
+    header = _LOCAL_FILE_HEADER.unpack(
+        os.pread(archive.fileno(), _LOCAL_FILE_HEADER.size, header_offset)
+    )
+    if header[0] != _SIGNATURE_LOCAL_FILE_HEADER:
+        raise zipfile.BadZipFile("Bad local file header signature")
+    name_length, extra_length = header[9], header[10]
+    return header_offset + _LOCAL_FILE_HEADER.size + name_length + extra_length
+
+
+def _iter_raw(entry: CompressedEntry) -> Iterable[bytes]:
+    fd = entry.archive.fileno()
+    offset = entry.data_offset
+    remaining = entry.compress_size
+    while remaining:
+        chunk = os.pread(fd, min(remaining, _CHUNK_SIZE), offset)
+        if not chunk:
+            raise PackagingError("Unexpected end of archive while reading entry")
+        yield chunk
+        offset += len(chunk)
+        remaining -= len(chunk)
+
+
+def _copy_raw(entry: CompressedEntry, fp: BinaryIO):
+    for chunk in _iter_raw(entry):
+        fp.write(chunk)
+
+
+def _matches_file(entry: CompressedEntry, source: Path) -> bool:
+    """Compares uncompressed entry contents with source, chunk by chunk"""
+    decompressor = (
+        zlib.decompressobj(-15) if entry.compress_type == zipfile.ZIP_DEFLATED else None
+    )
+    try:
+        with source.open("rb") as f:
+            for raw in _iter_raw(entry):
+                if decompressor is None:
+                    if f.read(len(raw)) != raw:
+                        return False
+                    continue
+                while raw:
+                    # Limit output size to keep memory use bounded
+                    data = decompressor.decompress(raw, _CHUNK_SIZE)
+                    if f.read(len(data)) != data:
+                        return False
+                    raw = decompressor.unconsumed_tail
+            if decompressor:
+                data = decompressor.flush()
+                if f.read(len(data)) != data:
+                    return False
+            return f.read(1) == b""
+    except (zlib.error, PackagingError, OSError):
+        return False
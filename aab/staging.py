@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+"""
+Staging of dist trees through a content store
+"""
+
+import fcntl
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from pathlib import Path
+from typing import IO, Callable, Optional
+
+# ioctl request to share the data of another file on Linux (btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+METHOD_REFLINK = "reflink"
+METHOD_HARDLINK = "hardlink"
+METHOD_COPY = "copy"
+
+
+def clone_file(source: Path, target: Path) -> str:
+    """Places a copy of source at target that shares its data where possible
+
+    Reflinks are tried first as they are true copy-on-write copies. Hard links
+    come next, so callers need to make sure that target is never modified in
+    place (see utils.make_private). Falls back to regular copies.
+
+    Returns:
+        str -- The method that was used
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            with source.open("rb") as src, target.open("xb") as dst:
+                try:
+                    fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+                except OSError:
+                    cloned = False
+                else:
+                    cloned = True
+            if cloned:
+                shutil.copystat(str(source), str(target))
+                return METHOD_REFLINK
+            target.unlink()
+        except OSError:
+            pass
+    try:
+        os.link(source, target)
+        return METHOD_HARDLINK
+    except OSError:
+        pass
+    shutil.copy2(str(source), str(target))
+    return METHOD_COPY
+
+
+class ContentStore:
+    """
+    Store of file contents that dist trees are assembled from
+
+    Entries are immutable and addressed by the key they were added with, e.g.
+    a Git object ID combined with the file mode. They are staged into dist
+    trees via clone_file, so the store has to live on the same filesystem as
+    the dist tree for links to work.
+    """
+
+    max_size = 1024**3
+
+    def __init__(self, path: Path):
+        self._path = path
+        self.stats: Counter = Counter()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def get(self, key: str) -> Optional[Path]:
+        entry = self._entry_path(key)
+        return entry if entry.exists() else None
+
+    def add(
+        self, key: str, write: Callable[[IO[bytes]], object], mode: int, mtime: float
+    ) -> Path:
+        """Adds an entry whose contents are written out by the write callback"""
+        entry = self._entry_path(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=entry.parent, prefix=".tmp-", delete=False
+        ) as f:
+            try:
+                write(f)
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        os.chmod(f.name, mode)
+        os.utime(f.name, (mtime, mtime))
+        os.replace(f.name, entry)
+        self.stats["added"] += 1
+        return entry
+
+    def stage(self, key: str, target: Path, mtime: float) -> str:
+        """Places the entry under key at target and stamps it with mtime
+
+        Entries can be shared by several versions, so the time they were
+        added at does not necessarily match the version that is staged.
+        """
+        if target.exists() or target.is_symlink():
+            target.unlink()
+        method = clone_file(self._entry_path(key), target)
+        os.utime(target, (mtime, mtime))
+        self.stats[method] += 1
+        return method
+
+    def prune(self):
+        """Removes entries that no dist tree links to anymore, least recently
+        staged first, until the store fits max_size"""
+        entries = []
+        total_size = 0
+        for entry in self._path.glob("*/*"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            total_size += stat.st_size
+            if stat.st_nlink == 1:
+                # Creating a link updates the ctime of the shared inode
+                entries.append((stat.st_ctime, stat.st_size, entry))
+
+        if total_size <= self.max_size:
+            return
+
+        logging.debug("Pruning content store at %s...", self._path)
+        entries.sort()
+        for _, size, entry in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def summary(self) -> str:
+        return "Staged {staged} files ({linked} linked, {copied} copied)".format(
+            staged=sum(
+                self.stats[m] for m in (METHOD_REFLINK, METHOD_HARDLINK, METHOD_COPY)
+            ),
+            linked=self.stats[METHOD_REFLINK] + self.stats[METHOD_HARDLINK],
+            copied=self.stats[METHOD_COPY],
+        )
+
+    def _entry_path(self, key: str) -> Path:
+        return self._path / key[:2] / key[2:]
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+"""
+Build tracing with Chrome trace-event export
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+CATEGORY_PHASE = "phase"
+CATEGORY_SUBPROCESS = "subprocess"
+CATEGORY_FORM = "form"
+
+_MAX_NAME_LENGTH = 80
+
+
+class Tracer:
+    """
+    Collects timed spans and exports them in the Chrome trace-event format
+
+    The resulting JSON can be loaded into chrome://tracing or
+    https://ui.perfetto.dev. Timestamps are taken from time.perf_counter_ns,
+    which uses a system-wide monotonic clock on Linux and macOS, so spans
+    recorded in worker processes line up with those of the main process.
+    """
+
+    def __init__(self):
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(
+        self, name: str, category: str = CATEGORY_PHASE, **args: Any
+    ) -> Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add_span(name, category, start, time.perf_counter_ns(), **args)
+
+    def add_span(
+        self,
+        name: str,
+        category: str,
+        start: int,
+        end: int,
+        pid: Optional[int] = None,
+        tid: Optional[int] = None,
+        **args: Any,
+    ):
+        """Records a span between two time.perf_counter_ns timestamps"""
+        if len(name) > _MAX_NAME_LENGTH:
+            name = name[: _MAX_NAME_LENGTH - 3] + "..."
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start / 1000,
+            "dur": (end - start) / 1000,
+            "pid": pid if pid is not None else os.getpid(),
+            "tid": tid if tid is not None else threading.get_ident(),
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def write(self, path: Path):
+        with self._lock:
+            events = list(self._events)
+        events.append(
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "args": {"name": "aab"},
+            }
+        )
+        with path.open("w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def slowest(self, category: str, limit: int = 5) -> List[Dict[str, Any]]:
+        with self._lock:
+            events = [event for event in self._events if event["cat"] == category]
+        return sorted(events, key=lambda event: event["dur"], reverse=True)[:limit]
+
+    def summary(self, limit: int = 5) -> str:
+        lines = []
+        for title, category in (
+            ("Slowest phases", CATEGORY_PHASE),
+            ("Slowest forms", CATEGORY_FORM),
+        ):
+            events = self.slowest(category, limit)
+            if not events:
+                continue
+            lines.append("{}:".format(title))
+            for event in events:
+                lines.append(
+                    "  {:>9.3f}s  {}".format(event["dur"] / 1e6, event["name"])
+                )
+        return "\n".join(lines)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def start_tracing() -> Tracer:
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop_tracing() -> Optional[Tracer]:
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+@contextmanager
+def span(name: str, category: str = CATEGORY_PHASE, **args: Any) -> Iterator[None]:
+    """Times the enclosed block if tracing is enabled"""
+    if _tracer is None:
+        yield
+        return
+    with _tracer.span(name, category, **args):
+        yield
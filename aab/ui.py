@@ -33,24 +33,36 @@
 UI Compilation
 """
 
+import hashlib
+import importlib
+import importlib.metadata
+import importlib.util
+import io
+import json
 import logging
+import multiprocessing
+import os
 import re
 import shutil
-from datetime import datetime
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Optional
-
-from whichcraft import which
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from . import __title__, __version__
+from .cache import FileCache, hash_key
 from .config import Config
-from .legacy import QRCMigrator, QRCParser, QResourceDescriptor
-from .utils import call_shell
+from .tracing import CATEGORY_FORM, get_tracer, span
+from .utils import call_shell, make_private
 
 QT_RESOURCES_FOLDER_NAME = "resources"
 QT_DESIGNER_FOLDER_NAME = "designer"
 FORMS_PACKAGE_NAME = "forms"
 RESOURCES_PACKAGE_NAME = "resources"
+# relative to the dist root, outside of the add-on package
+UI_BUILD_STATE_FOLDER = Path("build") / ".aab" / "ui"
 
 _template_header = '''\
 # -*- coding: utf-8 -*-
@@ -109,39 +121,167 @@ class QtVersion(Enum):
     qt6 = 6
 
 
+# Form compilation workers
+##############################################################################
+
+# uic compiler of the current worker process, set up once by the pool initializer
+_worker_compile_ui: Optional[Callable] = None
+
+
+def _load_compile_ui(qt_version_number: int) -> Callable:
+    uic = importlib.import_module(f"PyQt{qt_version_number}.uic")
+    return uic.compileUi
+
+
+def _compile_form_source(compile_ui: Callable, in_file: str) -> str:
+    """Equivalent of running 'pyuic{5,6} in_file', but writing to a buffer"""
+    buffer = io.StringIO()
+    compile_ui(in_file, buffer)
+    return buffer.getvalue()
+
+
+def _init_uic_worker(qt_version_number: int):
+    global _worker_compile_ui
+    _worker_compile_ui = _load_compile_ui(qt_version_number)
+
+
+def _compile_form_in_worker(in_file: str) -> Tuple[str, int, int, int]:
+    """Returns the form source along with the pid of the worker and the
+    perf_counter_ns timestamps the compilation started and ended at"""
+    assert _worker_compile_ui is not None
+    start = time.perf_counter_ns()
+    source = _compile_form_source(_worker_compile_ui, in_file)
+    return source, os.getpid(), start, time.perf_counter_ns()
+
+
 class UIBuilder:
 
     _re_munge = re.compile(r"^import .+?_rc(\n)?$", re.MULTILINE)
     _ui_file_glob = "*.ui"
     _ui_file_tool = "pyuic"
+    _build_state_version = 1
 
-    def __init__(self, dist: Path, config: Config):
+    def __init__(
+        self,
+        dist: Path,
+        config: Config,
+        jobs: int = 1,
+        in_process: bool = False,
+        form_cache: Optional[FileCache] = None,
+        timestamp: Optional[int] = None,
+    ):
+        """
+        Keyword Arguments:
+            timestamp {int} -- Unix timestamp to derive the years in generated
+                               file headers from, instead of the current date.
+                               Used for reproducible builds.
+        """
         self._dist = dist
         self._config = config
+        self._jobs = jobs
+        self._in_process = in_process
+        self._form_cache = form_cache
+        self._timestamp = timestamp
+        self._worker_pools: Dict[int, ProcessPoolExecutor] = {}
 
         self._gui_path: Path = self._dist / "src" / self._config["module_name"] / "gui"
         self._resources_source_path = self._dist / QT_RESOURCES_FOLDER_NAME
         self._resources_out_path = self._gui_path / RESOURCES_PACKAGE_NAME
         self._forms_source_path = self._dist / QT_DESIGNER_FOLDER_NAME
         self._forms_out_path = self._gui_path / FORMS_PACKAGE_NAME
+        self._build_state_path = self._dist / UI_BUILD_STATE_FOLDER
+
+        self._tool_versions: Dict[str, str] = {}
 
         self._format_dict = self._get_format_dict()
 
     def build(self, qt_version: QtVersion, pyenv=None) -> bool:
-        qt_version_key = qt_version.name
+        resource_prefixes_to_replace = self.prepare_resources()
+        return self._build_target(
+            qt_version=qt_version,
+            resource_prefixes_to_replace=resource_prefixes_to_replace,
+            pyenv=pyenv,
+        )
 
-        logging.info("Starting UI build tasks for target %r...", qt_version_key)
+    def build_targets(
+        self,
+        qt_versions: List[QtVersion],
+        pyenv=None,
+        resource_prefixes_to_replace: Optional[List[str]] = None,
+    ) -> bool:
+        """Builds UI for all Qt versions concurrently and then writes the Qt shim
 
-        path_in = self._forms_source_path
-        path_out = self._forms_out_path / qt_version_key
+        Resources are migrated once and shared by all targets, unless the
+        prefixes of already migrated resources are passed in. Returns True if
+        forms were built for at least one target.
+        """
+        if resource_prefixes_to_replace is None:
+            resource_prefixes_to_replace = self.prepare_resources()
+
+        # Each target writes to its own forms package, and the actual work happens
+        # in subprocesses or worker processes, so threads suffice here
+        with ThreadPoolExecutor(max_workers=max(len(qt_versions), 1)) as executor:
+            jobs = [
+                executor.submit(
+                    self._build_target,
+                    qt_version=qt_version,
+                    resource_prefixes_to_replace=resource_prefixes_to_replace,
+                    pyenv=pyenv,
+                )
+                for qt_version in qt_versions
+            ]
+            results = [job.result() for job in jobs]
+
+        if not any(results):
+            return False
+
+        logging.info("Writing Qt compatibility shim...")
+        self.create_qt_shim()
+        logging.info("Done.")
+
+        return True
+
+    def create_qt_shim(self):
+        if not self._forms_out_path.is_dir():
+            return False
+        out_path = self._forms_out_path / "__init__.py"
+        if out_path.exists():
+            out_path.unlink()
+        format_dict = self._format_dict
+        content = _template_qt_shim.format(**format_dict)
+        with out_path.open("w", encoding="utf-8") as f:
+            f.write(content)
+        return True
 
+    def close(self):
+        """Shut down any form compilation workers that are still running"""
+        for pool in self._worker_pools.values():
+            pool.shutdown()
+        self._worker_pools.clear()
+
+    def prepare_resources(self) -> List[str]:
+        """Migrates Qt resources if enabled. Returns list of prefixes to replace
+        in built UI forms"""
         if (
             self._resources_source_path.exists()
             and self._config.get("qt_resource_migration_mode") != "disabled"
         ):
-            resource_prefixes_to_replace = self._migrate_resources()
-        else:
-            resource_prefixes_to_replace = []
+            with span("migrate resources"):
+                return self._migrate_resources()
+        return []
+
+    def _build_target(
+        self,
+        qt_version: QtVersion,
+        resource_prefixes_to_replace: List[str],
+        pyenv: Optional[str] = None,
+    ) -> bool:
+        qt_version_key = qt_version.name
+
+        logging.info("Starting UI build tasks for target %r...", qt_version_key)
+
+        path_in = self._forms_source_path
+        path_out = self._forms_out_path / qt_version_key
 
         if not path_in.exists():
             logging.warning(
@@ -150,30 +290,19 @@ class UIBuilder:
             )
             return False
 
-        ret = self._build(
-            path_in=path_in,
-            path_out=path_out,
-            qt_version_number=qt_version.value,
-            resource_prefixes_to_replace=resource_prefixes_to_replace,
-            pyenv=pyenv,
-        )
+        with span("build ui {}".format(qt_version_key)):
+            ret = self._build(
+                path_in=path_in,
+                path_out=path_out,
+                qt_version_number=qt_version.value,
+                resource_prefixes_to_replace=resource_prefixes_to_replace,
+                pyenv=pyenv,
+            )
 
-        logging.info("Done with all UI build tasks.")
+        logging.info("Done with UI build tasks for target %r.", qt_version_key)
 
         return ret
 
-    def create_qt_shim(self):
-        if not self._forms_out_path.is_dir():
-            return False
-        out_path = self._forms_out_path / "__init__.py"
-        if out_path.exists():
-            out_path.unlink()
-        format_dict = self._format_dict
-        content = _template_qt_shim.format(**format_dict)
-        with out_path.open("w", encoding="utf-8") as f:
-            f.write(content)
-        return True
-
     def _build(
         self,
         path_in: Path,
@@ -186,13 +315,23 @@ class UIBuilder:
 
         # Basic checks
 
-        ui_files = list(path_in.glob(self._ui_file_glob))
+        ui_files = sorted(path_in.glob(self._ui_file_glob))
         if not ui_files:
             logging.warning("No forms found in %s. Skipping %s build.", path_in, tool)
             return False
 
         tool = "{tool}{nr}".format(tool=tool, nr=qt_version_number)
-        if which(tool) is None:
+        # pyenv environments can only be activated through the shell
+        use_uic_api = (self._jobs > 1 or self._in_process) and not pyenv
+        if use_uic_api:
+            tool_available = (
+                importlib.util.find_spec(f"PyQt{qt_version_number}") is not None
+            )
+        else:
+            from whichcraft import which
+
+            tool_available = which(tool) is not None
+        if not tool_available:
             logging.error(
                 f"ERROR: {tool} not found. Please make sure PyQt{qt_version_number} is"
                 " installed, or change the configuration to build the add-on for a"
@@ -207,15 +346,210 @@ class UIBuilder:
             tool,
         )
 
-        # Cleanup
+        # Staleness checks
+
+        tool_version = self._get_tool_version(
+            tool=tool,
+            use_uic_api=use_uic_api,
+            qt_version_number=qt_version_number,
+            pyenv=pyenv,
+        )
+        build_key = hash_key(
+            str(self._build_state_version),
+            tool_version,
+            "\n".join(sorted(resource_prefixes_to_replace)),
+            _template_header.format(**self._format_dict),
+        )
+        state = self._read_build_state(path_out)
+
+        if (
+            state is None
+            or state.get("build_key") != build_key
+            or not path_out.is_dir()
+        ):
+            logging.debug("Cleaning up old forms...")
+            if path_out.exists():
+                shutil.rmtree(str(path_out))
+            path_out.mkdir(parents=True)
+            state = {"forms": {}, "modules": None}
+
+        previous_forms: Dict[str, Dict[str, Any]] = state["forms"]
+        forms: Dict[str, Dict[str, Any]] = {}
+        stale_files: List[Path] = []
+
+        for in_file in ui_files:
+            stem = in_file.stem
+            out_file = Path(path_out / stem).with_suffix(".py")
+            previous = previous_forms.get(stem)
+            fingerprint = self._fingerprint_form(in_file, previous)
+            forms[stem] = fingerprint
+            if (
+                not out_file.exists()
+                or previous is None
+                or previous.get("path") != fingerprint["path"]
+                or previous.get("digest") != fingerprint["digest"]
+            ):
+                stale_files.append(in_file)
+
+        for stem in previous_forms.keys() - forms.keys():
+            logging.debug("Removing form '%s' with deleted source...", stem)
+            out_file = Path(path_out / stem).with_suffix(".py")
+            if out_file.exists():
+                out_file.unlink()
+
+        if len(stale_files) < len(ui_files):
+            logging.info(
+                "Skipping %s up-to-date forms.", len(ui_files) - len(stale_files)
+            )
+
+        # Form cache lookups
 
-        logging.debug("Cleaning up old forms...")
-        if path_out.exists():
-            shutil.rmtree(str(path_out))
-        path_out.mkdir(parents=True)
+        cache_keys: Dict[str, str] = {}
+        uncached_files: List[Path] = []
+
+        for in_file in stale_files:
+            stem = in_file.stem
+            if self._form_cache is None:
+                uncached_files.append(in_file)
+                continue
+            cache_key = self._get_form_cache_key(
+                forms[stem],
+                qt_version_number,
+                tool_version,
+                resource_prefixes_to_replace,
+            )
+            cache_keys[stem] = cache_key
+            out_file = Path(path_out / stem).with_suffix(".py")
+            if self._form_cache.retrieve(cache_key, out_file):
+                logging.debug("Using cached build of element '%s'", stem)
+            else:
+                uncached_files.append(in_file)
+
+        if len(uncached_files) < len(stale_files):
+            logging.info(
+                "Restored %s forms from cache.", len(stale_files) - len(uncached_files)
+            )
 
         # UI build loop
 
+        if uncached_files:
+            if use_uic_api and self._jobs > 1:
+                self._build_with_workers(
+                    uncached_files,
+                    path_out,
+                    qt_version_number,
+                    resource_prefixes_to_replace,
+                )
+            elif use_uic_api:
+                self._build_in_process(
+                    uncached_files,
+                    path_out,
+                    qt_version_number,
+                    resource_prefixes_to_replace,
+                )
+            else:
+                self._build_with_shell(
+                    uncached_files, path_out, tool, resource_prefixes_to_replace, pyenv
+                )
+
+        if self._form_cache is not None and uncached_files:
+            for in_file in uncached_files:
+                out_file = Path(path_out / in_file.stem).with_suffix(".py")
+                self._form_cache.store(cache_keys[in_file.stem], out_file)
+            self._form_cache.evict()
+
+        # Last steps
+
+        modules = [in_file.stem for in_file in ui_files]
+
+        if modules != state["modules"] or not (path_out / "__init__.py").exists():
+            self._write_init_file(modules, path_out)
+
+        self._write_build_state(
+            path_out, {"build_key": build_key, "forms": forms, "modules": modules}
+        )
+
+        logging.debug("Done with forms.")
+        return True
+
+    def _get_tool_version(
+        self,
+        tool: str,
+        use_uic_api: bool,
+        qt_version_number: int,
+        pyenv: Optional[str] = None,
+    ) -> str:
+        if use_uic_api:
+            return "PyQt{} {}".format(
+                qt_version_number,
+                importlib.metadata.version(f"PyQt{qt_version_number}"),
+            )
+
+        cache_key = f"{pyenv}:{tool}"
+        if cache_key not in self._tool_versions:
+            env = "" if not pyenv else self._pyenv_prefix(pyenv)
+            self._tool_versions[cache_key] = call_shell(
+                "{env} {tool} --version".format(env=env, tool=tool)
+            )
+        return self._tool_versions[cache_key]
+
+    def _get_form_cache_key(
+        self,
+        fingerprint: Dict[str, Any],
+        qt_version_number: int,
+        tool_version: str,
+        resource_prefixes_to_replace: List[str],
+    ) -> str:
+        return hash_key(
+            str(self._build_state_version),
+            str(qt_version_number),
+            tool_version,
+            "\n".join(sorted(resource_prefixes_to_replace)),
+            fingerprint["path"],
+            fingerprint["digest"],
+        )
+
+    def _fingerprint_form(
+        self, in_file: Path, previous: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        stat = in_file.stat()
+        fingerprint = {
+            # relative path is part of the generated form header
+            "path": str(self._relative_to_cwd(in_file)),
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+        }
+        if previous and all(
+            previous.get(key) == value for key, value in fingerprint.items()
+        ):
+            # make-style shortcut: unchanged stat info implies unchanged content
+            fingerprint["digest"] = previous.get("digest")
+        else:
+            fingerprint["digest"] = hashlib.sha256(in_file.read_bytes()).hexdigest()
+        return fingerprint
+
+    def _read_build_state(self, path_out: Path) -> Optional[Dict[str, Any]]:
+        state_path = self._build_state_path / f"{path_out.name}.json"
+        try:
+            with state_path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_build_state(self, path_out: Path, state: Dict[str, Any]):
+        self._build_state_path.mkdir(parents=True, exist_ok=True)
+        state_path = self._build_state_path / f"{path_out.name}.json"
+        with state_path.open("w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+
+    def _build_with_shell(
+        self,
+        ui_files: List[Path],
+        path_out: Path,
+        tool: str,
+        resource_prefixes_to_replace: List[str],
+        pyenv: Optional[str] = None,
+    ) -> List[str]:
         modules = []
 
         env = "" if not pyenv else self._pyenv_prefix(pyenv)
@@ -232,18 +566,124 @@ class UIBuilder:
                 in_file=self._relative_to_cwd(in_file),
                 out_file=self._relative_to_cwd(out_file),
             )
-            call_shell(cmd)
+            with span(self._form_span_name(in_file, tool), CATEGORY_FORM, tool=tool):
+                call_shell(cmd)
 
-            self._munge_form(out_file, resource_prefixes_to_replace)
+                self._munge_form(out_file, resource_prefixes_to_replace)
 
             modules.append(stem)
 
-        # Last steps
+        return modules
 
-        self._write_init_file(modules, path_out)
+    def _build_with_workers(
+        self,
+        ui_files: List[Path],
+        path_out: Path,
+        qt_version_number: int,
+        resource_prefixes_to_replace: List[str],
+    ) -> List[str]:
+        pool = self._get_worker_pool(qt_version_number)
+        tracer = get_tracer()
 
-        logging.debug("Done with forms.")
-        return True
+        jobs: List[Future] = []
+        for in_file in ui_files:
+            logging.debug("Queueing element '%s'...", in_file.stem)
+            # Use relative paths to improve readability of form header:
+            jobs.append(
+                pool.submit(
+                    _compile_form_in_worker, str(self._relative_to_cwd(in_file))
+                )
+            )
+
+        modules = []
+
+        # Post-process results in input order so that output matches serial builds
+        for in_file, job in zip(ui_files, jobs):
+            stem = in_file.stem
+            out_file = Path(path_out / stem).with_suffix(".py")
+            try:
+                source, pid, start, end = job.result()
+            except Exception as e:
+                self._log_compile_error(in_file, e)
+                sys.exit(1)
+
+            if tracer is not None:
+                tool = f"PyQt{qt_version_number}"
+                tracer.add_span(
+                    self._form_span_name(in_file, tool),
+                    CATEGORY_FORM,
+                    start,
+                    end,
+                    pid=pid,
+                    tid=pid,
+                    tool=tool,
+                )
+
+            self._write_form(out_file, source, resource_prefixes_to_replace)
+
+            modules.append(stem)
+
+        return modules
+
+    def _build_in_process(
+        self,
+        ui_files: List[Path],
+        path_out: Path,
+        qt_version_number: int,
+        resource_prefixes_to_replace: List[str],
+    ) -> List[str]:
+        compile_ui = _load_compile_ui(qt_version_number)
+        tool = f"PyQt{qt_version_number}"
+
+        modules = []
+
+        for in_file in ui_files:
+            stem = in_file.stem
+            out_file = Path(path_out / stem).with_suffix(".py")
+
+            logging.debug("Building element '%s'...", stem)
+            with span(self._form_span_name(in_file, tool), CATEGORY_FORM, tool=tool):
+                try:
+                    # Use relative paths to improve readability of form header:
+                    source = _compile_form_source(
+                        compile_ui, str(self._relative_to_cwd(in_file))
+                    )
+                except Exception as e:
+                    self._log_compile_error(in_file, e)
+                    sys.exit(1)
+
+                self._write_form(out_file, source, resource_prefixes_to_replace)
+
+            modules.append(stem)
+
+        return modules
+
+    def _form_span_name(self, in_file: Path, tool: str) -> str:
+        return "{} ({})".format(self._relative_to_cwd(in_file), tool)
+
+    def _log_compile_error(self, in_file: Path, error: Exception):
+        logging.error(
+            "Error while compiling form '%s': %s", self._relative_to_cwd(in_file), error
+        )
+
+    def _get_worker_pool(self, qt_version_number: int) -> ProcessPoolExecutor:
+        pool = self._worker_pools.get(qt_version_number)
+        if pool is None:
+            logging.debug(
+                "Starting %s form compilation workers for PyQt%s",
+                self._jobs,
+                qt_version_number,
+            )
+            # Workers load a single PyQt version each, so avoid inheriting
+            # the parent process state through fork
+            pool = ProcessPoolExecutor(
+                max_workers=self._jobs,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_uic_worker,
+                initargs=(qt_version_number,),
+            )
+            self._worker_pools[qt_version_number] = pool
+        return pool
 
     def _pyenv_prefix(self, pyenv):
         return (
@@ -261,6 +701,7 @@ class UIBuilder:
 
         init = "\n\n".join((header, all_str, import_str)) + "\n"
 
+        make_private(path_out / "__init__.py")
         with (path_out / "__init__.py").open("w", encoding="utf-8") as f:
             f.write(init)
 
@@ -279,48 +720,85 @@ class UIBuilder:
         (I prefer to initialize these manually)
         """
         logging.debug("Munging %s...", self._relative_to_cwd(path))
+        make_private(path)
         with path.open("r+", encoding="utf-8") as f:
             form = f.read()
-            munged = self._re_munge.sub("", form)
-            for prefix in resource_prefixes_to_replace:
-                munged = munged.replace(f'":/{prefix}/', f'"{prefix}:')
+            munged = self._munge_form_source(form, resource_prefixes_to_replace)
             f.seek(0)
             f.write(munged)
             f.truncate()
 
+    def _write_form(
+        self, path: Path, source: str, resource_prefixes_to_replace: List[str]
+    ):
+        """Munge form source compiled in memory and write it out in one go"""
+        logging.debug("Writing munged %s...", self._relative_to_cwd(path))
+        munged = self._munge_form_source(source, resource_prefixes_to_replace)
+        make_private(path)
+        with path.open("w", encoding="utf-8") as f:
+            f.write(munged)
+
+    def _munge_form_source(
+        self, form: str, resource_prefixes_to_replace: List[str]
+    ) -> str:
+        munged = self._re_munge.sub("", form)
+        for prefix in resource_prefixes_to_replace:
+            munged = munged.replace(f'":/{prefix}/', f'"{prefix}:')
+        return munged
+
     def _migrate_resources(self) -> List[str]:
         """Returns list of prefixes to replace in built UI forms"""
         logging.info("Qt resources folder found. Attempting to migrate...")
 
+        # Pulls in xml.etree, which projects without resources can do without
+        from .legacy import QRCMigrator, QRCParser, QResourceDescriptor
+
         resources: List[QResourceDescriptor] = []
 
-        for qrc_path in self._resources_source_path.glob("*.qrc"):
-            parser = QRCParser(qrc_path=qrc_path)
+        for qrc_path in sorted(self._resources_source_path.glob("*.qrc")):
+            # --no-cache bypasses all of the user cache
+            parser = QRCParser(
+                qrc_path=qrc_path, use_cache=self._form_cache is not None
+            )
             resources.extend(parser.get_qresources())
 
+        migrator = QRCMigrator(self._gui_path)
+
         if not resources:
+            # Clean up files migrated from collections that have been removed
+            migrator.migrate_resources(resources=[])
             return []
 
-        migrator = QRCMigrator(self._gui_path)
         integration_snippet = migrator.migrate_resources(resources=resources)
 
         content_init = (
             _template_header.format(**self._format_dict) + "\n" + integration_snippet
         )
 
-        with (self._resources_out_path / "__init__.py").open(
-            "w", encoding="utf-8"
-        ) as f:
-            f.write(content_init)
-
-        prefixes = list(set(resource.prefix for resource in resources))
+        # Only rewritten when prefixes (or the header) change, so that its mtime
+        # stays put
+        init_path = self._resources_out_path / "__init__.py"
+        try:
+            with init_path.open(encoding="utf-8") as f:
+                previous_content_init = f.read()
+        except FileNotFoundError:
+            previous_content_init = None
+        if content_init != previous_content_init:
+            make_private(init_path)
+            with init_path.open("w", encoding="utf-8") as f:
+                f.write(content_init)
+
+        prefixes = sorted(set(resource.prefix for resource in resources))
 
         return prefixes
 
     def _get_format_dict(self):
         config = self._config
         start_year = config.get("copyright_start")
-        now = datetime.now().year
+        if self._timestamp is not None:
+            now = datetime.fromtimestamp(self._timestamp, tz=timezone.utc).year
+        else:
+            now = datetime.now().year
         if start_year and start_year != now:
             years = "{start_year}-{now}".format(start_year=start_year, now=now)
         else:
@@ -33,14 +33,27 @@
 Utility functions
 """
 
+import fnmatch
 import logging
+import os
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from .tracing import CATEGORY_SUBPROCESS, span
+
+# Version control data is never purged
+_purge_skipped_names = {".git", ".hg", ".svn"}
 
 
 def call_shell(command, echo=False, error_exit=True, **kwargs):
     try:
-        out = subprocess.check_output(command, shell=True, **kwargs)
+        with span(command, CATEGORY_SUBPROCESS, command=command):
+            out = subprocess.check_output(command, shell=True, **kwargs)
         decoded = out.decode("utf-8").strip()
         if echo:
             logging.info(decoded)
@@ -55,30 +68,117 @@ def call_shell(command, echo=False, error_exit=True, **kwargs):
         return False
 
 
-def purge(path, patterns, recursive=False):
-    """Wrapper for GNU find that deletes files matching pattern
+def purge(
+    path: Union[str, Path],
+    patterns: Iterable[str],
+    recursive: bool = False,
+    exclude: Iterable[Union[str, Path]] = (),
+) -> int:
+    """Deletes files and directories below path whose names match any of patterns
 
     Arguments:
         path {str} -- Path to look through
-        patterns {list} -- List of patterns to delete
+        patterns {list} -- List of glob patterns to delete
 
     Keyword Arguments:
         recursive {bool} -- Whether to search recursively (default: {False})
+        exclude {list} -- Directories not to look into. Matching directories
+                          are deleted all the same. (default: {()})
+
+    Returns:
+        int -- Number of deleted files and directories
     """
+    patterns = list(patterns)
     if not path or not patterns:
-        return False
-    pattern_string = " -o ".join("-name '{}'".format(p) for p in patterns)
-    pattern_string = "\( {} \)".format(pattern_string)
-    depth = "-maxdepth 1" if not recursive else ""
-    cmd = 'find "{path}" {depth} {pattern_string} -delete'.format(
-        path=path, depth=depth, pattern_string=pattern_string
+        return 0
+    excluded = {os.path.normpath(p) for p in exclude}
+
+    deleted = 0
+    pending = [os.fspath(path)]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if any(fnmatch.fnmatch(entry.name, pattern) for pattern in patterns):
+                if is_dir:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
+                deleted += 1
+            elif (
+                is_dir
+                and recursive
+                and entry.name not in _purge_skipped_names
+                and os.path.normpath(entry.path) not in excluded
+            ):
+                pending.append(entry.path)
+    return deleted
+
+
+def remove_tree_in_background(
+    path: Union[str, Path], trash_path: Union[str, Path]
+) -> Optional[threading.Thread]:
+    """Moves path out of the way and deletes it in a background thread
+
+    Arguments:
+        path {str} -- Directory to delete
+        trash_path {str} -- Directory to move path to while it is being deleted.
+                            Needs to be on the same file system as path.
+
+    Returns:
+        Thread -- Thread deleting the directory, or None if path did not exist
+    """
+    trash_path = Path(trash_path)
+    trash_path.mkdir(parents=True, exist_ok=True)
+    # Left behind by runs that exited before deletion finished
+    targets = list(trash_path.iterdir())
+
+    target = Path(
+        tempfile.mkdtemp(prefix="{}-".format(Path(path).name), dir=str(trash_path))
     )
-    return call_shell(cmd)
+    try:
+        os.replace(str(path), str(target))
+    except FileNotFoundError:
+        target.rmdir()
+        return None
+    targets.append(target)
+
+    def remove():
+        for target in targets:
+            shutil.rmtree(str(target), ignore_errors=True)
+
+    # Not a daemon thread, so that deletion finishes before the interpreter exits
+    thread = threading.Thread(target=remove, name="remove {}".format(path))
+    thread.start()
+    return thread
+
+
+def make_private(path: Union[str, Path]) -> bool:
+    """Replaces a file that shares its data with other paths by a private copy
 
+    Files in the dist tree might be hard links into aab's content store, so
+    they must go through this before they are modified in place.
 
-def copy_recursively(source, target):
-    if not source or not target:
+    Returns:
+        bool -- Whether a private copy had to be made
+    """
+    try:
+        if os.lstat(path).st_nlink <= 1:
+            return False
+    except FileNotFoundError:
         return False
-    return call_shell(
-        'cp -r "{source}" "{target}"'.format(source=source, target=target)
-    )
+    path = Path(path)
+    tmp_path = path.with_name(".{}.tmp".format(path.name))
+    shutil.copy2(str(path), str(tmp_path))
+    os.replace(str(tmp_path), str(path))
+    return True
+
+
+def make_tree_private(path: Union[str, Path]):
+    """Applies make_private to all files below path"""
+    for root, dirs, files in os.walk(str(path)):
+        for file in files:
+            make_private(os.path.join(root, file))
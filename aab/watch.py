@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+"""
+File watching and incremental rebuilds during development
+"""
+
+import ctypes
+import ctypes.util
+import importlib.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .config import PATH_CONFIG, Config
+from .git import Git
+from .manifest import ManifestUtils
+from .ui import QT_DESIGNER_FOLDER_NAME, QT_RESOURCES_FOLDER_NAME, QtVersion, UIBuilder
+
+# inotify(7) event flags
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+
+_INOTIFY_MASK = (
+    _IN_CLOSE_WRITE
+    | _IN_ATTRIB
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+)
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class PollingWatcher:
+    """
+    Detects changed files by periodically comparing stat results
+
+    Watches the files directly inside root as well as all files below the
+    given recursive directories, which do not need to exist yet.
+    """
+
+    def __init__(self, root: Path, directories: Iterable[Path], interval: float = 0.25):
+        self._root = root
+        self._directories = list(directories)
+        self._interval = interval
+        self._state = self._scan()
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        """Blocks until files changed or timeout passed. Returns changed paths."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            state = self._scan()
+            changed = {
+                path
+                for path in state.keys() | self._state.keys()
+                if state.get(path) != self._state.get(path)
+            }
+            self._state = state
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(
+                self._interval
+                if deadline is None
+                else max(min(self._interval, deadline - time.monotonic()), 0)
+            )
+
+    def close(self):
+        pass
+
+    def _scan(self) -> Dict[Path, Tuple[int, int]]:
+        state = {}
+        for entry in os.scandir(self._root):
+            if entry.is_file():
+                stat = entry.stat()
+                state[Path(entry.path)] = (stat.st_mtime_ns, stat.st_size)
+        for directory in self._directories:
+            for root, _, files in os.walk(directory):
+                for file in files:
+                    path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    state[Path(path)] = (stat.st_mtime_ns, stat.st_size)
+        return state
+
+
+class InotifyWatcher:
+    """
+    Linux inotify based watcher with the same interface as PollingWatcher
+
+    Uses libc through ctypes, so that no additional dependencies are needed.
+    """
+
+    def __init__(self, root: Path, directories: Iterable[Path]):
+        libc = _load_libc()
+        if libc is None:
+            raise OSError("inotify is not available")
+        self._libc = libc
+        self._root = root
+        self._directories = list(directories)
+        self._watches: Dict[int, Path] = {}
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._add_watch(root)
+        for directory in self._directories:
+            self._add_recursive_watch(directory)
+
+    @classmethod
+    def is_supported(cls) -> bool:
+        return sys.platform.startswith("linux") and _load_libc() is not None
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        """Blocks until files changed or timeout passed. Returns changed paths."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed: Set[Path] = set()
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                # Events were lost, so consider everything changed
+                changed.add(self._root)
+                continue
+
+            parent = self._watches.get(wd)
+            if parent is None or not name:
+                continue
+            path = parent / name
+
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO) and self._is_watched_tree(path):
+                    self._add_recursive_watch(path)
+                    # Files might have been created before the watch was added
+                    changed.update(p for p in path.rglob("*") if p.is_file())
+                continue
+
+            changed.add(path)
+
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+    def _is_watched_tree(self, path: Path) -> bool:
+        return any(
+            path == directory or directory in path.parents
+            for directory in self._directories
+        )
+
+    def _add_recursive_watch(self, directory: Path):
+        if not directory.is_dir():
+            return
+        for root, _, _ in os.walk(directory):
+            self._add_watch(Path(root))
+
+    def _add_watch(self, path: Path):
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), ctypes.c_uint32(_INOTIFY_MASK)
+        )
+        if wd < 0:
+            logging.debug("Could not watch %s", path)
+            return
+        self._watches[wd] = path
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    libc_name = ctypes.util.find_library("c")
+    try:
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+def create_watcher(root: Path, directories: Iterable[Path], polling: bool = False):
+    if not polling and InotifyWatcher.is_supported():
+        try:
+            return InotifyWatcher(root, directories)
+        except OSError as e:
+            logging.debug("Could not set up inotify: %s. Polling instead.", e)
+    return PollingWatcher(root, directories)
+
+
+class ProjectWatcher:
+    """
+    Rebuilds Qt forms, resources and the manifest of the project in the
+    current working directory as their sources change
+
+    Config and UIBuilder stay loaded between rebuilds and are only replaced
+    when addon.json changes. Forms are built incrementally, so only forms
+    whose sources changed get compiled again.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        qt_versions: List[QtVersion],
+        version: Optional[str] = None,
+        jobs: int = 1,
+        form_cache=None,
+        debounce: float = 0.1,
+        polling: bool = False,
+    ):
+        self._root = root
+        self._qt_versions = qt_versions
+        self._version = version
+        self._jobs = jobs
+        self._form_cache = form_cache
+        self._debounce = debounce
+        self._polling = polling
+
+        self._designer_path = root / QT_DESIGNER_FOLDER_NAME
+        self._resources_path = root / QT_RESOURCES_FOLDER_NAME
+        self._config_path = root / PATH_CONFIG.name
+
+        self._config: Optional[Config] = None
+        self._ui_builder: Optional[UIBuilder] = None
+        self._resource_prefixes: List[str] = []
+        # Changes of failed rebuilds, retried along with the next changes
+        self._failed_changes: Set[Path] = set()
+
+    def run(self):
+        """Builds everything once and then rebuilds on changes until interrupted"""
+        watcher = create_watcher(
+            self._root,
+            [self._designer_path, self._resources_path],
+            polling=self._polling,
+        )
+        logging.info(
+            "Watching %s for changes using %s. Press Ctrl+C to stop.",
+            self._root,
+            "polling" if isinstance(watcher, PollingWatcher) else "inotify",
+        )
+        try:
+            self.rebuild({self._config_path})
+            while True:
+                changes = watcher.wait()
+                # Debounce bursts of events, e.g. from editors saving via temp files
+                while True:
+                    more_changes = watcher.wait(self._debounce)
+                    if not more_changes:
+                        break
+                    changes |= more_changes
+                self.rebuild(changes)
+        except KeyboardInterrupt:
+            logging.info("Stopped watching.")
+        finally:
+            watcher.close()
+            self.close()
+
+    def rebuild(self, changes: Iterable[Path]) -> bool:
+        """Rebuilds whatever changes affect. Errors are logged rather than
+        raised, as half-saved files are common while editing.
+
+        Returns:
+            bool -- Whether the rebuild succeeded
+        """
+        changes = self._failed_changes | set(changes)
+        try:
+            self._rebuild(changes)
+        except (Exception, SystemExit) as e:
+            message = str(e) if isinstance(e, Exception) else "see above"
+            logging.error(
+                "Error: Rebuild failed (%s). Waiting for further changes...",
+                message,
+            )
+            self._failed_changes = changes
+            return False
+        self._failed_changes = set()
+        return True
+
+    def _rebuild(self, changes: Set[Path]):
+        config_changed, resources_changed, forms_changed = self._classify(changes)
+        if not (config_changed or resources_changed or forms_changed):
+            return
+
+        start = time.perf_counter()
+
+        if config_changed or self._ui_builder is None:
+            self._load_config()
+            self._write_manifest()
+            resources_changed = True
+
+        assert self._ui_builder is not None
+
+        if resources_changed:
+            self._resource_prefixes = self._ui_builder.prepare_resources()
+
+        self._ui_builder.build_targets(
+            self._qt_versions, resource_prefixes_to_replace=self._resource_prefixes
+        )
+
+        logging.info("Rebuilt in %.0f ms.", (time.perf_counter() - start) * 1000)
+
+    def close(self):
+        if self._ui_builder is not None:
+            self._ui_builder.close()
+            self._ui_builder = None
+
+    def _classify(self, changes: Iterable[Path]) -> Tuple[bool, bool, bool]:
+        config_changed = resources_changed = forms_changed = False
+        for path in changes:
+            if path == self._root:
+                # Unknown changes
+                return True, True, True
+            if path.name.startswith(".") or path.name.endswith("~"):
+                continue
+            if path == self._config_path:
+                config_changed = True
+            elif self._resources_path in path.parents:
+                resources_changed = True
+            elif path.parent == self._designer_path and path.suffix == ".ui":
+                forms_changed = True
+        return config_changed, resources_changed, forms_changed
+
+    def _load_config(self):
+        logging.info("Loading %s...", self._config_path.name)
+        # Keep the previous config and builder around if the new one is invalid
+        config = Config(self._config_path)
+        self.close()
+        self._config = config
+        self._ui_builder = UIBuilder(
+            dist=self._root,
+            config=config,
+            jobs=self._jobs,
+            # Compiling in-process avoids starting pyuic for every change
+            in_process=all(
+                importlib.util.find_spec(f"PyQt{qt_version.value}") is not None
+                for qt_version in self._qt_versions
+            ),
+            form_cache=self._form_cache,
+        )
+
+    def _write_manifest(self):
+        assert self._config is not None
+        git = Git()
+        try:
+            ManifestUtils.generate_and_write_manifest(
+                addon_properties=self._config,
+                version=git.parse_version(self._version),
+                dist_type="local",
+                target_dir=self._root / "src" / self._config["module_name"],
+                git=git,
+            )
+        finally:
+            git.close()
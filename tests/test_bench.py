@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import subprocess
+from pathlib import Path
+
+from aab.bench import (
+    BENCH_VERSION,
+    BENCH_WORKDIR_MARKER,
+    PHASES,
+    BenchmarkRunner,
+    BenchmarkSpec,
+    generate_project,
+    percentile,
+)
+
+
+def test_generate_project(tmp_path: Path):
+    spec = BenchmarkSpec(
+        source_files=3, forms=2, qrc_entries=4, assets=2, asset_size_kb=1
+    )
+
+    file_count, total_size = generate_project(tmp_path, spec)
+
+    assert len(list((tmp_path / "designer").glob("*.ui"))) == 2
+    assert len(list((tmp_path / "resources" / "icons").glob("*.svg"))) == 4
+    assert (
+        tmp_path / "src" / "bench_addon" / "assets" / "asset_1.bin"
+    ).stat().st_size == 1024
+    tracked = subprocess.check_output(
+        ["git", "ls-files"], cwd=tmp_path, universal_newlines=True
+    ).splitlines()
+    assert len(tracked) == file_count
+    assert total_size > 2048
+    tags = subprocess.check_output(["git", "tag"], cwd=tmp_path).decode()
+    assert tags.strip() == BENCH_VERSION
+
+
+def test_percentile():
+    values = [5.0, 1.0, 3.0, 2.0, 4.0]
+    assert percentile(values, 50) == 3.0
+    assert percentile(values, 95) == 5.0
+    assert percentile([1.0], 95) == 1.0
+
+
+def test_benchmark_runner(tmp_path: Path):
+    spec = BenchmarkSpec(
+        source_files=2, forms=0, qrc_entries=0, assets=1, asset_size_kb=1
+    )
+    runner = BenchmarkRunner(spec, iterations=2)
+
+    results = runner.run(workdir=tmp_path / "project")
+
+    assert set(results["phases"]) == set(PHASES)
+    for summary in results["phases"].values():
+        assert len(summary["runs"]) == 2
+        assert summary["min"] <= summary["median"] <= summary["p95"]
+    assert list((tmp_path / "project" / "build").glob("*.ankiaddon"))
+
+
+def test_benchmark_runner_keeps_foreign_workdirs(tmp_path: Path):
+    spec = BenchmarkSpec(
+        source_files=1, forms=0, qrc_entries=0, assets=0, asset_size_kb=1
+    )
+    runner = BenchmarkRunner(spec, iterations=1)
+    (tmp_path / "important.txt").write_text("keep me")
+
+    runner.run(workdir=tmp_path)
+
+    assert (tmp_path / "important.txt").read_text() == "keep me"
+    (project_path,) = tmp_path.glob("aab-bench-*")
+    assert (project_path / BENCH_WORKDIR_MARKER).is_file()
+    assert list((project_path / "build").glob("*.ankiaddon"))
+
+    # Directories created by aab bench are reused
+    runner.run(workdir=project_path)
+    assert list(tmp_path.glob("aab-bench-*")) == [project_path]
+    assert not list(project_path.glob("aab-bench-*"))
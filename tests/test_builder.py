@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import json
+import os
+import subprocess
+import sys
+import zipfile
+from pathlib import Path
+from shutil import copytree
+
+from aab import PATH_PACKAGE
+
+from . import SAMPLE_PROJECT_NAME, SAMPLE_PROJECT_ROOT
+from .util import init_git_repo
+
+# Paths of the builder are resolved relative to the working directory at
+# import time, so builds run in a separate interpreter inside the project
+_BUILD_VARIANTS = """
+import json
+from aab.builder import AddonBuilder
+from aab.ui import QtVersion
+
+builder = AddonBuilder(version="v1.0.0")
+try:
+    paths = builder.build_variants(
+        qt_versions=[QtVersion.qt6], disttypes=["local", "ankiweb"]
+    )
+finally:
+    builder.close()
+print(json.dumps([str(path) for path in paths]))
+"""
+
+
+def test_build_variants(tmp_path: Path):
+    project_path = tmp_path / SAMPLE_PROJECT_NAME
+    copytree(SAMPLE_PROJECT_ROOT, project_path)
+    module_path = project_path / "src" / "sample_project"
+    module_path.mkdir(parents=True)
+    (module_path / "__init__.py").write_text("from . import gui\n")
+    (module_path / "data.txt").write_text("\n".join(map(str, range(10000))))
+    init_git_repo(project_path)
+
+    result = subprocess.run(
+        [sys.executable, "-c", _BUILD_VARIANTS],
+        cwd=str(project_path),
+        env=dict(os.environ, PYTHONPATH=str(PATH_PACKAGE.parent)),
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    local_path, ankiweb_path = map(Path, json.loads(result.stdout.splitlines()[-1]))
+
+    build_path = project_path / "build"
+    assert local_path == build_path / "sample-project-v1.0.0-qt6.ankiaddon"
+    assert ankiweb_path == build_path / "sample-project-v1.0.0-qt6-ankiweb.ankiaddon"
+
+    packages = {}
+    for path in (local_path, ankiweb_path):
+        with zipfile.ZipFile(path) as zf:
+            assert zf.testzip() is None
+            packages[path] = {
+                name: zf.read(name) for name in zf.namelist() if name != "manifest.json"
+            }
+            packages[path]["manifest.json"] = json.loads(zf.read("manifest.json"))
+
+    local, ankiweb = packages[local_path], packages[ankiweb_path]
+    assert local["manifest.json"]["package"] == "sample_project"
+    assert local["manifest.json"]["conflicts"] == ["999999999999"]
+    assert ankiweb["manifest.json"]["package"] == "999999999999"
+    assert ankiweb["manifest.json"]["conflicts"] == ["sample_project"]
+    assert local["manifest.json"]["version"] == "v1.0.0"
+    assert ankiweb["manifest.json"]["mod"] == local["manifest.json"]["mod"]
+
+    # Variants share everything but their manifest
+    del local["manifest.json"], ankiweb["manifest.json"]
+    assert local == ankiweb
+    assert local["__init__.py"] == b"from . import gui\n"
+    assert "gui/forms/qt6/dialog.py" in local
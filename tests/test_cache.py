@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import os
+from pathlib import Path
+
+from aab.cache import FileCache, hash_key
+
+
+def test_file_cache_roundtrip(tmp_path: Path):
+    cache = FileCache(tmp_path / "cache")
+    key = hash_key("form", b"content")
+
+    target = tmp_path / "target.py"
+    assert cache.retrieve(key, target) is False
+
+    source = tmp_path / "source.py"
+    source.write_text("compiled", encoding="utf-8")
+    cache.store(key, source)
+
+    assert cache.retrieve(key, target) is True
+    assert target.read_text(encoding="utf-8") == "compiled"
+
+    linked_target = tmp_path / "linked.py"
+    assert cache.retrieve(key, linked_target, link=True) is True
+    assert linked_target.read_text(encoding="utf-8") == "compiled"
+
+
+def test_file_cache_evicts_least_recently_used(tmp_path: Path):
+    cache = FileCache(tmp_path / "cache", max_size=250)
+
+    keys = [hash_key(str(index)) for index in range(3)]
+    for index, key in enumerate(keys):
+        cache.store_bytes(key, b"x" * 100)
+        entry = cache.get(key)
+        assert entry is not None
+        os.utime(entry, (index, index))
+
+    # mark first entry as recently used
+    assert cache.get(keys[0]) is not None
+
+    cache.evict()
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import os
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+from aab import PATH_PACKAGE
+
+# Cumulative time allowed for importing aab.cli, in microseconds. Loading the
+# full import graph of all commands took well over 200 ms.
+STARTUP_BUDGET_US = 100_000
+
+# Only needed by some commands, so never imported to parse arguments
+DEFERRED_MODULES = (
+    "jsonschema",
+    "whichcraft",
+    "xml.etree.ElementTree",
+    "aab.builder",
+    "aab.git",
+    "aab.ui",
+    "aab.legacy",
+    "aab.manifest",
+)
+
+
+def _import_times(*args: str) -> Dict[str, int]:
+    """Runs the aab CLI with -X importtime and returns cumulative import times"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "from aab.cli import main; main()"]
+        + list(args),
+        env=dict(os.environ, PYTHONPATH=str(PATH_PACKAGE.parent)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_help_defers_imports():
+    times = _import_times("--help")
+
+    for module in DEFERRED_MODULES:
+        assert module not in times, f"{module} should be imported lazily"
+
+
+@pytest.mark.skipif(
+    not os.environ.get("AAB_TEST_STARTUP_BUDGET"),
+    reason="Wall-clock timings are unreliable on shared machines. "
+    "Set AAB_TEST_STARTUP_BUDGET=1 to check them.",
+)
+def test_help_startup_budget():
+    # Import timings are noisy, so take the best of a few runs
+    startup = min(_import_times("--help")["aab.cli"] for _ in range(3))
+    assert startup < STARTUP_BUDGET_US
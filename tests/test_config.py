@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import json
+from pathlib import Path
+
+import pytest
+from jsonschema.exceptions import ValidationError
+
+from aab.config import Config
+
+from . import SAMPLE_PROJECT_ROOT
+
+
+def test_config_validation_is_memoized(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("AAB_CACHE_DIR", str(tmp_path / "cache"))
+    config_path = tmp_path / "addon.json"
+    config_path.write_bytes((SAMPLE_PROJECT_ROOT / "addon.json").read_bytes())
+
+    assert Config(config_path)["module_name"] == "sample_project"
+    assert len(list((tmp_path / "cache" / "config").glob("*/*"))) == 1
+
+    def fail():
+        raise AssertionError("config should not be validated again")
+
+    with monkeypatch.context() as m:
+        m.setattr(Config, "_get_validator", fail)
+        assert Config(config_path)["module_name"] == "sample_project"
+
+    # Changed contents are validated again, and failures are not remembered
+    data = json.loads(config_path.read_text(encoding="utf-8"))
+    del data["module_name"]
+    config_path.write_text(json.dumps(data), encoding="utf-8")
+
+    for _ in range(2):
+        with pytest.raises(ValidationError):
+            Config(config_path)
+    assert len(list((tmp_path / "cache" / "config").glob("*/*"))) == 1
+
+
+def test_config_loads_without_writable_cache(tmp_path: Path, monkeypatch):
+    # A file in place of a directory can't be written to, even by root
+    (tmp_path / "not-a-directory").touch()
+    monkeypatch.setenv("AAB_CACHE_DIR", str(tmp_path / "not-a-directory" / "aab"))
+    config_path = tmp_path / "addon.json"
+    config_path.write_bytes((SAMPLE_PROJECT_ROOT / "addon.json").read_bytes())
+
+    for _ in range(2):
+        assert Config(config_path)["module_name"] == "sample_project"
+
+
+def test_config_validation_cache_is_evicted(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("AAB_CACHE_DIR", str(tmp_path / "cache"))
+    contents = (SAMPLE_PROJECT_ROOT / "addon.json").read_bytes()
+    monkeypatch.setattr(Config, "_max_cache_size", 2 * len(contents) + 100)
+    config_path = tmp_path / "addon.json"
+
+    for version in range(5):
+        data = json.loads(contents)
+        data["display_name"] = "Sample Project {}".format(version)
+        config_path.write_text(json.dumps(data, indent=4), encoding="utf-8")
+        Config(config_path)
+
+    assert len(list((tmp_path / "cache" / "config").glob("*/*"))) <= 2
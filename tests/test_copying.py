@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import os
+from pathlib import Path
+
+from aab.copying import CopyEngine
+
+
+def test_copy_engine_skips_unchanged_files(tmp_path: Path):
+    source = tmp_path / "source"
+    (source / "nested").mkdir(parents=True)
+    (source / "a.txt").write_bytes(b"a" * 100)
+    (source / "nested" / "b.bin").write_bytes(os.urandom(3 * 1024 * 1024))
+    (source / "nested" / "b.bin").chmod(0o755)
+    target = tmp_path / "target"
+
+    with CopyEngine() as engine:
+        engine.copy_tree(source, target)
+    assert engine.stats.files == 2
+    assert engine.stats.bytes == 100 + 3 * 1024 * 1024
+    for path in ("a.txt", "nested/b.bin"):
+        assert (target / path).read_bytes() == (source / path).read_bytes()
+        assert (target / path).stat().st_mode == (source / path).stat().st_mode
+        assert (target / path).stat().st_mtime_ns == (source / path).stat().st_mtime_ns
+
+    (source / "a.txt").write_bytes(b"b" * 100)
+
+    with CopyEngine() as engine:
+        engine.copy_tree(source, target)
+    assert (engine.stats.files, engine.stats.skipped_files) == (1, 1)
+    assert engine.stats.skipped_bytes == 3 * 1024 * 1024
+    assert (target / "a.txt").read_bytes() == b"b" * 100
+
+
+def test_copy_engine_replaces_linked_targets(tmp_path: Path):
+    source = tmp_path / "LICENSE"
+    source.write_text("new license")
+    shared = tmp_path / "store-entry"
+    shared.write_text("old license")
+    target = tmp_path / "dist" / "LICENSE.txt"
+    target.parent.mkdir()
+    os.link(shared, target)
+
+    with CopyEngine() as engine:
+        engine.copy_file(source, target)
+
+    assert target.read_text() == "new license"
+    assert shared.read_text() == "old license"
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from shutil import copytree
+
+import pytest
+
+from aab import PATH_PACKAGE
+from aab import daemon as aab_daemon
+from aab.daemon import PATH_DAEMON_SOCKET, run_client, stop_daemon
+
+from . import SAMPLE_PROJECT_NAME, SAMPLE_PROJECT_ROOT
+from .util import change_dir, init_git_repo
+
+
+def test_daemon_serves_commands_and_picks_up_changes(tmp_path: Path, capsys):
+    project_root = tmp_path / SAMPLE_PROJECT_NAME
+    copytree(SAMPLE_PROJECT_ROOT, project_root)
+    (project_root / "src" / "sample_project").mkdir(parents=True)
+    init_git_repo(project_root)
+    manifest_path = project_root / "src" / "sample_project" / "manifest.json"
+
+    env = dict(os.environ, PYTHONPATH=str(PATH_PACKAGE.parent))
+    daemon = subprocess.Popen(
+        [sys.executable, "-m", "aab.cli", "daemon", "--poll"],
+        cwd=project_root,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+    try:
+        with change_dir(project_root):
+            for _ in range(100):
+                if PATH_DAEMON_SOCKET.exists():
+                    break
+                time.sleep(0.1)
+            assert PATH_DAEMON_SOCKET.stat().st_mode & 0o777 == 0o600
+
+            assert run_client(["manifest", "release"]) == 0
+            assert "Writing manifest" in capsys.readouterr().out
+            with manifest_path.open(encoding="utf-8") as f:
+                manifest = json.load(f)
+            assert manifest["version"] == "v1.0.0"
+            assert manifest["name"] == "Sample Project"
+
+            # Warm config and Git state is dropped as files change
+            config_path = project_root / "addon.json"
+            config_path.write_text(
+                config_path.read_text(encoding="utf-8").replace(
+                    '"Sample Project"', '"Renamed Project"'
+                ),
+                encoding="utf-8",
+            )
+            subprocess.check_call(
+                ["git", "commit", "-q", "-am", "Rename", "--no-verify"],
+                env=dict(
+                    os.environ,
+                    GIT_AUTHOR_NAME="aab",
+                    GIT_AUTHOR_EMAIL="aab@example.com",
+                    GIT_COMMITTER_NAME="aab",
+                    GIT_COMMITTER_EMAIL="aab@example.com",
+                ),
+            )
+            subprocess.check_call(["git", "tag", "v1.1.0"])
+
+            assert run_client(["manifest", "release"]) == 0
+            with manifest_path.open(encoding="utf-8") as f:
+                manifest = json.load(f)
+            assert manifest["version"] == "v1.1.0"
+            assert manifest["name"] == "Renamed Project"
+
+            # Errors are passed on, long-running commands are left to the client
+            assert run_client(["manifest", "v9.9.9", "--bogus"]) == 2
+            assert run_client(["watch"]) is None
+
+            assert stop_daemon()
+        assert daemon.wait(timeout=10) == 0
+        assert not (project_root / PATH_DAEMON_SOCKET).exists()
+    finally:
+        if daemon.poll() is None:
+            daemon.kill()
+
+
+@pytest.mark.skipif(
+    not hasattr(socket, "SO_PEERCRED"), reason="Peer credentials not available"
+)
+def test_daemon_rejects_other_users(monkeypatch):
+    server, client = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    with server, client:
+        assert aab_daemon._is_same_user(server)
+        uid = os.getuid()
+        monkeypatch.setattr(os, "getuid", lambda: uid + 1)
+        assert not aab_daemon._is_same_user(server)
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import json
+import os
+import stat
+import subprocess
+from pathlib import Path
+from typing import Set
+from shutil import copytree
+
+import pytest
+
+from aab import manifest
+from aab.git import Git
+from aab.staging import METHOD_COPY, METHOD_HARDLINK, METHOD_REFLINK, ContentStore
+
+from . import SAMPLE_PROJECT_NAME, SAMPLE_PROJECT_ROOT
+from .util import change_dir, init_git_repo
+
+
+@pytest.fixture
+def sample_repo(tmp_path: Path) -> Path:
+    repo_path = tmp_path / SAMPLE_PROJECT_NAME
+    copytree(SAMPLE_PROJECT_ROOT, repo_path)
+
+    script_path = repo_path / "tools" / "run.sh"
+    script_path.parent.mkdir()
+    script_path.write_text("#!/bin/sh\n", encoding="utf-8")
+    script_path.chmod(0o755)
+    (repo_path / "large.bin").write_bytes(os.urandom(Git._max_buffered_size + 1))
+
+    init_git_repo(repo_path)
+    return repo_path
+
+
+@pytest.fixture
+def monorepo(tmp_path: Path) -> Path:
+    """Repository that holds the sample project in a subdirectory"""
+    repo_path = tmp_path / "monorepo"
+    copytree(SAMPLE_PROJECT_ROOT, repo_path / "addon")
+    (repo_path / "README.md").write_text("Monorepo\n", encoding="utf-8")
+    (repo_path / "other").mkdir()
+    (repo_path / "other" / "addon.json").write_text("{}", encoding="utf-8")
+    init_git_repo(repo_path)
+    return repo_path
+
+
+def _list_exported(root: Path) -> Set[str]:
+    return {
+        path.relative_to(root).as_posix()
+        for path in root.rglob("*")
+        if path.is_file() and "build" not in path.parts
+    }
+
+
+def test_git_archive(sample_repo: Path, tmp_path: Path):
+    out_path = tmp_path / "dist"
+    out_path.mkdir()
+
+    extracted = {}
+
+    def on_extract(path: Path, size: int):
+        extracted[path.relative_to(out_path).as_posix()] = size
+
+    with change_dir(sample_repo):
+        assert Git().archive("v1.0.0", out_path, on_extract=on_extract) is True
+
+    expected_files = {
+        path.relative_to(sample_repo).as_posix(): path.stat().st_size
+        for path in sample_repo.rglob("*")
+        if path.is_file() and ".git" not in path.parts
+    }
+
+    assert extracted == expected_files
+    for relative_path, size in expected_files.items():
+        assert (out_path / relative_path).stat().st_size == size
+    assert (out_path / "large.bin").read_bytes() == (
+        sample_repo / "large.bin"
+    ).read_bytes()
+    assert (out_path / "tools" / "run.sh").stat().st_mode & stat.S_IXUSR
+
+
+def test_git_archive_reports_failure(sample_repo: Path, tmp_path: Path):
+    with change_dir(sample_repo), pytest.raises(SystemExit):
+        Git().archive("does-not-exist", tmp_path)
+
+
+def test_git_metadata(sample_repo: Path):
+    def git_output(*args: str) -> str:
+        return subprocess.check_output(
+            ["git", *args], cwd=sample_repo, universal_newlines=True
+        ).strip()
+
+    with change_dir(sample_repo):
+        git = Git()
+        try:
+            revision = git.revision("v1.0.0")
+            assert revision is not None
+            assert revision.commit == git_output("rev-parse", "v1.0.0^{commit}")
+            assert revision.tree == git_output("rev-parse", "v1.0.0^{tree}")
+            assert revision.timestamp == int(git_output("log", "-1", "--format=%ct"))
+            assert git.modtime("v1.0.0") == revision.timestamp
+
+            # Lookups are served by a single long-lived process
+            process = git._reader._process
+            assert git.revision("HEAD") == revision
+            assert git.revision("does-not-exist") is None
+            assert git._reader._process is process
+
+            assert git.parse_version() == "v1.0.0"
+            assert not git.snapshot().is_dirty
+        finally:
+            git.close()
+
+    assert process.poll() == 0
+
+
+def test_git_snapshot(sample_repo: Path):
+    spaced_path = sample_repo / "designer" / "dialog with spaces.ui"
+    spaced_path.write_text("<ui/>", encoding="utf-8")
+    (sample_repo / "designer" / "dialog.ui").unlink()
+    (sample_repo / "large.bin").rename(sample_repo / "renamed.bin")
+    os.utime(spaced_path, (1600000000, 1600000000))
+    os.utime(sample_repo / "renamed.bin", (1700000000, 1700000000))
+
+    with change_dir(sample_repo):
+        subprocess.check_call(["git", "add", "large.bin", "renamed.bin"])
+
+        git = Git()
+        snapshot = git.snapshot()
+        changes = {change.path: change for change in snapshot.changes}
+        assert set(changes) == {
+            "designer/dialog with spaces.ui",
+            "designer/dialog.ui",
+            "renamed.bin",
+        }
+        assert changes["designer/dialog with spaces.ui"].untracked
+        assert changes["designer/dialog.ui"].deleted
+        assert snapshot.has_tracked_changes
+        assert git.modtime("dev") == 1700000000
+
+        git = Git(untracked_files=False)
+        snapshot = git.snapshot()
+        assert {change.path for change in snapshot.changes} == {
+            "designer/dialog.ui",
+            "renamed.bin",
+        }
+
+
+def test_git_export_working_tree(sample_repo: Path, tmp_path: Path):
+    out_path = tmp_path / "dist"
+
+    with change_dir(sample_repo):
+        (sample_repo / ".gitattributes").write_text(
+            "resources/icons/optional export-ignore\n", encoding="utf-8"
+        )
+        (sample_repo / "addon.json").write_text("{}", encoding="utf-8")
+        (sample_repo / "designer" / "new form.ui").write_text("<ui/>")
+        (sample_repo / "large.bin").unlink()
+        subprocess.check_call(["git", "add", ".gitattributes", "designer"])
+        (sample_repo / "untracked.txt").write_text("untracked", encoding="utf-8")
+
+        extracted = []
+        assert Git().archive(
+            "dev", out_path, on_extract=lambda p, s: extracted.append(p)
+        )
+
+        exported = {
+            path.relative_to(out_path).as_posix()
+            for path in out_path.rglob("*")
+            if path.is_file() and "build" not in path.parts
+        }
+        assert exported == {
+            ".gitattributes",
+            "addon.json",
+            "designer/dialog.ui",
+            "designer/new form.ui",
+            "resources/icons.qrc",
+            "resources/icons/heart.svg",
+            "resources/icons/help.svg",
+            "tools/run.sh",
+        }
+        assert (out_path / "addon.json").read_text(encoding="utf-8") == "{}"
+        assert (out_path / "tools" / "run.sh").stat().st_mode & stat.S_IXUSR
+        assert len(extracted) == len(exported)
+
+        # Only changed files are copied again, removed ones are deleted
+        (sample_repo / "designer" / "new form.ui").unlink()
+        (sample_repo / "addon.json").write_text('{"changed": true}')
+        extracted.clear()
+        assert Git().archive(
+            "dev", out_path, on_extract=lambda p, s: extracted.append(p)
+        )
+
+        assert extracted == [out_path / "addon.json"]
+        assert not (out_path / "designer" / "new form.ui").exists()
+
+
+def test_git_archive_staged_from_store(sample_repo: Path, tmp_path: Path):
+    store = ContentStore(tmp_path / "store")
+
+    with change_dir(sample_repo):
+        Git().archive("v1.0.0", tmp_path / "archived")
+        for name in ("staged", "restaged"):
+            Git().archive("v1.0.0", tmp_path / name, store=store)
+
+    def read_tree(root: Path):
+        return {
+            path.relative_to(root).as_posix(): (
+                path.read_bytes(),
+                path.stat().st_mode,
+                path.stat().st_mtime,
+            )
+            for path in root.rglob("*")
+            if path.is_file()
+        }
+
+    archived = read_tree(tmp_path / "archived")
+    assert read_tree(tmp_path / "staged") == archived
+    assert read_tree(tmp_path / "restaged") == archived
+    assert store.stats["added"] == len(archived)
+
+
+def test_git_archive_staged_from_store_in_subdirectory(monorepo: Path, tmp_path: Path):
+    store = ContentStore(tmp_path / "store")
+
+    with change_dir(monorepo / "addon"):
+        Git().archive("v1.0.0", tmp_path / "archived")
+        Git().archive("v1.0.0", tmp_path / "staged", store=store)
+
+    staged = _list_exported(tmp_path / "staged")
+    assert staged == _list_exported(tmp_path / "archived")
+    assert "addon.json" in staged
+    assert "README.md" not in staged
+    assert store.stats["added"] == len(staged)
+
+    # 'git archive' ignores attributes outside of the archived subtree
+    (monorepo / ".gitattributes").write_text("*.ui export-ignore\n", encoding="utf-8")
+    subprocess.check_call(["git", "add", ".gitattributes"], cwd=str(monorepo))
+    subprocess.check_call(
+        ["git", "-c", "user.name=aab", "-c", "user.email=aab@example.com"]
+        + ["commit", "-q", "-m", "Ignore forms"],
+        cwd=str(monorepo),
+    )
+    with change_dir(monorepo / "addon"):
+        Git().archive("HEAD", tmp_path / "archived-head")
+        Git().archive("HEAD", tmp_path / "staged-head", store=store)
+
+    assert _list_exported(tmp_path / "staged-head") == _list_exported(
+        tmp_path / "archived-head"
+    )
+    methods = (METHOD_REFLINK, METHOD_HARDLINK, METHOD_COPY)
+    assert sum(store.stats[method] for method in methods) == 2 * len(staged)
+
+
+def test_git_archive_staged_files_use_commit_time(sample_repo: Path, tmp_path: Path):
+    store = ContentStore(tmp_path / "store")
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME="aab",
+        GIT_AUTHOR_EMAIL="aab@example.com",
+        GIT_COMMITTER_NAME="aab",
+        GIT_COMMITTER_EMAIL="aab@example.com",
+        GIT_COMMITTER_DATE="2030-01-01T00:00:00Z",
+    )
+    subprocess.run(
+        ["git", "commit", "-q", "--allow-empty", "-m", "Release"],
+        cwd=str(sample_repo),
+        env=env,
+        check=True,
+    )
+    subprocess.run(["git", "tag", "v1.1.0"], cwd=str(sample_repo), check=True)
+
+    with change_dir(sample_repo):
+        Git().archive("v1.0.0", tmp_path / "old", store=store)
+        added = store.stats["added"]
+        Git().archive("v1.1.0", tmp_path / "new", store=store)
+        Git().archive("v1.1.0", tmp_path / "archived")
+
+    # Entries are reused, but staged with the time of the new commit
+    assert store.stats["added"] == added
+    for name in ("new", "archived"):
+        assert (tmp_path / name / "addon.json").stat().st_mtime == 1893456000
+
+
+def test_generated_manifest_closes_own_git(
+    sample_repo: Path, monkeypatch: pytest.MonkeyPatch
+):
+    created = []
+
+    class RecordingGit(Git):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self)
+
+    monkeypatch.setattr(manifest, "Git", RecordingGit)
+    properties = json.loads((sample_repo / "addon.json").read_text())
+
+    with change_dir(sample_repo):
+        generated = manifest.ManifestUtils.generate_manifest_from_properties(
+            properties, version="v1.0.0", dist_type="local"
+        )
+        (git,) = created
+        assert git._reader._process is None
+
+        git = Git()
+        try:
+            assert generated["mod"] == git.modtime("v1.0.0")
+        finally:
+            git.close()
+
+
+def test_git_export_working_tree_of_subdirectory(monorepo: Path, tmp_path: Path):
+    with change_dir(monorepo / "addon"):
+        Git().archive("v1.0.0", tmp_path / "archived")
+        (monorepo / "addon" / "addon.json").write_text("{}", encoding="utf-8")
+        assert Git().archive("dev", tmp_path / "exported")
+
+    exported = _list_exported(tmp_path / "exported")
+    assert exported == _list_exported(tmp_path / "archived")
+    assert "addon.json" in exported
+    assert "README.md" not in exported
+    assert (tmp_path / "exported" / "addon.json").read_text(encoding="utf-8") == "{}"
+
+    # Like 'git archive', attributes above the project are not applied
+    (monorepo / ".gitattributes").write_text("*.ui export-ignore\n", encoding="utf-8")
+    with change_dir(monorepo / "addon"):
+        subprocess.check_call(["git", "add", "../.gitattributes"])
+        assert Git().archive("dev", tmp_path / "exported")
+
+    assert _list_exported(tmp_path / "exported") == exported
@@ -29,11 +29,16 @@
 #
 # Any modifications to this file must keep this entire header intact.
 
+import xml.etree.ElementTree as ElementTree
+from dataclasses import replace
 from pathlib import Path
 from shutil import copytree
 
+import pytest
+
 from aab.legacy import (
     QRCMigrator,
+    QRCParseError,
     QRCParser,
     QResourceDescriptor,
     QResourceFileDescriptor,
@@ -71,6 +76,70 @@ def test_qrc_parser():
     assert actual == expected
 
 
+def test_qrc_parser_only_reads_files_of_qresources(tmp_path: Path):
+    qrc_path = tmp_path / "icons.qrc"
+    qrc_path.write_text(
+        """\
+<RCC>
+  <qresource prefix="/a">
+    <file>x.svg</file>
+  </qresource>
+  <file>stray.svg</file>
+  <qresource prefix="/b">
+    <group>
+      <file>nested.svg</file>
+    </group>
+  </qresource>
+</RCC>
+""",
+        encoding="utf-8",
+    )
+
+    resources = QRCParser(qrc_path=qrc_path, use_cache=False).get_qresources()
+
+    assert resources == [
+        QResourceDescriptor(
+            prefix="a",
+            parent_path=tmp_path,
+            files=[QResourceFileDescriptor(relative_path="x.svg")],
+        ),
+        QResourceDescriptor(prefix="b", parent_path=tmp_path, files=[]),
+    ]
+
+
+def test_qrc_parser_cache(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("AAB_CACHE_DIR", str(tmp_path / "cache"))
+    qrc_path = tmp_path / "icons.qrc"
+    qrc_path.write_bytes((SAMPLE_PROJECT_ROOT / "resources" / "icons.qrc").read_bytes())
+
+    expected = [replace(_qrc_sample_resources[0], parent_path=tmp_path)]
+    assert QRCParser(qrc_path=qrc_path).get_qresources() == expected
+
+    def fail(*args, **kwargs):
+        raise AssertionError("qrc file should not be parsed again")
+
+    with monkeypatch.context() as m:
+        m.setattr(ElementTree, "iterparse", fail)
+        assert QRCParser(qrc_path=qrc_path).get_qresources() == expected
+
+    qrc_path.write_text(
+        "<RCC><qresource><file>icons/help.svg</file></qresource></RCC>",
+        encoding="utf-8",
+    )
+    with pytest.raises(QRCParseError):
+        QRCParser(qrc_path=qrc_path)
+
+
+def test_qrc_parser_without_writable_cache(tmp_path: Path, monkeypatch):
+    # A file in place of a directory can't be written to, even by root
+    (tmp_path / "not-a-directory").touch()
+    monkeypatch.setenv("AAB_CACHE_DIR", str(tmp_path / "not-a-directory" / "aab"))
+    qrc_path = SAMPLE_PROJECT_ROOT / "resources" / "icons.qrc"
+
+    for _ in range(2):
+        assert QRCParser(qrc_path=qrc_path).get_qresources() == _qrc_sample_resources
+
+
 def test_qrc_migrator(tmp_path: Path):
     test_project_root = tmp_path / SAMPLE_PROJECT_NAME
     copytree(SAMPLE_PROJECT_ROOT, test_project_root)
@@ -107,3 +176,36 @@ gui/
 """
 
     assert expected_file_structure == list_files(gui_src_path)
+
+
+def test_qrc_migrator_is_incremental(tmp_path: Path):
+    gui_path = tmp_path / "gui"
+    migrator = QRCMigrator(gui_path=gui_path)
+    icons_path = gui_path / "resources" / "sample-project" / "icons"
+
+    migrator.migrate_resources(resources=_qrc_sample_resources)
+    inode = (icons_path / "help.svg").stat().st_ino
+
+    # Unchanged files are left alone, files no longer listed are removed
+    (icons_path / "obsolete.svg").write_text("<svg/>")
+    resources = [
+        replace(
+            _qrc_sample_resources[0],
+            files=[
+                file
+                for file in _qrc_sample_resources[0].files
+                if file.alias != "icons/email.svg"
+            ],
+        )
+    ]
+    migrator.migrate_resources(resources=resources)
+
+    assert (icons_path / "help.svg").stat().st_ino == inode
+    assert sorted(path.name for path in icons_path.iterdir()) == [
+        "coffee.svg",
+        "heart.svg",
+        "help.svg",
+    ]
+
+    migrator.migrate_resources(resources=[])
+    assert not (gui_path / "resources" / "sample-project").exists()
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import os
+import zipfile
+from pathlib import Path
+from typing import Dict, Optional
+
+from aab.packaging import CompressionPolicy, PackageWriter, ZipEntryStore
+
+
+def _write_tree(root: Path, files: Dict[str, bytes]):
+    for name, content in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+
+def _package_tree(
+    root: Path,
+    out_path: Path,
+    store: ZipEntryStore,
+    source_date: Optional[int] = None,
+) -> PackageWriter:
+    with PackageWriter(out_path, store=store, source_date=source_date) as writer:
+        for path in sorted(root.rglob("*")):
+            if path.is_file():
+                writer.write(path, str(path.relative_to(root)))
+    return writer
+
+
+def _read_package(path: Path) -> Dict[str, bytes]:
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+_sample_files = {
+    "__init__.py": b"print('hello')\n" * 100,
+    "manifest.json": b'{"package": "local"}',
+    "web/data.bin": bytes(range(256)) * 64,
+    "web/empty.txt": b"",
+}
+
+
+def test_package_writer_output_readable(tmp_path: Path):
+    tree = tmp_path / "tree"
+    _write_tree(tree, _sample_files)
+
+    writer = _package_tree(tree, tmp_path / "out.ankiaddon", ZipEntryStore())
+
+    assert _read_package(tmp_path / "out.ankiaddon") == _sample_files
+    # manifest.json and empty.txt are too small to gain from compression
+    assert writer.stats.files_deflated == 2
+    assert writer.stats.files_stored == 2
+    assert writer.stats.files_reused == 0
+
+
+def test_package_writer_reuses_entries_across_variants(tmp_path: Path):
+    tree = tmp_path / "tree"
+    _write_tree(tree, _sample_files)
+    store = ZipEntryStore()
+
+    _package_tree(tree, tmp_path / "local.ankiaddon", store)
+
+    (tree / "manifest.json").write_bytes(b'{"package": "ankiweb"}')
+    writer = _package_tree(tree, tmp_path / "ankiweb.ankiaddon", store)
+
+    assert writer.stats.files_stored == 1
+    assert writer.stats.files_reused == len(_sample_files) - 1
+    assert _read_package(tmp_path / "ankiweb.ankiaddon") == dict(
+        _sample_files, **{"manifest.json": b'{"package": "ankiweb"}'}
+    )
+    store.close()
+
+
+def test_package_writer_reuses_entries_of_previous_package(tmp_path: Path):
+    tree = tmp_path / "tree"
+    _write_tree(tree, _sample_files)
+
+    out_path = tmp_path / "addon.ankiaddon"
+    _package_tree(tree, out_path, ZipEntryStore())
+
+    store = ZipEntryStore()
+    assert store.index_archive(out_path) == len(_sample_files)
+
+    (tree / "web" / "data.bin").write_bytes(b"changed")
+    writer = _package_tree(tree, out_path, store)
+
+    assert writer.stats.files_stored == 1
+    assert writer.stats.files_reused == len(_sample_files) - 1
+    assert _read_package(out_path) == dict(
+        _sample_files, **{"web/data.bin": b"changed"}
+    )
+    store.close()
+
+
+def test_package_writer_reuses_entries_matching_policy(tmp_path: Path):
+    # Only files that gain from compression, which are deflated at any level
+    files = {
+        "__init__.py": _sample_files["__init__.py"],
+        "manifest.json": _sample_files["manifest.json"] * 50,
+        "web/data.bin": _sample_files["web/data.bin"],
+    }
+    tree = tmp_path / "tree"
+    _write_tree(tree, files)
+
+    foreign_path = tmp_path / "foreign.ankiaddon"
+    with zipfile.ZipFile(foreign_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+
+    # Deflate levels of foreign archives are unknown
+    store = ZipEntryStore()
+    assert store.index_archive(foreign_path) == 0
+    store.close()
+
+    store = ZipEntryStore()
+    with PackageWriter(tmp_path / "default.ankiaddon", store=store) as writer:
+        writer.write_files((tree / name, name) for name in files)
+
+    policy = CompressionPolicy(level=9)
+    with PackageWriter(
+        tmp_path / "best.ankiaddon", store=store, policy=policy
+    ) as writer:
+        writer.write_files((tree / name, name) for name in files)
+    assert writer.stats.files_reused == 0
+    assert writer.stats.files_deflated == len(files)
+
+    policy = CompressionPolicy(store_extensions=frozenset([".py", ".json"]))
+    with PackageWriter(
+        tmp_path / "stored.ankiaddon", store=store, policy=policy
+    ) as writer:
+        writer.write_files((tree / name, name) for name in files)
+    assert writer.stats.files_reused == 1
+    assert writer.stats.files_stored == 2
+
+    with zipfile.ZipFile(tmp_path / "stored.ankiaddon") as zf:
+        compress_types = {info.filename: info.compress_type for info in zf.infolist()}
+    assert compress_types == {
+        "__init__.py": zipfile.ZIP_STORED,
+        "manifest.json": zipfile.ZIP_STORED,
+        "web/data.bin": zipfile.ZIP_DEFLATED,
+    }
+    assert _read_package(tmp_path / "stored.ankiaddon") == files
+
+    store = ZipEntryStore()
+    assert store.index_archive(tmp_path / "best.ankiaddon") == len(files)
+    with PackageWriter(
+        tmp_path / "reused.ankiaddon", store=store, policy=CompressionPolicy(level=9)
+    ) as writer:
+        writer.write_files((tree / name, name) for name in files)
+    assert writer.stats.files_reused == len(files)
+    store.close()
+
+
+def test_package_writer_parallel_order_and_spooling(tmp_path: Path, monkeypatch):
+    # Force compressed data of most files to be spooled to disk
+    monkeypatch.setattr(PackageWriter, "max_buffered_size", 1024)
+
+    tree = tmp_path / "tree"
+    files = {
+        f"file{index:02d}.bin": os.urandom(index * 512) + b"a" * index * 4096
+        for index in range(40, 0, -1)
+    }
+    _write_tree(tree, files)
+
+    out_path = tmp_path / "out.ankiaddon"
+    with PackageWriter(out_path, workers=4) as writer:
+        writer.write_files((tree / name, name) for name in files)
+
+    with zipfile.ZipFile(out_path) as zf:
+        assert zf.namelist() == list(files)
+    assert _read_package(out_path) == files
+
+
+def test_package_writer_compression_policy(tmp_path: Path):
+    tree = tmp_path / "tree"
+    files = {
+        "text.txt": b"compressible " * 20000,
+        "image.png": b"compressible " * 20000,
+        "custom.dat": b"compressible " * 20000,
+        "random.bin": os.urandom(200000),
+    }
+    _write_tree(tree, files)
+
+    policy = CompressionPolicy.from_config({"level": 9, "store_extensions": ["dat"]})
+    assert policy.level == 9
+
+    out_path = tmp_path / "out.ankiaddon"
+    with PackageWriter(out_path, policy=policy) as writer:
+        writer.write_files((tree / name, name) for name in files)
+
+    with zipfile.ZipFile(out_path) as zf:
+        compress_types = {info.filename: info.compress_type for info in zf.infolist()}
+
+    assert compress_types == {
+        "text.txt": zipfile.ZIP_DEFLATED,
+        "image.png": zipfile.ZIP_STORED,
+        "custom.dat": zipfile.ZIP_STORED,
+        "random.bin": zipfile.ZIP_STORED,
+    }
+    assert _read_package(out_path) == files
+    assert writer.stats.files_stored == 3
+    assert writer.stats.bytes_stored == sum(
+        len(files[name]) for name in ("image.png", "custom.dat", "random.bin")
+    )
+
+
+def test_package_writer_stores_small_incompressible_files(tmp_path: Path):
+    tree = tmp_path / "tree"
+    files = {
+        "random.bin": os.urandom(4096),
+        "text.txt": b"compressible " * 300,
+    }
+    _write_tree(tree, files)
+
+    out_path = tmp_path / "out.ankiaddon"
+    with PackageWriter(out_path) as writer:
+        writer.write_files((tree / name, name) for name in files)
+
+    with zipfile.ZipFile(out_path) as zf:
+        infos = {info.filename: info for info in zf.infolist()}
+
+    # Both files are below the trial size, so only full compression tells
+    assert infos["random.bin"].compress_type == zipfile.ZIP_STORED
+    assert infos["random.bin"].compress_size == len(files["random.bin"])
+    assert infos["text.txt"].compress_type == zipfile.ZIP_DEFLATED
+    assert _read_package(out_path) == files
+    assert writer.stats.files_stored == 1
+
+    # Without trial compression, everything but stored formats is deflated
+    policy = CompressionPolicy(trial_compression=False)
+    with PackageWriter(out_path, policy=policy) as writer:
+        writer.write_files((tree / name, name) for name in files)
+    assert writer.stats.files_deflated == 2
+
+
+def test_package_writer_reproducible(tmp_path: Path):
+    source_date = 1650000000
+    packages = []
+    for index, mtime in enumerate((1600000000, 1700000000)):
+        tree = tmp_path / "tree{}".format(index)
+        _write_tree(tree, _sample_files)
+        for path in tree.rglob("*"):
+            os.utime(path, (mtime, mtime))
+        (tree / "__init__.py").chmod(0o600 if index else 0o664)
+
+        out_path = tmp_path / "out{}.ankiaddon".format(index)
+        _package_tree(tree, out_path, ZipEntryStore(), source_date=source_date)
+        packages.append(out_path.read_bytes())
+
+    assert packages[0] == packages[1]
+
+    with zipfile.ZipFile(tmp_path / "out0.ankiaddon") as zf:
+        for info in zf.infolist():
+            assert info.date_time == (2022, 4, 15, 5, 20, 0)
+            assert info.external_attr >> 16 == 0o100644
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import os
+from pathlib import Path
+
+from aab.staging import METHOD_COPY, ContentStore, clone_file
+from aab.utils import make_private
+
+
+def test_clone_file_and_make_private(tmp_path: Path):
+    source = tmp_path / "source.txt"
+    source.write_text("shared", encoding="utf-8")
+    target = tmp_path / "target.txt"
+
+    method = clone_file(source, target)
+
+    assert target.read_text(encoding="utf-8") == "shared"
+    if method == METHOD_COPY or target.stat().st_nlink == 1:
+        assert make_private(target) is False
+        return
+
+    assert make_private(target) is True
+    assert target.stat().st_nlink == 1
+    target.write_text("modified", encoding="utf-8")
+    assert source.read_text(encoding="utf-8") == "shared"
+
+
+def test_content_store_prunes_unlinked_entries(tmp_path: Path):
+    store = ContentStore(tmp_path / "store")
+    store.max_size = 10
+
+    for key in ("aa01", "bb02"):
+        store.add(key, lambda f: f.write(b"123456789"), mode=0o644, mtime=0)
+
+    target = tmp_path / "dist" / "file"
+    target.parent.mkdir()
+    store.stage("bb02", target, mtime=100)
+    assert os.stat(target).st_mode & 0o777 == 0o644
+    assert os.stat(target).st_mtime == 100
+
+    store.prune()
+
+    assert store.get("aa01") is None
+    assert store.get("bb02") is not None
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import json
+from pathlib import Path
+
+from aab import tracing
+from aab.utils import call_shell
+
+
+def test_tracer_records_phases_and_subprocesses(tmp_path: Path):
+    tracer = tracing.start_tracing()
+    try:
+        with tracing.span("outer"):
+            call_shell("echo traced")
+        tracer.add_span(
+            "designer/dialog.ui (pyuic6)", tracing.CATEGORY_FORM, 0, 2_000_000
+        )
+    finally:
+        assert tracing.stop_tracing() is tracer
+
+    # Spans are no-ops once tracing has stopped
+    with tracing.span("untraced"):
+        pass
+
+    trace_path = tmp_path / "trace.json"
+    tracer.write(trace_path)
+    with trace_path.open(encoding="utf-8") as f:
+        events = json.load(f)["traceEvents"]
+
+    spans = {event["name"]: event for event in events if event["ph"] == "X"}
+    assert set(spans) == {"outer", "echo traced", "designer/dialog.ui (pyuic6)"}
+    assert spans["echo traced"]["cat"] == tracing.CATEGORY_SUBPROCESS
+    assert spans["echo traced"]["args"] == {"command": "echo traced"}
+    assert spans["outer"]["dur"] >= spans["echo traced"]["dur"]
+    assert spans["designer/dialog.ui (pyuic6)"]["dur"] == 2000
+
+    summary = tracer.summary()
+    assert "Slowest phases:" in summary
+    assert "0.002s  designer/dialog.ui (pyuic6)" in summary
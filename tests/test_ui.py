@@ -29,27 +29,18 @@
 #
 # Any modifications to this file must keep this entire header intact.
 
-import contextlib
 import os
 from pathlib import Path
 from shutil import copytree
-from typing import Union
 
+import pytest
+
+from aab.cache import FileCache
 from aab.config import Config
 from aab.ui import QtVersion, UIBuilder
 
 from . import SAMPLE_PROJECT_NAME, SAMPLE_PROJECT_ROOT, SAMPLE_PROJECTS_FOLDER
-from .util import list_files
-
-
-@contextlib.contextmanager
-def change_dir(path: Union[Path, str]):
-    current = os.getcwd()
-    os.chdir(str(path))
-    try:
-        yield
-    finally:
-        os.chdir(current)
+from .util import change_dir, list_files
 
 
 def test_ui_builder(tmp_path: Path):
@@ -153,3 +144,165 @@ gui/
     assert (
         list_files(gui_src_path) == expected_file_structure
     ), "Issue with GUI file structure"
+
+
+@pytest.mark.parametrize(
+    "builder_kwargs", [{"jobs": 2}, {"in_process": True}], ids=["workers", "in-process"]
+)
+def test_ui_builder_uic_api_matches_pyuic(tmp_path: Path, builder_kwargs: dict):
+    def build_forms(project_root: Path, **kwargs) -> Path:
+        copytree(SAMPLE_PROJECT_ROOT, project_root)
+        config = Config(project_root / "addon.json")
+        with change_dir(project_root):
+            ui_builder = UIBuilder(dist=project_root, config=config, **kwargs)
+            try:
+                assert ui_builder.build(QtVersion.qt5)
+                assert ui_builder.build(QtVersion.qt6)
+            finally:
+                ui_builder.close()
+        return project_root / "src" / "sample_project" / "gui" / "forms"
+
+    pyuic_forms_path = build_forms(tmp_path / "pyuic" / SAMPLE_PROJECT_NAME)
+    api_forms_path = build_forms(
+        tmp_path / "api" / SAMPLE_PROJECT_NAME, **builder_kwargs
+    )
+
+    for relative_path in (
+        Path("qt5") / "__init__.py",
+        Path("qt5") / "dialog.py",
+        Path("qt6") / "__init__.py",
+        Path("qt6") / "dialog.py",
+    ):
+        expected = (pyuic_forms_path / relative_path).read_text(encoding="utf-8")
+        actual = (api_forms_path / relative_path).read_text(encoding="utf-8")
+        assert expected == actual, f"{relative_path} differs between build modes"
+
+
+def test_ui_builder_incremental(tmp_path: Path):
+    test_project_root = tmp_path / SAMPLE_PROJECT_NAME
+    copytree(SAMPLE_PROJECT_ROOT, test_project_root)
+
+    designer_path = test_project_root / "designer"
+    forms_path = test_project_root / "src" / "sample_project" / "gui" / "forms" / "qt5"
+
+    config = Config(test_project_root / "addon.json")
+
+    with change_dir(test_project_root):
+        ui_builder = UIBuilder(dist=test_project_root, config=config)
+
+        def build_and_stat():
+            assert ui_builder.build(QtVersion.qt5)
+            return {
+                path.name: path.stat().st_mtime_ns for path in forms_path.glob("*.py")
+            }
+
+        initial = build_and_stat()
+        assert build_and_stat() == initial, "Up-to-date forms were rebuilt"
+
+        (designer_path / "dialog.ui").touch()
+        assert build_and_stat() == initial, "Forms with unchanged content rebuilt"
+
+        (designer_path / "other.ui").write_bytes(
+            (designer_path / "dialog.ui").read_bytes()
+        )
+        added = build_and_stat()
+        assert added["dialog.py"] == initial["dialog.py"]
+        assert "other.py" in added
+        assert "from . import other" in (forms_path / "__init__.py").read_text()
+
+        (designer_path / "other.ui").unlink()
+        removed = build_and_stat()
+        assert removed.keys() == initial.keys()
+        assert removed["dialog.py"] == initial["dialog.py"]
+        assert "other" not in (forms_path / "__init__.py").read_text()
+
+
+def test_ui_builder_rewrites_resources_init_on_prefix_change(tmp_path: Path):
+    test_project_root = tmp_path / SAMPLE_PROJECT_NAME
+    copytree(SAMPLE_PROJECT_ROOT, test_project_root)
+
+    qrc_path = test_project_root / "resources" / "icons.qrc"
+    init_path = (
+        test_project_root
+        / "src"
+        / "sample_project"
+        / "gui"
+        / "resources"
+        / "__init__.py"
+    )
+
+    config = Config(test_project_root / "addon.json")
+
+    with change_dir(test_project_root):
+        ui_builder = UIBuilder(dist=test_project_root, config=config)
+
+        assert ui_builder.build(QtVersion.qt6)
+        os.utime(init_path, ns=(0, 0))
+
+        (test_project_root / "resources" / "icons" / "help.svg").touch()
+        assert ui_builder.build(QtVersion.qt6)
+        assert init_path.stat().st_mtime_ns == 0, "Unchanged prefixes rewritten"
+
+        qrc_path.write_text(
+            qrc_path.read_text().replace("/sample-project", "/renamed-project")
+        )
+        assert ui_builder.build(QtVersion.qt6)
+        assert init_path.stat().st_mtime_ns != 0, "Changed prefixes not written"
+        assert '"renamed-project"' in init_path.read_text()
+        assert '"sample-project"' not in init_path.read_text()
+
+
+def test_ui_builder_form_cache(tmp_path: Path):
+    form_cache = FileCache(tmp_path / "cache")
+
+    def build_forms(project_root: Path) -> Path:
+        copytree(SAMPLE_PROJECT_ROOT, project_root)
+        config = Config(project_root / "addon.json")
+        with change_dir(project_root):
+            ui_builder = UIBuilder(
+                dist=project_root, config=config, form_cache=form_cache
+            )
+            assert ui_builder.build(QtVersion.qt6)
+        return project_root / "src" / "sample_project" / "gui" / "forms" / "qt6"
+
+    first_forms_path = build_forms(tmp_path / "first" / SAMPLE_PROJECT_NAME)
+    assert list(form_cache.path.glob("*/*")), "Form not stored in cache"
+
+    # Poison the cache entry to confirm the second build restores from it
+    for entry in form_cache.path.glob("*/*"):
+        entry.write_text("# cached\n", encoding="utf-8")
+
+    second_forms_path = build_forms(tmp_path / "second" / SAMPLE_PROJECT_NAME)
+
+    assert (first_forms_path / "dialog.py").read_text().startswith("# Form")
+    assert (second_forms_path / "dialog.py").read_text() == "# cached\n"
+
+
+def test_ui_builder_build_targets(tmp_path: Path):
+    test_project_root = tmp_path / SAMPLE_PROJECT_NAME
+    copytree(SAMPLE_PROJECT_ROOT, test_project_root)
+
+    forms_path = test_project_root / "src" / "sample_project" / "gui" / "forms"
+
+    config = Config(test_project_root / "addon.json")
+
+    with change_dir(test_project_root):
+        ui_builder = UIBuilder(dist=test_project_root, config=config)
+        migrate_resources = ui_builder._migrate_resources
+        migration_calls = []
+
+        def _migrate_resources():
+            migration_calls.append(True)
+            return migrate_resources()
+
+        ui_builder._migrate_resources = _migrate_resources  # type: ignore
+
+        assert ui_builder.build_targets([QtVersion.qt5, QtVersion.qt6]) is True
+
+    assert len(migration_calls) == 1, "Resources should only be migrated once"
+
+    for qt_version in ("qt5", "qt6"):
+        form_contents = (forms_path / qt_version / "dialog.py").read_text()
+        assert '"sample-project:icons/help.svg"' in form_contents
+
+    assert "from .qt6 import *" in (forms_path / "__init__.py").read_text()
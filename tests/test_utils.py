@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+from pathlib import Path
+
+from aab.utils import purge, remove_tree_in_background
+
+
+def test_purge(tmp_path: Path):
+    files = [
+        "module.py",
+        "module.pyc",
+        "__pycache__/module.cpython-38.pyc",
+        "sub/other.pyo",
+        "sub/other.py",
+        ".git/objects/keep.pyc",
+        "venv/lib/keep.pyc",
+    ]
+    for file in files:
+        (tmp_path / file).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / file).touch()
+
+    deleted = purge(
+        tmp_path,
+        ["*.pyc", "*.pyo", "__pycache__"],
+        recursive=True,
+        exclude=[tmp_path / "venv"],
+    )
+
+    assert deleted == 3
+    assert sorted(
+        path.relative_to(tmp_path).as_posix()
+        for path in tmp_path.rglob("*")
+        if path.is_file()
+    ) == [".git/objects/keep.pyc", "module.py", "sub/other.py", "venv/lib/keep.pyc"]
+
+
+def test_remove_tree_in_background(tmp_path: Path):
+    trash_path = tmp_path / "trash"
+    leftover = trash_path / "dist-interrupted"
+    (leftover / "nested").mkdir(parents=True)
+    dist_path = tmp_path / "dist"
+    (dist_path / "src").mkdir(parents=True)
+    (dist_path / "src" / "file.txt").write_text("content")
+
+    thread = remove_tree_in_background(dist_path, trash_path)
+
+    # moved out of the way right away
+    assert not dist_path.exists()
+    assert thread is not None
+    thread.join()
+    assert list(trash_path.iterdir()) == []
+
+    assert remove_tree_in_background(dist_path, trash_path) is None
+    assert list(trash_path.iterdir()) == []
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Anki Add-on Builder
+#
+# Copyright (C)  2016-2022 Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+import json
+from pathlib import Path
+from shutil import copytree
+
+import pytest
+
+from aab import watch
+from aab.ui import QtVersion
+from aab.watch import InotifyWatcher, PollingWatcher, ProjectWatcher
+
+from . import SAMPLE_PROJECT_NAME, SAMPLE_PROJECT_ROOT
+from .util import change_dir, init_git_repo
+
+
+@pytest.mark.parametrize(
+    "watcher_class",
+    [
+        PollingWatcher,
+        pytest.param(
+            InotifyWatcher,
+            marks=pytest.mark.skipif(
+                not InotifyWatcher.is_supported(), reason="requires inotify"
+            ),
+        ),
+    ],
+)
+def test_watcher_reports_changes(tmp_path: Path, watcher_class):
+    designer_path = tmp_path / "designer"
+    designer_path.mkdir()
+    (designer_path / "dialog.ui").write_text("<ui/>", encoding="utf-8")
+
+    watcher = watcher_class(tmp_path, [designer_path, tmp_path / "resources"])
+    try:
+        assert watcher.wait(0.05) == set()
+
+        (designer_path / "dialog.ui").write_text("<ui></ui>", encoding="utf-8")
+        (tmp_path / "addon.json").write_text("{}", encoding="utf-8")
+        (tmp_path / "resources" / "icons").mkdir(parents=True)
+        (tmp_path / "resources" / "icons" / "icon.svg").write_text("<svg/>")
+
+        changes = set()
+        for _ in range(10):
+            changes |= watcher.wait(0.3)
+            if len(changes) == 3:
+                break
+
+        assert changes == {
+            designer_path / "dialog.ui",
+            tmp_path / "addon.json",
+            tmp_path / "resources" / "icons" / "icon.svg",
+        }
+    finally:
+        watcher.close()
+
+
+def test_create_watcher_polls_without_inotify(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(watch, "_load_libc", lambda: None)
+
+    with pytest.raises(OSError):
+        InotifyWatcher(tmp_path, [tmp_path])
+
+    watcher = watch.create_watcher(tmp_path, [tmp_path])
+    assert isinstance(watcher, PollingWatcher)
+
+
+def test_project_watcher_rebuilds_affected_files(tmp_path: Path):
+    project_root = tmp_path / SAMPLE_PROJECT_NAME
+    copytree(SAMPLE_PROJECT_ROOT, project_root)
+    (project_root / "src" / "sample_project").mkdir(parents=True)
+    init_git_repo(project_root)
+
+    module_path = project_root / "src" / "sample_project"
+    form_path = module_path / "gui" / "forms" / "qt6" / "dialog.py"
+
+    with change_dir(project_root):
+        watcher = ProjectWatcher(
+            root=project_root, qt_versions=[QtVersion.qt6], version="v1.0.0"
+        )
+        try:
+            watcher.rebuild({project_root / "addon.json"})
+
+            with (module_path / "manifest.json").open(encoding="utf-8") as f:
+                assert json.load(f)["version"] == "v1.0.0"
+            assert form_path.exists()
+            assert (module_path / "gui" / "resources" / "__init__.py").exists()
+
+            # Unrelated changes are ignored
+            (module_path / "manifest.json").unlink()
+            watcher.rebuild({project_root / "README.md"})
+            assert not (module_path / "manifest.json").exists()
+
+            form_source = project_root / "designer" / "dialog.ui"
+            form_source.write_text(
+                form_source.read_text(encoding="utf-8").replace(
+                    "<string>Dialog</string>", "<string>Watched</string>"
+                ),
+                encoding="utf-8",
+            )
+            watcher.rebuild({form_source})
+
+            assert "Watched" in form_path.read_text(encoding="utf-8")
+            # Only addon.json changes rewrite the manifest
+            assert not (module_path / "manifest.json").exists()
+        finally:
+            watcher.close()
+
+
+def test_project_watcher_survives_broken_files(tmp_path: Path):
+    project_root = tmp_path / SAMPLE_PROJECT_NAME
+    copytree(SAMPLE_PROJECT_ROOT, project_root)
+    (project_root / "src" / "sample_project").mkdir(parents=True)
+    init_git_repo(project_root)
+
+    form_path = project_root / "src" / "sample_project" / "gui" / "forms" / "qt6"
+    form_path = form_path / "dialog.py"
+    form_source = project_root / "designer" / "dialog.ui"
+    config_path = project_root / "addon.json"
+    original_form = form_source.read_text(encoding="utf-8")
+
+    with change_dir(project_root):
+        watcher = ProjectWatcher(
+            root=project_root, qt_versions=[QtVersion.qt6], version="v1.0.0"
+        )
+        try:
+            assert watcher.rebuild({config_path})
+
+            form_source.write_text(original_form[:200], encoding="utf-8")
+            assert not watcher.rebuild({form_source})
+
+            original_config = config_path.read_text(encoding="utf-8")
+            config_path.write_text(original_config[:20], encoding="utf-8")
+            assert not watcher.rebuild({config_path})
+
+            config_path.write_text(original_config, encoding="utf-8")
+            form_source.write_text(
+                original_form.replace(
+                    "<string>Dialog</string>", "<string>Fixed</string>"
+                ),
+                encoding="utf-8",
+            )
+            assert watcher.rebuild({form_source})
+            assert "Fixed" in form_path.read_text(encoding="utf-8")
+        finally:
+            watcher.close()
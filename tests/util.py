@@ -30,8 +30,11 @@
 # Any modifications to this file must keep this entire header intact.
 
 
+import contextlib
 import os
+import subprocess
 from pathlib import Path
+from typing import Union
 
 
 def list_files(startpath: Path):
@@ -48,3 +51,31 @@ def list_files(startpath: Path):
             ret.append("{}{}".format(subindent, f))
 
     return "\n".join(ret)
+
+
+@contextlib.contextmanager
+def change_dir(path: Union[Path, str]):
+    current = os.getcwd()
+    os.chdir(str(path))
+    try:
+        yield
+    finally:
+        os.chdir(current)
+
+
+def init_git_repo(path: Path, tag: str = "v1.0.0"):
+    """Turns path into a git repository with a single tagged commit"""
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME="aab",
+        GIT_AUTHOR_EMAIL="aab@example.com",
+        GIT_COMMITTER_NAME="aab",
+        GIT_COMMITTER_EMAIL="aab@example.com",
+    )
+    for cmd in (
+        ["git", "init", "-q", "."],
+        ["git", "add", "-A"],
+        ["git", "commit", "-q", "-m", "Initial commit"],
+        ["git", "tag", tag],
+    ):
+        subprocess.run(cmd, cwd=str(path), env=env, check=True)